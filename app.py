@@ -1,16 +1,22 @@
-from RealtimeSTT import AudioToTextRecorder
+import time
+STARTUP_STARTED = time.monotonic()
+
 import pyaudiowpatch as pyaudio
 from queue import Queue
-import numpy as np
-import samplerate
 import threading
+import argparse
 import wave
-import time
-import time
 import os
 
-from chat_history import MESSAGE_TYPE, ROLE
-from textual_ui import *
+from chat_history import ROLE
+import latency
+from startup import Startup, COMPONENT_STATUS
+from session_store import SessionJournal, load_session, latest_session_name
+from search_index import SEARCH_INDEX_FILE
+from transcription import recorder_config, make_recorder_config, poll_recorder, realtime_transcription, TARGET_RATE, MESSAGE_QUEUE_SIZE, END_OF_UTTERANCE_SILENCE, SHARE_TRANSCRIPTION_MODELS, ADAPTIVE_REALTIME_PAUSE
+from scheduler import RealtimeScheduler
+# RealTimeSTT (which pulls in torch), the audio capture (numpy, samplerate) and the UI (textual)
+#   are imported where they're first needed, on the startup threads
 
 # Required for resampling speaker audio
 #   as realtimeSST requires specifically 16khz sound
@@ -19,32 +25,20 @@ SPEAKER_RATE = 16000
 SPEAKER_CHANNELS = 1
 MIC_RATE = 16000
 MIC_CHANNELS = 1
-resampler = samplerate.Resampler(converter_type='sinc_fastest')
-TARGET_RATE = 16000
-
-VOICETOTEXT_MODEL_REALTIME = 'tiny'
-VOICETOTEXT_MODEL = 'base'
-VOICETOTEXT_LANGUAGE = 'en'
 
 speaker_recorder = None  
 mic_recorder = None  
+speaker_capture = None
 
-message_queue = Queue()
+message_queue = Queue(maxsize=MESSAGE_QUEUE_SIZE)
+scheduler = RealtimeScheduler(message_queue, recorder_config['realtime_processing_pause']) if ADAPTIVE_REALTIME_PAUSE else None
 
 def realtime_transcription_speaker(text):
-    message_queue.put({
-        "role": ROLE.USER, 
-        "transcription_type": MESSAGE_TYPE.REALTIME, 
-        "content": text
-    })
+    realtime_transcription(text, ROLE.USER, message_queue, speaker_recorder.recording_start_time)
     
 
 def realtime_transcription_mic(text):
-    message_queue.put({
-        "role": ROLE.ASSISTANT, 
-        "transcription_type": MESSAGE_TYPE.REALTIME, 
-        "content": text
-    })
+    realtime_transcription(text, ROLE.ASSISTANT, message_queue, mic_recorder.recording_start_time)
 
 
 def write_chunk_to_file(data, rate, channels=1, out_file_name='qqqq.wav'):
@@ -58,21 +52,10 @@ def write_chunk_to_file(data, rate, channels=1, out_file_name='qqqq.wav'):
 
 def record_audio_speaker(in_data, frame_count, time_info, status):
     """
-        Resamples buffer to TARGET_RATE and feeds it to RealTimeSST
+        PortAudio callback. Only hands the raw frames over to the capture ring buffer,
+        the resampling and feeding to RealTimeSST happen on the capture worker thread
     """
-    global speaker_recorder
-    audio_np = np.frombuffer(in_data, dtype=np.int16)
-    
-    if SPEAKER_CHANNELS > 1:
-        audio_np = np.reshape(audio_np, (-1, SPEAKER_CHANNELS))
-        audio_np = audio_np[:, 0]
-
-    audio_np = audio_np.astype(np.float32) / 32768.0
-    resampled = resampler.process(audio_np, TARGET_RATE / SPEAKER_RATE)
-    audio_np = (resampled * 32768.0).astype(np.int16).tobytes()
-
-    speaker_recorder.feed_audio(audio_np, original_sample_rate=16000)
-        
+    speaker_capture.push(in_data)
     return (in_data, pyaudio.paContinue)
 
 # def record_audio_mic(in_data, frame_count, time_info, status):
@@ -98,7 +81,9 @@ def get_default_speaker(p):
         Gets device id (and the sample rate and number of channels)
         of the speaker that is currently set to system default.
     """
-    global SPEAKER_RATE, SPEAKER_CHANNELS
+    global SPEAKER_RATE, SPEAKER_CHANNELS, speaker_capture
+    from audio_capture import SpeakerCapture
+
     try:
         # Get default WASAPI info
         wasapi_info = p.get_host_api_info_by_type(pyaudio.paWASAPI)
@@ -122,6 +107,11 @@ def get_default_speaker(p):
     SPEAKER_RATE = int(default_speakers["defaultSampleRate"])
     SPEAKER_CHANNELS = default_speakers["maxInputChannels"]
 
+    speaker_capture = SpeakerCapture(speaker_recorder, SPEAKER_RATE, SPEAKER_CHANNELS, TARGET_RATE, CHUNK, END_OF_UTTERANCE_SILENCE)
+    if latency.profiler is not None:
+        speaker_capture.clock = latency.profiler.clock(ROLE.USER)
+    speaker_capture.start()
+
     speakers_stream = p.open(
         format=pyaudio.paInt16,
         channels=SPEAKER_CHANNELS,
@@ -135,112 +125,158 @@ def get_default_speaker(p):
     return speakers_stream
 
 
-# Configuration for RealTimeSST
-recorder_config = {
-    'spinner': False,
-    'model': VOICETOTEXT_MODEL, # or large-v2 or deepdml/faster-whisper-large-v3-turbo-ct2 or ...
-    'download_root': '.', # default download root location. Ex. ~/.cache/huggingface/hub/ in Linux
-    'realtime_model_type': VOICETOTEXT_MODEL_REALTIME, # or small.en or distil-small.en or ...
-    'language': VOICETOTEXT_LANGUAGE,
-    'silero_sensitivity': 0.05,
-    'webrtc_sensitivity': 3,
-    'post_speech_silence_duration': 1,
-    'min_length_of_recording': 1.1,        
-    'min_gap_between_recordings': 0,                
-    'enable_realtime_transcription': True,
-    'realtime_processing_pause': 1,
-    'silero_deactivity_detection': True,
-    'early_transcription_on_silence': 0,
-    'beam_size': 5,
-    'beam_size_realtime': 3,
-    'batch_size': 0,
-    'realtime_batch_size': 0,        
-    'no_log_file': True,
-    'initial_prompt_realtime': (
-        "End incomplete sentences with ellipses.\n"
-        "Examples:\n"
-        "Complete: The sky is blue.\n"
-        "Incomplete: When the sky...\n"
-        "Complete: She walked home.\n"
-        "Incomplete: Because he...\n"
-    ),
-    'silero_use_onnx': True,
-    'use_microphone': False,
-    'faster_whisper_vad_filter': False,
-    # 'level': logging.DEBUG
-}
-
 def poll_speaker_recorder(r):
     """
         This will poll the RealTimeSST service (the one responsible for the speaker)
         for new (final, non-realtime) messages and put them into the queue
     """
-    while True:
-        # time.sleep(0.1)
-        text = r.text()
-        message_queue.put({
-            "role": ROLE.USER, 
-            "transcription_type": MESSAGE_TYPE.FINAL, 
-            "content": text
-        })
-
-def speaker_simulate_noise(r):
-    # The recorder will not spit out the final result until the buffer is full.
-    # so we force it full with empty audio.
-    silent_buffer = (b'\x00\x00') * 1024
-    while True:
-        r.feed_audio(silent_buffer, original_sample_rate=16000)
-        time.sleep(0.3)
-
+    poll_recorder(r, ROLE.USER, message_queue)
 
 def poll_mic_recorder(r):
     """
         This will poll the RealTimeSST service (the one responsible for the mic)
         for new (final, non-realtime) messages and put them into the queue
     """
-    while True:
-        # time.sleep(0.1)
-        text = r.text()
-        message_queue.put({
-            "role": ROLE.ASSISTANT, 
-            "transcription_type": MESSAGE_TYPE.FINAL, 
-            "content": text
-        })
-
+    poll_recorder(r, ROLE.ASSISTANT, message_queue)
 
-def main():
-    global speaker_recorder, mic_recorder
-    p = pyaudio.PyAudio()
 
-    speaker_recorder_config = recorder_config.copy()
-    speaker_recorder_config['on_realtime_transcription_stabilized'] = realtime_transcription_speaker
-    speaker_recorder = AudioToTextRecorder(**speaker_recorder_config) 
+def load_shared_engine():
+    from shared_engine import SharedTranscriptionEngine
+    return SharedTranscriptionEngine(recorder_config)
 
-    mic_recorder_config = recorder_config.copy()
-    mic_recorder_config['on_realtime_transcription_stabilized'] = realtime_transcription_mic
-    mic_recorder_config['use_microphone'] = True
-    mic_recorder = AudioToTextRecorder(**mic_recorder_config) 
 
+def load_speaker(p, startup: Startup):
+    """
+        Loads the speaker recorder, then starts capturing the speakers and polling for final messages
+    """
+    global speaker_recorder
+    from RealtimeSTT import AudioToTextRecorder
+
+    shared_engine = startup.result('whisper') if 'whisper' in startup else None
+    overrides = {}
+    if latency.profiler is not None:
+        # The capture marks the audio stages of voiced audio, the recorder tells where an utterance ends
+        overrides['on_recording_stop'] = lambda: latency.end_utterance(ROLE.USER)
+    if scheduler is not None and shared_engine is not None:
+        overrides['realtime_transcription_executor'] = scheduler.timed(ROLE.USER, shared_engine.realtime)
+    speaker_recorder = AudioToTextRecorder(**make_recorder_config(realtime_transcription_speaker, shared_engine, **overrides))
+    if scheduler is not None:
+        scheduler.add(ROLE.USER, speaker_recorder)
     speakers_stream = get_default_speaker(p)
-    print("🔴 Listening to the speakers")
 
     speaker_record_thread = threading.Thread(target=poll_speaker_recorder, args=[speaker_recorder], daemon=True)
     speaker_record_thread.start()
-    speaker_noise_thread = threading.Thread(target=speaker_simulate_noise, args=[speaker_recorder], daemon=True)
-    speaker_noise_thread.start()
+    return speakers_stream
+
+
+def mark_mic_capture(chunk: bytes) -> None:
+    """
+        Marks the mic's capture stage for voiced chunks only, so a FINAL is timed from the end of the speech
+        and not from the silence the recorder needed to end the utterance
+    """
+    import numpy as np
+    from audio_capture import VOICE_RMS_THRESHOLD
+
+    samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+    if len(samples) and np.dot(samples, samples) / len(samples) > (VOICE_RMS_THRESHOLD * 32768.0) ** 2:
+        latency.mark_audio(ROLE.ASSISTANT, 'capture')
+
+
+def load_mic(startup: Startup):
+    """
+        Loads the mic recorder (it opens the microphone itself) and starts polling it for final messages
+    """
+    global mic_recorder
+    from RealtimeSTT import AudioToTextRecorder
+
+    shared_engine = startup.result('whisper') if 'whisper' in startup else None
+    overrides = {'use_microphone': True}
+    if latency.profiler is not None:
+        # The mic recorder reads the microphone itself, this is the closest thing to a capture callback
+        overrides['on_recorded_chunk'] = mark_mic_capture
+        overrides['on_recording_stop'] = lambda: latency.end_utterance(ROLE.ASSISTANT)
+    if scheduler is not None and shared_engine is not None:
+        overrides['realtime_transcription_executor'] = scheduler.timed(ROLE.ASSISTANT, shared_engine.realtime)
+    mic_recorder = AudioToTextRecorder(**make_recorder_config(realtime_transcription_mic, shared_engine, **overrides))
+    if scheduler is not None:
+        scheduler.add(ROLE.ASSISTANT, mic_recorder)
 
     mic_record_thread = threading.Thread(target=poll_mic_recorder, args=[mic_recorder], daemon=True)
     mic_record_thread.start()
+    return mic_recorder
+
+
+def main(startup: Startup):
+    """
+        Starts loading the recorders in the background, each one becomes usable as soon as it's loaded
+        (their progress shows up in the UI header)
+    """
+    p = pyaudio.PyAudio()
 
-    return (speakers_stream, speaker_recorder, mic_recorder)
+    after = ()
+    if SHARE_TRANSCRIPTION_MODELS:
+        startup.start('whisper', load_shared_engine)
+        after = ('whisper',)
+    startup.start('speaker', load_speaker, p, startup, after=after)
+    startup.start('mic', load_mic, startup, after=after)
+    if scheduler is not None:
+        scheduler.start()
 
 
 if __name__ == '__main__':
-    speakers_stream, speaker_recorder, mic_recorder = main()
-    app = ChatApp(message_queue)
+    parser = argparse.ArgumentParser(description="Interview Assistant")
+    parser.add_argument('--profile', nargs='?', const='latency_profile.json', metavar='JSON',
+                        help="Measure the latency of every stage, show it in the UI and write it to JSON (default latency_profile.json) at exit")
+    parser.add_argument('--resume', nargs='?', const='', metavar='SESSION',
+                        help="Continue a saved session (default: the latest one in sessions/)")
+    parser.add_argument('--no-journal', action='store_true', help="Don't save the session to disk")
+    args = parser.parse_args()
+    if args.profile:
+        latency.enable()
+
+    session_started = time.monotonic()
+    journal, session = None, None
+    if args.resume is not None:
+        session_name = args.resume or latest_session_name()
+        if session_name is None:
+            exit("No saved session to resume")
+        session = load_session(session_name)
+    if not args.no_journal:
+        journal = SessionJournal(session_name if session is not None else None)
+
+    startup = Startup(STARTUP_STARTED)
+    startup.record('imports', STARTUP_STARTED, session_started)
+    startup.record('session', session_started)
+    main(startup)
+
+    # The UI shows up (and the LLM provider is checked) while the models are still loading
+    ui_imports_started = time.monotonic()
+    from textual_ui import ChatApp
+    from llm_config import load_llm
+    startup.record('ui imports', ui_imports_started)
+    startup.start('llm', load_llm)
+
+    app = ChatApp(message_queue, startup, journal, session)
     app.run()
+    print(startup.report())
+    if scheduler is not None:
+        print(scheduler.report())
+    if startup.status('llm') is COMPONENT_STATUS.READY:
+        llm = startup.result('llm')
+        if hasattr(llm, 'cache'):
+            print(llm.cache.report())
+        if hasattr(llm, 'backends'):
+            print(llm.report())
+    if journal is not None:
+        journal.close()
+        if journal.exists:
+            app._chat_history.search_index.save(os.path.join(journal.path, SEARCH_INDEX_FILE))
+            print("Session saved to " + journal.path)
+    if latency.profiler is not None:
+        latency.profiler.dump(args.profile)
+        print("Latency profile written to " + args.profile)
     # speaker_recorder.shutdown()
     # speakers_stream.stop_stream()
     # speakers_stream.close()
     # mic_recorder.shutdown()
-    exit()
\ No newline at end of file
+    exit()
@@ -0,0 +1,304 @@
+from collections import deque
+import numpy as np
+import samplerate
+import threading
+import time
+import wave
+
+# How much raw audio the ring buffer can hold before the callback starts
+#   dropping blocks (an overrun). Whisper stalls are usually well below this.
+RING_SECONDS = 4
+# The worker accumulates at least this much resampled audio before
+#   handing it over to RealTimeSTT
+FEED_BATCH_SECONDS = 0.1
+# How long the worker sleeps when the ring buffer is empty
+WORKER_POLL_INTERVAL = 0.01
+# RMS level (of the resampled audio, full scale = 1) above which a block counts as speech
+VOICE_RMS_THRESHOLD = 0.01
+# Trailing silence is fed in blocks of this length, paced in real time
+#   (RealTimeSTT measures the post speech silence on the wall clock)
+SILENCE_BLOCK_SECONDS = 0.1
+
+
+class RingBuffer:
+    """
+        Preallocated single-producer / single-consumer ring buffer of int16 samples.
+        The producer (the PortAudio callback) only ever moves the write position
+        and the consumer (the worker thread) only ever moves the read position,
+        so no lock is needed between the two.
+    """
+    def __init__(self, capacity: int):
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        self._capacity = capacity
+        # Both positions grow monotonically, the index into the buffer is pos % capacity
+        self._write_pos = 0
+        self._read_pos = 0
+        self.overruns = 0
+        # Reads that found nothing: an idle worker polls an empty buffer all the time, so this is no sign of starvation
+        self.empty_polls = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    def write(self, data) -> bool:
+        """
+            Copies a block of raw int16 samples into the buffer.
+            If the block doesn't fit, it is dropped as a whole and counted as an overrun
+            (the callback must never wait for the consumer).
+        """
+        samples = np.frombuffer(data, dtype=np.int16)
+        n = len(samples)
+        if n > self._capacity - (self._write_pos - self._read_pos):
+            self.overruns += 1
+            return False
+
+        start = self._write_pos % self._capacity
+        first = min(n, self._capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        if first < n:
+            self._buffer[:n - first] = samples[first:]
+
+        # Publish only after the data is in place
+        self._write_pos += n
+        return True
+
+    def read_into(self, out: np.ndarray, multiple_of: int = 1) -> int:
+        """
+            Moves up to len(out) samples into `out` and returns how many were moved.
+            The amount is rounded down to `multiple_of` so that interleaved frames are never split.
+            An empty read is counted in `empty_polls`.
+        """
+        n = min(len(out), self._write_pos - self._read_pos)
+        n -= n % multiple_of
+        if n <= 0:
+            self.empty_polls += 1
+            return 0
+
+        start = self._read_pos % self._capacity
+        first = min(n, self._capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        if first < n:
+            out[first:n] = self._buffer[:n - first]
+
+        self._read_pos += n
+        return n
+
+
+class SpeakerCapture:
+    """
+        Decouples the audio callback from the transcription.
+        `push` is meant to be called from the PortAudio callback and only copies the raw frames
+        into a ring buffer. A worker thread takes them out, keeps the first channel,
+        resamples to `target_rate` into preallocated buffers and feeds the recorder in batches.
+
+        Loopback devices stop delivering audio when nothing is playing, which would leave
+        the recorder waiting for the end of the last utterance forever. With `end_of_utterance_silence`
+        set, once the stream goes quiet after speech, the worker feeds (in real time) just enough silence
+        for the recorder's VAD to close the utterance, minus the quiet audio it has already received.
+    """
+    def __init__(self, recorder, rate: int, channels: int, target_rate: int = 16000, block_frames: int = 1024,
+                 end_of_utterance_silence: float = None):
+        self.recorder = recorder
+        self.rate = rate
+        self.channels = channels
+        self.target_rate = target_rate
+        self.ratio = target_rate / rate
+
+        self.ring = RingBuffer(max(int(rate * RING_SECONDS), block_frames * 4) * channels)
+
+        # Scratch buffers reused by the worker for every block
+        self._raw = np.empty(block_frames * channels, dtype=np.int16)
+        self._mono = np.empty(block_frames, dtype=np.float32)
+        self._batch_samples = int(target_rate * FEED_BATCH_SECONDS)
+        # Room for one full batch plus one resampled block (and some slack for the resampler)
+        self._out = np.empty(self._batch_samples + int(block_frames * self.ratio) + 64, dtype=np.int16)
+        self._out_len = 0
+
+        self._resampler = samplerate.Resampler(converter_type='sinc_fastest', channels=1)
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.end_of_utterance_silence = end_of_utterance_silence
+        # The stream counts as quiet when no audio arrived for two callback periods
+        self._quiet_after = max(2 * block_frames / rate, 0.05)
+        self._silence_block = bytes(2 * int(target_rate * SILENCE_BLOCK_SECONDS))
+        # Speech was fed and the recorder hasn't been given the silence to end it yet
+        self._utterance_open = False
+        # Seconds of quiet audio fed since the last voiced block
+        self._quiet_fed = 0.0
+        self._last_audio_at = 0.0
+        self._next_silence_at = None
+
+        # latency.StageClock of this capture's role, marked at the feeds of voiced audio when profiling
+        self.clock = None
+        # (frames captured after a push, when it was captured) for the pushes the worker hasn't read yet,
+        #   so the capture time travels with the audio through the ring buffer (only kept when profiling)
+        self._push_times = deque(maxlen=max(int(rate * RING_SECONDS) // block_frames, 4) * 2)
+        self._frames_read = 0
+        # When the newest voiced block of the batch being built was captured
+        self._voiced_captured_at = None
+
+        self.frames_captured = 0
+        self.samples_fed = 0
+        self.batches_fed = 0
+        self.utterances_closed = 0
+        self.silence_blocks_fed = 0
+
+    def push(self, in_data) -> None:
+        """
+            Called from the audio callback. Does nothing but copy the frames.
+        """
+        if self.ring.write(in_data):
+            self.frames_captured += len(in_data) // (2 * self.channels)
+            if self.clock is not None:
+                self._push_times.append((self.frames_captured, time.monotonic()))
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._flush()
+
+    def stats(self) -> dict:
+        return {
+            "overruns": self.ring.overruns,
+            "empty_polls": self.ring.empty_polls,
+            "frames_captured": self.frames_captured,
+            "samples_fed": self.samples_fed,
+            "batches_fed": self.batches_fed,
+            "utterances_closed": self.utterances_closed,
+            "silence_blocks_fed": self.silence_blocks_fed,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            n = self.ring.read_into(self._raw, multiple_of=self.channels)
+            if n == 0:
+                # Nothing is coming in right now, don't keep what we have waiting
+                self._flush()
+                if self._utterance_open and self.end_of_utterance_silence:
+                    self._end_utterance()
+                time.sleep(WORKER_POLL_INTERVAL)
+                continue
+            self._next_silence_at = None
+            self._last_audio_at = time.monotonic()
+            self._process(self._raw[:n], self._captured_at(n // self.channels))
+
+    def _captured_at(self, frames: int) -> float:
+        """
+            When the newest of the `frames` just read was captured (None when not profiling)
+        """
+        self._frames_read += frames
+        captured_at = None
+        while self._push_times and self._push_times[0][0] <= self._frames_read:
+            captured_at = self._push_times.popleft()[1]
+        if captured_at is None and self._push_times:
+            # The read ended inside a push's frames
+            captured_at = self._push_times[0][1]
+        return captured_at
+
+    def _end_utterance(self) -> None:
+        """
+            Feeds the next block of trailing silence once the stream has been quiet for long enough
+        """
+        now = time.monotonic()
+        if self._next_silence_at is None:
+            if now - self._last_audio_at < self._quiet_after:
+                return
+            self._next_silence_at = now
+        if now < self._next_silence_at:
+            return
+
+        if self._quiet_fed >= self.end_of_utterance_silence:
+            self._utterance_open = False
+            self._next_silence_at = None
+            self.utterances_closed += 1
+            return
+
+        self.recorder.feed_audio(self._silence_block, original_sample_rate=self.target_rate)
+        self.silence_blocks_fed += 1
+        self._quiet_fed += SILENCE_BLOCK_SECONDS
+        self._next_silence_at += SILENCE_BLOCK_SECONDS
+
+    def _process(self, raw: np.ndarray, captured_at: float = None) -> None:
+        frames = len(raw) // self.channels
+        mono = self._mono[:frames]
+        if self.channels > 1:
+            first_channel = raw.reshape(-1, self.channels)[:, 0]
+        else:
+            first_channel = raw
+        np.multiply(first_channel, 1 / 32768.0, out=mono, casting='unsafe')
+
+        if self.ratio != 1:
+            resampled = self._resampler.process(mono, self.ratio)
+        else:
+            resampled = mono
+        n = len(resampled)
+        if n and np.dot(resampled, resampled) / n > VOICE_RMS_THRESHOLD ** 2:
+            self._utterance_open = True
+            self._quiet_fed = 0.0
+            if captured_at is not None:
+                self._voiced_captured_at = captured_at
+        else:
+            self._quiet_fed += n / self.target_rate
+
+        resampled *= 32768.0
+        np.clip(resampled, -32768, 32767, out=resampled)
+
+        if self._out_len + n > len(self._out):
+            self._flush()
+        np.copyto(self._out[self._out_len:self._out_len + n], resampled, casting='unsafe')
+        self._out_len += n
+
+        if self._out_len >= self._batch_samples:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._out_len == 0:
+            return
+        self.recorder.feed_audio(self._out[:self._out_len].tobytes(), original_sample_rate=self.target_rate)
+        if self.clock is not None and self._voiced_captured_at is not None:
+            self.clock.mark('capture', self._voiced_captured_at)
+            self.clock.mark('feed')
+            self._voiced_captured_at = None
+        self.samples_fed += self._out_len
+        self.batches_fed += 1
+        self._out_len = 0
+
+
+def read_wav(file_path: str):
+    """
+        Reads a PCM WAV file of any sample rate, channel count and (8/16/24/32 bit) sample width.
+        Returns interleaved int16 samples, the sample rate and the number of channels
+    """
+    with wave.open(file_path, 'rb') as wf:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        width = wf.getsampwidth()
+        raw = wf.readframes(wf.getnframes())
+
+    if width == 1:
+        # 8 bit WAV is unsigned
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype=np.int16)
+    elif width == 3:
+        bytes_ = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        # Keep the two most significant bytes of each little-endian 24 bit sample
+        samples = (bytes_[:, 1].astype(np.uint16) | (bytes_[:, 2].astype(np.uint16) << 8)).view(np.int16)
+    elif width == 4:
+        samples = (np.frombuffer(raw, dtype=np.int32) >> 16).astype(np.int16)
+    else:
+        raise Exception("Unsupported sample width: " + str(width))
+
+    return samples, rate, channels
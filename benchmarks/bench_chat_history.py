@@ -0,0 +1,136 @@
+"""
+    ChatHistory at the size of a long session: putting realtime updates and final transcriptions
+    (with word timestamps, some phrases overlapping the other speaker's) the way the UI does, in batches
+    followed by a timeline refresh, and then reading the dialogue back the ways the LLM requests do.
+    The put cost of the first and the last thousand operations shows whether it grows with the history.
+
+    python benchmarks/bench_chat_history.py --messages 10000 50000
+"""
+import argparse
+import json
+import gc
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_history import ChatHistory, ROLE, MESSAGE_TYPE
+from search_index import SearchIndex
+
+SIZES = (10000, 50000)
+# Realtime updates before the final transcription of a phrase
+REALTIME_UPDATES = 3
+WORDS_PER_PHRASE = 10
+# Every this many phrases, the next speaker starts before the current one's final transcription arrived
+OVERLAP_EVERY = 10
+# Operations the UI puts between two timeline refreshes
+BATCH = 4
+# Operations timed at the start and the end of the history
+SAMPLE_OPS = 1000
+
+_VOCABULARY = "so tell me about the last project you worked on and what part of it was yours".split()
+
+
+def phrase_ops(i: int, started_at: float) -> list[tuple]:
+    """
+        The puts of one phrase: realtime updates of a growing text, then the final with its words
+    """
+    role = ROLE.USER if i % 2 == 0 else ROLE.ASSISTANT
+    words = [_VOCABULARY[(i + k) % len(_VOCABULARY)] for k in range(WORDS_PER_PHRASE)]
+    ops = []
+    for update in range(1, REALTIME_UPDATES + 1):
+        content = ' '.join(words[:update * WORDS_PER_PHRASE // (REALTIME_UPDATES + 1)])
+        ops.append((role, MESSAGE_TYPE.REALTIME, content, None, started_at))
+    timestamps = [(started_at + k * 0.3, started_at + k * 0.3 + 0.25, word) for k, word in enumerate(words)]
+    ops.append((role, MESSAGE_TYPE.FINAL, ' '.join(words), timestamps, started_at))
+    return ops
+
+
+def make_ops(messages: int) -> list[tuple]:
+    ops = []
+    i = 0
+    while i < messages:
+        first = phrase_ops(i, 3.0 * i)
+        if i % OVERLAP_EVERY == OVERLAP_EVERY - 1 and i + 1 < messages:
+            # The other speaker starts halfway through: their realtime updates come before this final
+            second = phrase_ops(i + 1, 3.0 * i + 1.5)
+            ops += first[:-1] + second[:-1] + [first[-1], second[-1]]
+            i += 2
+        else:
+            ops += first
+            i += 1
+    return ops
+
+
+def put_all(history: ChatHistory, ops: list[tuple]) -> None:
+    for n, op in enumerate(ops, 1):
+        history.put(*op)
+        if n % BATCH == 0:
+            history.timeline.refresh()
+    history.timeline.refresh()
+
+
+def best_of(repeats: int, function) -> float:
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def measure(messages: int, repeats: int) -> dict:
+    ops = make_ops(messages)
+    history = ChatHistory()
+    history.search_index = SearchIndex()
+
+    started = time.perf_counter()
+    put_all(history, ops[:SAMPLE_OPS])
+    first = time.perf_counter() - started
+    put_all(history, ops[SAMPLE_OPS:-SAMPLE_OPS])
+    started_last = time.perf_counter()
+    put_all(history, ops[-SAMPLE_OPS:])
+    last = time.perf_counter() - started_last
+    total = time.perf_counter() - started
+
+    # The history is kept out of the collections, or whichever read happens to trigger one pays for walking it
+    gc.collect()
+    gc.freeze()
+
+    def late_final():
+        # A long phrase whose recording started an hour of timeline ago, finished only now
+        at = 3.0 * messages / 2 + 0.1
+        history.put(ROLE.USER, MESSAGE_TYPE.REALTIME, "and", None, at)
+        history.put(ROLE.USER, MESSAGE_TYPE.FINAL, "and then", [(at, at + 0.2, "and"), (at + 0.3, at + 0.5, "then")], at)
+        history.timeline.refresh()
+
+    try:
+        return {
+            "messages": len(history),
+            "turns": len(history.timeline.turns),
+            "puts_per_second": len(ops) / total,
+            "put_first_1k_us": first / SAMPLE_OPS * 1e6,
+            "put_last_1k_us": last / SAMPLE_OPS * 1e6,
+            "late_final_us": best_of(repeats, late_final) * 1e6,
+            "as_list_realtime_ms": best_of(repeats, lambda: history.as_list()) * 1e3,
+            "as_list_final_ms": best_of(repeats, lambda: history.as_list(realtime=False)) * 1e3,
+            "as_list_until_user_final_ms": best_of(repeats, lambda: history.as_list(realtime=False, until_latest_user_final=True)) * 1e3,
+            "last_turns_us": best_of(repeats, lambda: history.last_turns(20).as_messages()) * 1e6,
+            "search_ms": best_of(repeats, lambda: history.search_index.search('last project')) * 1e3,
+        }
+    finally:
+        gc.unfreeze()
+
+
+def run(sizes=SIZES, repeats: int = 5) -> dict:
+    return {f"{messages}_messages": measure(messages, repeats) for messages in sizes}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the chat history")
+    parser.add_argument('--messages', type=int, nargs='+', default=SIZES, help="History sizes to measure")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.messages, args.repeats), indent=2))
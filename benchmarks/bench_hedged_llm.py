@@ -0,0 +1,74 @@
+"""
+    Hedged requests across two local fake servers (see fake_llm_server.py), one OpenAI-compatible
+    and one Ollama-compatible. Each scenario makes one of them slow (or failing) and reports
+    which backend won, the time to first token and the backends' stats afterwards:
+    - slow_primary: the configured primary takes `--slow` seconds to its first token
+    - failing_primary: the primary answers every request with HTTP 500
+    - fan_out: hedge delay 0, both backends are asked at once
+
+    python benchmarks/bench_hedged_llm.py --slow 0.5 --hedge-delay 0.1 --requests 5
+"""
+from threading import Event
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gpt_request import APIProvider
+from hedged_llm import HedgedLLMAPI
+from fake_llm_server import FakeLLMServer
+from bench_llm_stream import make_provider, CHAT
+
+
+def measure(llm: HedgedLLMAPI, requests: int) -> dict:
+    ttft, winners = [], []
+    for _ in range(requests):
+        sent_at = time.monotonic()
+        first_chunk_at = None
+        for _ in llm.chat(CHAT, Event()):
+            if first_chunk_at is None:
+                first_chunk_at = time.monotonic()
+        ttft.append(first_chunk_at - sent_at)
+        winners.append(llm.ranked()[0].name)
+    return {
+        "time_to_first_token": ttft,
+        "primary_after_each_request": winners,
+        "backends": llm.stats(),
+    }
+
+
+def scenario(primary: FakeLLMServer, secondary: FakeLLMServer, hedge_delay: float, requests: int) -> dict:
+    llm = HedgedLLMAPI([make_provider(APIProvider.OPENAI, primary), make_provider(APIProvider.OLLAMA, secondary)], hedge_delay)
+    try:
+        return measure(llm, requests)
+    finally:
+        llm.close()
+
+
+def run(slow: float = 0.5, hedge_delay: float = 0.1, requests: int = 5, tokens: int = 20) -> dict:
+    results = {}
+    fast = FakeLLMServer(tokens=tokens).start()
+    slow_server = FakeLLMServer(tokens=tokens, first_token_delay=slow).start()
+    failing = FakeLLMServer(tokens=tokens, status=500).start()
+    try:
+        results["slow_primary"] = scenario(slow_server, fast, hedge_delay, requests)
+        results["failing_primary"] = scenario(failing, fast, hedge_delay, requests)
+        results["fan_out"] = scenario(slow_server, fast, 0, requests)
+    finally:
+        for server in (fast, slow_server, failing):
+            server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hedged LLM requests against local fake servers")
+    parser.add_argument('--slow', type=float, default=0.5, help="Time to first token of the slow backend")
+    parser.add_argument('--hedge-delay', type=float, default=0.1)
+    parser.add_argument('--requests', type=int, default=5)
+    parser.add_argument('--tokens', type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(run(args.slow, args.hedge_delay, args.requests, args.tokens), indent=2))
@@ -0,0 +1,90 @@
+"""
+    Time to first token and tokens per second of the LLM providers, measured against
+    the local fake server (see fake_llm_server.py), plus the time a cancelled stream
+    takes to stop.
+
+    python benchmarks/bench_llm_stream.py --tokens 200 --token-delay 0.005
+"""
+from threading import Event
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from gpt_request import LLMFactory, APIProvider
+from fake_llm_server import FakeLLMServer
+
+CHAT = [{"role": "user", "content": "How is the interview going?"}]
+
+
+def make_provider(provider: APIProvider, server: FakeLLMServer):
+    if provider == APIProvider.OPENAI:
+        llm = LLMFactory(provider, baseurl=server.url + '/v1')
+        llm.header["Authorization"] = "Bearer fake"
+        llm.select_model('gpt-4.1-nano')
+    else:
+        llm = LLMFactory(provider, baseurl=server.url + '/api')
+        llm.select_model('deepseek:7b')
+    return llm
+
+
+def measure_stream(llm, repeats: int) -> dict:
+    ttft, tps, server_tps, total = [], [], [], []
+    for _ in range(repeats):
+        for _ in llm.chat(CHAT, Event()):
+            pass
+        stats = llm.last_stats
+        ttft.append(stats.time_to_first_token)
+        tps.append(stats.tokens_per_second or 0.0)
+        if stats.server_tokens_per_second is not None:
+            server_tps.append(stats.server_tokens_per_second)
+        total.append(stats.last_chunk_at - stats.sent_at)
+    results = {
+        "time_to_first_token": sum(ttft) / len(ttft),
+        "tokens_per_second": sum(tps) / len(tps),
+        "total_seconds": sum(total) / len(total),
+    }
+    if server_tps:
+        # As reported by the server (Ollama's eval_count / eval_duration)
+        results["server_tokens_per_second"] = sum(server_tps) / len(server_tps)
+    return results
+
+
+def measure_cancel(llm, after_chunks: int = 5) -> float:
+    """
+        Seconds between asking a stream to stop and the generator returning
+    """
+    terminate = Event()
+    stop_requested_at = None
+    for i, _ in enumerate(llm.chat(CHAT, terminate)):
+        if i + 1 == after_chunks:
+            terminate.set()
+            stop_requested_at = time.monotonic()
+    return time.monotonic() - stop_requested_at if stop_requested_at else None
+
+
+def run(tokens: int = 200, token_delay: float = 0.005, repeats: int = 3) -> dict:
+    server = FakeLLMServer(tokens=tokens, token_delay=token_delay).start()
+    results = {}
+    try:
+        for provider in (APIProvider.OPENAI, APIProvider.OLLAMA):
+            llm = make_provider(provider, server)
+            results[provider.value] = measure_stream(llm, repeats)
+            results[provider.value]["cancel_seconds"] = measure_cancel(llm)
+            llm.close()
+    finally:
+        server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="LLM streaming benchmark against a local fake server")
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.tokens, args.token_delay, args.repeats), indent=2))
@@ -0,0 +1,94 @@
+"""
+    Throughput of the speaker capture (SpeakerCapture, what record_audio_speaker hands the frames to)
+    for common device sample rates and channel counts: how many seconds of audio are pushed, downmixed,
+    resampled and fed per second of wall time, and what a push costs the audio callback.
+    The recorder is a sink that only counts the bytes, so no RealTimeSTT or sound device is needed.
+
+    python benchmarks/bench_resample.py --seconds 30 --rates 44100 48000 --channels 2
+"""
+import argparse
+import json
+import time
+import sys
+import os
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_capture import SpeakerCapture
+from latency import percentile
+
+RATES = (16000, 44100, 48000, 96000)
+CHANNELS = (1, 2)
+# Frames per audio callback, as app.py opens the device streams
+BLOCK_FRAMES = 1024
+
+
+class _SinkRecorder:
+    """
+        Stands in for AudioToTextRecorder, only counts what it is fed
+    """
+    def __init__(self):
+        self.bytes_fed = 0
+
+    def feed_audio(self, chunk: bytes, original_sample_rate: int = 16000) -> None:
+        self.bytes_fed += len(chunk)
+
+
+def make_audio(rate: int, channels: int, seconds: float) -> np.ndarray:
+    """
+        Interleaved int16 frames: a tone with some noise on every channel
+    """
+    t = np.arange(int(rate * seconds)) / rate
+    rng = np.random.default_rng(0)
+    mono = 0.3 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(len(t))
+    return (np.repeat(mono[:, None], channels, axis=1) * 32767).astype(np.int16).ravel()
+
+
+def measure(rate: int, channels: int, seconds: float) -> dict:
+    samples = make_audio(rate, channels, seconds)
+    blocks = [samples[i:i + BLOCK_FRAMES * channels].tobytes() for i in range(0, len(samples), BLOCK_FRAMES * channels)]
+    recorder = _SinkRecorder()
+    capture = SpeakerCapture(recorder, rate, channels, block_frames=BLOCK_FRAMES)
+
+    push_seconds = []
+    started = time.perf_counter()
+    for block in blocks:
+        pushed = time.perf_counter()
+        capture.push(block)
+        push_seconds.append(time.perf_counter() - pushed)
+        # The worker's step, run inline: timing the thread would mostly time its polling
+        n = capture.ring.read_into(capture._raw, multiple_of=channels)
+        capture._process(capture._raw[:n])
+    capture.stop()
+    elapsed = time.perf_counter() - started
+
+    stats = capture.stats()
+    return {
+        "x_realtime": seconds / elapsed,
+        "blocks_per_second": len(blocks) / elapsed,
+        "push_p50_us": percentile(push_seconds, 50) * 1e6,
+        "push_p99_us": percentile(push_seconds, 99) * 1e6,
+        "samples_fed": stats["samples_fed"],
+        "overruns": stats["overruns"],
+    }
+
+
+def run(seconds: float = 20.0, rates=RATES, channels=CHANNELS, repeats: int = 3) -> dict:
+    # The best of the repeats: the machine may be busy with something else for a while
+    return {
+        f"{rate}Hz_{count}ch": max((measure(rate, count, seconds) for _ in range(repeats)), key=lambda result: result["x_realtime"])
+        for rate in rates for count in channels
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the capture resampling")
+    parser.add_argument('--seconds', type=float, default=20.0, help="Seconds of audio per configuration")
+    parser.add_argument('--rates', type=int, nargs='+', default=RATES)
+    parser.add_argument('--channels', type=int, nargs='+', default=CHANNELS)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.seconds, args.rates, args.channels, args.repeats), indent=2))
@@ -0,0 +1,165 @@
+"""
+    Compares the two ways of making the speaker recorder finalize an utterance when the
+    loopback stream goes quiet:
+    - noise: the old approach, 1024 samples of zeros fed every 300 ms, forever
+    - flush: SpeakerCapture's end of utterance silence, fed only after speech
+
+    The utterances of the given WAV file are played into the recorder in real time with no audio
+    at all between them (like a loopback device while nothing is playing). Reports the mean
+    audio end -> FINAL latency, the CPU used while nobody speaks and how often the recorder is fed then.
+    Needs RealTimeSTT with its Whisper and Silero VAD models (downloaded on first use).
+
+    python benchmarks/bench_speaker_flush.py speech.wav --idle 20
+"""
+from RealtimeSTT import AudioToTextRecorder
+import numpy as np
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_capture import SpeakerCapture, read_wav
+from replay import CHUNK
+from transcription import recorder_config, TARGET_RATE, END_OF_UTTERANCE_SILENCE
+
+# Quiet stretches of at least this long separate utterances in the input file
+MIN_GAP_SECONDS = 1.0
+VOICED_RMS = 300
+# Time given to each utterance to produce its FINAL message
+FINAL_TIMEOUT = 8
+
+
+def split_utterances(samples: np.ndarray, rate: int, channels: int) -> list[np.ndarray]:
+    block = CHUNK * channels
+    blocks = [samples[i:i + block] for i in range(0, len(samples), block)]
+    voiced = [np.sqrt(np.mean(b.astype(np.float32) ** 2)) > VOICED_RMS for b in blocks]
+    min_gap_blocks = max(1, int(MIN_GAP_SECONDS * rate / CHUNK))
+
+    utterances, current, gap = [], [], 0
+    for b, v in zip(blocks, voiced):
+        if v:
+            current.append(b)
+            gap = 0
+        elif current:
+            gap += 1
+            if gap >= min_gap_blocks:
+                utterances.append(np.concatenate(current))
+                current, gap = [], 0
+            else:
+                current.append(b)
+    if current:
+        utterances.append(np.concatenate(current))
+    return utterances
+
+
+def cpu_seconds() -> float:
+    """
+        CPU time of this process and its children (the recorder may transcribe in a subprocess)
+    """
+    try:
+        import psutil
+        process = psutil.Process()
+        total = sum(process.cpu_times()[:2])
+        for child in process.children(recursive=True):
+            try:
+                total += sum(child.cpu_times()[:2])
+            except psutil.NoSuchProcess:
+                pass
+        return total
+    except ImportError:
+        return time.process_time()
+
+
+def simulate_noise(recorder, stop: threading.Event, fed: list):
+    silent_buffer = (b'\x00\x00') * 1024
+    while not stop.is_set():
+        recorder.feed_audio(silent_buffer, original_sample_rate=16000)
+        fed[0] += 1
+        time.sleep(0.3)
+
+
+def run_mode(mode: str, utterances: list[np.ndarray], rate: int, channels: int, idle_seconds: float) -> dict:
+    finals = []
+    final_arrived = threading.Event()
+    recorder = AudioToTextRecorder(**recorder_config)
+
+    def poll():
+        while True:
+            recorder.text()
+            finals.append(time.monotonic())
+            final_arrived.set()
+    threading.Thread(target=poll, daemon=True).start()
+
+    capture = SpeakerCapture(recorder, rate, channels, TARGET_RATE, CHUNK,
+                             END_OF_UTTERANCE_SILENCE if mode == 'flush' else None)
+    capture.start()
+    stop_noise = threading.Event()
+    noise_fed = [0]
+    if mode == 'noise':
+        threading.Thread(target=simulate_noise, args=[recorder, stop_noise, noise_fed], daemon=True).start()
+
+    def feeds() -> int:
+        return capture.batches_fed + capture.silence_blocks_fed + noise_fed[0]
+
+    latencies = []
+    block = CHUNK * channels
+    for utterance in utterances:
+        final_arrived.clear()
+        started = time.monotonic()
+        for offset in range(0, len(utterance), block):
+            capture.push(utterance[offset:offset + block].tobytes())
+            delay = started + (offset + block) / channels / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        audio_end = time.monotonic()
+        # Nothing is pushed from here on, like a loopback device with nothing playing
+        if final_arrived.wait(FINAL_TIMEOUT):
+            latencies.append(finals[-1] - audio_end)
+        time.sleep(1)
+
+    cpu_before, feeds_before = cpu_seconds(), feeds()
+    time.sleep(idle_seconds)
+    idle_cpu = (cpu_seconds() - cpu_before) / idle_seconds
+    idle_feeds = (feeds() - feeds_before) / idle_seconds
+
+    stop_noise.set()
+    capture.stop()
+    recorder.shutdown()
+    return {
+        "utterances": len(utterances),
+        "finalized": len(latencies),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+        "latency_max": max(latencies, default=None),
+        # CPU seconds per second (1.0 = one core fully busy) while nobody speaks
+        "idle_cpu": idle_cpu,
+        # feed_audio calls per second while nobody speaks, each one runs the recorder's VAD
+        "idle_feeds_per_second": idle_feeds,
+        "capture": capture.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Silence injection vs end of utterance flush")
+    parser.add_argument('wav', help="Speech with pauses between the utterances")
+    parser.add_argument('--idle', type=float, default=20, help="Seconds of idle time to measure the CPU over")
+    parser.add_argument('--mode', choices=['noise', 'flush', 'both'], default='both')
+    parser.add_argument('--json', dest='json_path', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    samples, rate, channels = read_wav(args.wav)
+    utterances = split_utterances(samples, rate, channels)
+    modes = ['noise', 'flush'] if args.mode == 'both' else [args.mode]
+    results = {mode: run_mode(mode, utterances, rate, channels, args.idle) for mode in modes}
+
+    print(json.dumps(results, indent=2))
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as jf:
+            json.dump(results, jf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
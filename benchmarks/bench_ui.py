@@ -0,0 +1,164 @@
+"""
+    The Textual UI under floods, run headless with Textual's test harness (no terminal needed):
+    a flood of transcription messages (the path the recorders' messages take from the message queue:
+    coalesce_messages, process_messages, ChatView and the repaint), what process_messages
+    costs for a single update once the session is long (the repaint follows on the screen's next refresh),
+    and LLM tokens streamed into the GPT pane's queue (check_gpt_queue).
+
+    python benchmarks/bench_ui.py --phrases 500 --tokens 4000 --token-rate 2000
+"""
+from threading import Thread
+from queue import Queue
+import tempfile
+import argparse
+import asyncio
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chat_history import MESSAGE_TYPE, ROLE, coalesce_messages
+from startup import Startup
+from latency import percentile
+from bench_chat_history import make_ops
+import textual_ui
+
+# Terminal size of the headless app
+SCREEN_SIZE = (120, 40)
+# Messages the message queue holds when the UI takes them (before coalescing)
+FLOOD_BATCH = 16
+# How often the benchmark checks whether the app has caught up
+POLL_INTERVAL = 0.01
+
+
+def as_message(op: tuple) -> dict:
+    role, transcription_type, content, words, started_at = op
+    return {"role": role, "transcription_type": transcription_type, "content": content, "words": words, "started_at": started_at}
+
+
+def _no_llm():
+    raise RuntimeError("no LLM provider in the benchmark")
+
+
+async def wait_until(pilot, condition, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("the UI didn't catch up")
+        await pilot.pause(POLL_INTERVAL)
+
+
+async def message_flood(app, pilot, phrases: int, updates: int) -> dict:
+    """
+        The phrases' messages handed to process_messages in coalesced batches of FLOOD_BATCH, the way
+        watch_message_queue does when the recorders are ahead of the UI, each one rendered before the next
+    """
+    messages = [as_message(op) for op in make_ops(phrases)]
+    history = app._chat_history
+
+    started = time.perf_counter()
+    for i in range(0, len(messages), FLOOD_BATCH):
+        await app.process_messages(coalesce_messages(messages[i:i + FLOOD_BATCH]))
+        await pilot.pause()
+    elapsed = time.perf_counter() - started
+
+    # One realtime update of a phrase at the end of the now long session, as the recorder sends them
+    role = ROLE.USER if history.get_by_id(phrases - 1).role is ROLE.ASSISTANT else ROLE.ASSISTANT
+    at = messages[-1]["started_at"] + 3.0
+    update_seconds = []
+    for update in range(updates):
+        message = {"role": role, "transcription_type": MESSAGE_TYPE.REALTIME, "content": "word " * (update % 20 + 1), "started_at": at}
+        started_update = time.perf_counter()
+        await app.process_messages([message])
+        update_seconds.append(time.perf_counter() - started_update)
+    await app.process_messages([{**message, "transcription_type": MESSAGE_TYPE.FINAL}])
+
+    return {
+        "messages": len(messages),
+        "messages_per_second": len(messages) / elapsed,
+        "mounted_turns": len(app.chat._widgets),
+        "update_p50_ms": percentile(update_seconds, 50) * 1e3,
+        "update_p95_ms": percentile(update_seconds, 95) * 1e3,
+    }
+
+
+async def token_flood(app, pilot, tokens: int, rate: float) -> dict:
+    """
+        `tokens` chunks streamed at `rate` per second (far faster than an LLM): the pane should repaint
+        at most GPT_FRAME_RATE times per second and show the last chunk within a frame or two
+    """
+    chunks = [f"token{i} " for i in range(tokens)]
+    length = sum(len(chunk) for chunk in chunks)
+    frames = 0
+    update = app.gpt_content.update
+
+    def counted(*args, **kwargs):
+        nonlocal frames
+        frames += 1
+        return update(*args, **kwargs)
+    app.gpt_content.update = counted
+
+    def stream():
+        nonlocal sent_at
+        for i, chunk in enumerate(chunks):
+            time.sleep(max(0.0, started + i / rate - time.perf_counter()))
+            textual_ui.gpt_queue.put(chunk)
+        sent_at = time.perf_counter()
+
+    textual_ui.gpt_queue.put('|||')
+    sent_at = None
+    started = time.perf_counter()
+    Thread(target=stream, daemon=True).start()
+    await wait_until(pilot, lambda: not app._gpt_buffer.dirty and app._gpt_buffer._buffer.tell() == length)
+    shown_at = time.perf_counter()
+    app.gpt_content.update = update
+
+    return {
+        "tokens": tokens,
+        "tokens_per_second": tokens / (shown_at - started),
+        # At most GPT_FRAME_RATE per second of the stream
+        "repaints": frames,
+        # From the last chunk put into the queue to the pane showing it (within POLL_INTERVAL)
+        "last_token_lag_ms": (shown_at - sent_at) * 1e3,
+    }
+
+
+async def run_app(phrases: int, updates: int, tokens: int, token_rate: float) -> dict:
+    startup = Startup()
+    startup.start('llm', _no_llm)
+    app = textual_ui.ChatApp(Queue(), startup)
+    async with app.run_test(size=SCREEN_SIZE) as pilot:
+        # Let the app report the missing provider into the GPT pane before the tokens come
+        await wait_until(pilot, lambda: startup.done())
+        await pilot.pause(2 * textual_ui.STARTUP_STATUS_INTERVAL)
+        return {
+            "message_flood": await message_flood(app, pilot, phrases, updates),
+            "token_flood": await token_flood(app, pilot, tokens, token_rate),
+        }
+
+
+def run(phrases: int = 500, updates: int = 200, tokens: int = 4000, token_rate: float = 2000.0) -> dict:
+    textual_ui.ChatApp.CSS_PATH = os.path.join(ROOT, 'dom.tcss')
+    cwd = os.getcwd()
+    # The app may write next to where it runs (sessions/, llm_cache/), keep that out of the repository
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            return asyncio.run(run_app(phrases, updates, tokens, token_rate))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the Textual UI under message and token floods")
+    parser.add_argument('--phrases', type=int, default=500, help="Phrases in the message flood (each is several messages)")
+    parser.add_argument('--updates', type=int, default=200, help="Single realtime updates timed after the flood")
+    parser.add_argument('--tokens', type=int, default=4000, help="Chunks in the token flood")
+    parser.add_argument('--token-rate', type=float, default=2000.0, help="Chunks per second in the token flood")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.phrases, args.updates, args.tokens, args.token_rate), indent=2))
@@ -0,0 +1,178 @@
+"""
+    Local stand-in for the OpenAI and Ollama HTTP APIs, for trying the LLM providers
+    out (and timing them) without a network or a GPU.
+
+    python benchmarks/fake_llm_server.py --port 8765
+
+    then point a provider to it:
+    LLMFactory(APIProvider.OPENAI, baseurl="http://127.0.0.1:8765/v1")
+    LLMFactory(APIProvider.OLLAMA, baseurl="http://127.0.0.1:8765/api")
+
+    Every reply is `tokens` copies of a token, streamed `token_delay` seconds apart
+    (OpenAI as server-sent events when the request asks for `stream`, Ollama as NDJSON).
+    `connections` counts the TCP connections the server accepted, which tells whether
+    the client reused its keep-alive connections.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import argparse
+import threading
+import json
+import time
+
+MODELS = ['gpt-4.1-nano', 'deepseek:7b']
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that connections are kept alive between requests
+    protocol_version = 'HTTP/1.1'
+    # The headers and every streamed chunk are small writes, with Nagle's algorithm each one would wait
+    #   for the ACK of the previous one, which the client delays (by ~40 ms on Linux)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        return
+
+    def _send_json(self, payload: dict) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _tokens(self):
+        if self.server.first_token_delay:
+            time.sleep(self.server.first_token_delay)
+        for _ in range(self.server.tokens):
+            if self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            yield self.server.token
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        if self.path == '/v1/models':
+            self._send_json({"data": [{"id": m} for m in MODELS]})
+        elif self.path == '/api/tags':
+            self._send_json({"models": [{"name": m} for m in MODELS]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.requests += 1
+        request = self._read_json()
+        if self.server.status != 200:
+            self.send_error(self.server.status)
+        elif self.path == '/v1/chat/completions':
+            self._openai_chat(request)
+        elif self.path == '/api/chat':
+            self._ollama_chat(request)
+        else:
+            self.send_error(404)
+
+    def _openai_chat(self, request: dict) -> None:
+        if not request.get('stream'):
+            content = ''.join(self._tokens())
+            self._send_json({"choices": [{"message": {"role": "assistant", "content": content}}]})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        count = 0
+        try:
+            for token in self._tokens():
+                count += 1
+                self._write_chunk('data: ' + json.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}) + '\n\n')
+            if request.get('stream_options', {}).get('include_usage'):
+                self._write_chunk('data: ' + json.dumps({"choices": [], "usage": {"completion_tokens": count}}) + '\n\n')
+            self._write_chunk('data: [DONE]\n\n')
+            self._write_chunk('')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the stream
+            with self.server.lock:
+                self.server.cancelled += 1
+            self.close_connection = True
+
+    def _ollama_chat(self, request: dict) -> None:
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        count = 0
+        started = time.monotonic_ns()
+        try:
+            for token in self._tokens():
+                count += 1
+                self._write_chunk(json.dumps({"message": {"role": "assistant", "content": token}, "done": False}) + '\n')
+            eval_duration = time.monotonic_ns() - started
+            self._write_chunk(json.dumps({
+                "message": {"role": "assistant", "content": ""}, "done": True,
+                "total_duration": eval_duration, "load_duration": 0,
+                "prompt_eval_count": len(json.dumps(request.get('messages', []))) // 4, "prompt_eval_duration": 0,
+                "eval_count": count, "eval_duration": eval_duration,
+            }) + '\n')
+            self._write_chunk('')
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.lock:
+                self.server.cancelled += 1
+            self.close_connection = True
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode()
+        self.wfile.write(('%x\r\n' % len(data)).encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, tokens: int = 50, token_delay: float = 0.0, token: str = 'word ',
+                 first_token_delay: float = 0.0, status: int = 200):
+        super().__init__(('127.0.0.1', port), FakeLLMHandler)
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.token = token
+        # Extra wait before the first token (a busy or slow backend)
+        self.first_token_delay = first_token_delay
+        # Anything but 200 makes every chat request fail with that status
+        self.status = status
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        # Streams the client hung up on before they were finished
+        self.cancelled = 0
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def start(self) -> 'FakeLLMServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake OpenAI / Ollama server")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    args = parser.parse_args()
+    server = FakeLLMServer(args.port, args.tokens, args.token_delay)
+    print("Serving on " + server.url)
+    server.serve_forever()
@@ -0,0 +1,193 @@
+"""
+    Runs the offline benchmarks (no sound device, STT model or LLM provider needed) and compares
+    their metrics with a stored baseline: the capture resampling, the chat history at 10k+ messages,
+    the Textual UI under message and token floods and the LLM streaming against the local fake servers.
+    The results are written as JSON, the exit code is 1 when a metric got worse than the baseline by more
+    than the tolerance. A baseline only means something on the machine it was saved on.
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --only chat_history ui --tolerance 0.5
+    python benchmarks/run_benchmarks.py --save-baseline
+"""
+import argparse
+import platform
+import json
+import time
+import sys
+import os
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import bench_resample
+import bench_chat_history
+import bench_ui
+import bench_llm_stream
+import bench_hedged_llm
+
+BASELINE_FILE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+RESULTS_FILE = os.path.join(BENCHMARKS_DIR, 'results.json')
+# A metric regressed when it got worse than the baseline by more than this share. Runs of the same code
+#   easily differ by 20-30% on a laptop or a shared VM, what this is meant to catch is the step a change
+#   makes when it puts work back on a hot path (e.g. something per message that grows with the session)
+REGRESSION_TOLERANCE = 0.5
+# Timings that differ from the baseline by less than this are noise, whatever the ratio
+NOISE_FLOOR_SECONDS = 0.002
+# Which way is better is told by the metric's name, the others (counts) are reported but not compared
+HIGHER_IS_BETTER = ('_per_second', 'x_realtime')
+LOWER_IS_BETTER = ('_seconds', '_ms', '_us', 'time_to_first_token')
+_UNITS = {'_ms': 1e-3, '_us': 1e-6}
+
+# The suite, with sizes that keep the whole run under two minutes
+SUITE = {
+    "resample": lambda: bench_resample.run(seconds=30.0, repeats=5),
+    "chat_history": lambda: bench_chat_history.run(sizes=(10000, 50000), repeats=10),
+    # The chat window is full (and sliding) after the first ~60 phrases
+    "ui": lambda: best(bench_ui.run(phrases=200, tokens=4000, token_rate=2000.0) for _ in range(2)),
+    # No delay between the tokens, so the client's parsing is what is measured
+    "llm_stream": lambda: best(bench_llm_stream.run(tokens=20000, token_delay=0.0) for _ in range(5)),
+    "hedged_llm": lambda: best(bench_hedged_llm.run() for _ in range(3)),
+}
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    """
+        The numeric leaves of the nested results as {"bench.path.metric": value}
+    """
+    metrics = {}
+    for name, value in results.items():
+        key = prefix + name
+        if isinstance(value, dict):
+            metrics.update(flatten(value, key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[key] = value
+    return metrics
+
+
+def best(runs) -> dict:
+    """
+        Merges the results of several runs of a benchmark, keeping the best value of every compared metric
+        (and the first run's value of everything else): short benchmarks are at the mercy of the scheduler
+    """
+    runs = list(runs)
+    merged = {}
+    for name, value in runs[0].items():
+        if isinstance(value, dict):
+            merged[name] = best(run[name] for run in runs)
+        elif direction(name) and isinstance(value, (int, float)) and all(isinstance(run.get(name), (int, float)) for run in runs):
+            values = [run[name] for run in runs]
+            merged[name] = max(values) if direction(name) > 0 else min(values)
+        else:
+            merged[name] = value
+    return merged
+
+
+def direction(metric: str) -> int:
+    """
+        1 if higher is better, -1 if lower is better, 0 if the metric isn't compared
+    """
+    name = metric.rsplit('.', 1)[-1]
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def to_seconds(metric: str, value: float) -> float:
+    for suffix, unit in _UNITS.items():
+        if metric.endswith(suffix):
+            return value * unit
+    return value
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float = REGRESSION_TOLERANCE) -> dict:
+    """
+        Every compared metric that is in both, with its change relative to the baseline
+        (positive is better) and whether it regressed
+    """
+    comparison = {}
+    for metric, value in metrics.items():
+        better = direction(metric)
+        base = baseline.get(metric)
+        if not better or not base:
+            continue
+        change = better * (value - base) / base
+        regressed = change < -tolerance
+        if regressed and better < 0 and to_seconds(metric, value - base) < NOISE_FLOOR_SECONDS:
+            regressed = False
+        comparison[metric] = {"baseline": base, "value": value, "change": change, "regressed": regressed}
+    return comparison
+
+
+def machine() -> dict:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def run(only: list[str] = None) -> dict:
+    results = {}
+    for name, bench in SUITE.items():
+        if only and name not in only:
+            continue
+        started = time.monotonic()
+        results[name] = bench()
+        print(f"{name}: {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return results
+
+
+def report(comparison: dict) -> str:
+    lines = []
+    for metric, row in comparison.items():
+        mark = "REGRESSED" if row["regressed"] else ""
+        lines.append(f"{metric:<60} {row['baseline']:>14.4g} {row['value']:>14.4g} {row['change']:>+8.0%} {mark}")
+    regressions = sum(row["regressed"] for row in comparison.values())
+    lines.append(f"{len(comparison)} metrics compared, {regressions} regressed")
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the offline benchmarks and compare them with the baseline")
+    parser.add_argument('--only', nargs='+', choices=list(SUITE), help="Run only these benchmarks")
+    parser.add_argument('--output', default=RESULTS_FILE, help="Where to write the results")
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline instead of comparing")
+    args = parser.parse_args()
+
+    results = run(args.only)
+    metrics = flatten(results)
+    output = {"machine": machine(), "results": results, "metrics": metrics}
+
+    if args.save_baseline:
+        baseline = {"machine": output["machine"], "metrics": metrics}
+        if args.only and os.path.exists(args.baseline):
+            # Keep the metrics of the benchmarks that weren't run
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline["metrics"] = {**json.load(f)["metrics"], **metrics}
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    comparison = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline["machine"] != output["machine"]:
+            print("The baseline was saved on another machine, the comparison is only indicative", file=sys.stderr)
+        comparison = compare(metrics, baseline["metrics"], args.tolerance)
+        print(report(comparison))
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to store one")
+    output["comparison"] = comparison
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+    sys.exit(1 if any(row["regressed"] for row in comparison.values()) else 0)
@@ -0,0 +1,214 @@
+"""
+    Finds the Whisper models and settings this machine can run in real time and saves them
+    to STT_CONFIG_FILE, which transcription.py loads into recorder_config at startup.
+
+    An utterance made of the given clip (by default the short clip bundled with RealTimeSTT,
+    repeated) is transcribed with every candidate model / beam size / batch size / compute type.
+    Both paths (final and realtime) must transcribe faster than MAX_RTF times real time, as two
+    recorders share them. The final path gets the largest model and beam that manage it, the
+    realtime path the largest that also answers within REALTIME_MAX_LATENCY.
+
+    python calibrate.py                         # bundled clip, CUDA when available
+    python calibrate.py speech.wav --device cpu
+"""
+from datetime import datetime, timezone
+import numpy as np
+import argparse
+import platform
+import json
+import math
+import time
+import os
+
+from latency import percentile
+from transcription import recorder_config, STT_CONFIG_FILE, TARGET_RATE
+
+# In order of increasing size (and accuracy)
+CALIBRATION_MODELS = ('tiny', 'base', 'small', 'medium')
+CALIBRATION_BEAMS = (1, 3, 5)
+CALIBRATION_BATCH_SIZES = (0, 8)
+CALIBRATION_COMPUTE_TYPES = {
+    'cpu': ('int8', 'float32'),
+    'cuda': ('float16', 'int8_float16'),
+}
+# Length of the audio transcribed at once, a typical phrase
+UTTERANCE_SECONDS = 6
+# Transcriptions timed per configuration (after a warm-up one)
+UTTERANCES = 3
+# The mic and the speaker recorders share each model, so it has to keep up with both
+MAX_RTF = 0.5
+# The realtime text should lag behind the speech by at most this much
+REALTIME_MAX_LATENCY = 1.0
+# Bounds of the calibrated realtime_processing_pause
+MIN_PROCESSING_PAUSE = 0.1
+MAX_PROCESSING_PAUSE = 1.0
+
+
+def bundled_clip() -> str:
+    import RealtimeSTT
+    return os.path.join(os.path.dirname(RealtimeSTT.__file__), 'assets', 'warmup_audio.wav')
+
+
+def read_utterance(file_path: str, seconds: float = UTTERANCE_SECONDS) -> np.ndarray:
+    """
+        The clip as 16 kHz mono float32, repeated (or cut) to `seconds`
+    """
+    from audio_capture import read_wav
+
+    samples, rate, channels = read_wav(file_path)
+    audio = samples.reshape(-1, channels)[:, 0].astype(np.float32) / 32768.0
+    if rate != TARGET_RATE:
+        import samplerate
+        audio = samplerate.resample(audio, TARGET_RATE / rate, 'sinc_best').astype(np.float32)
+    length = int(seconds * TARGET_RATE)
+    return np.tile(audio, math.ceil(length / len(audio)))[:length]
+
+
+def measure(model: str, compute_type: str, beam_size: int, batch_size: int, device: str, audio: np.ndarray) -> dict:
+    from RealtimeSTT.transcription_engines import create_transcription_engine, TranscriptionEngineConfig
+
+    load_started = time.monotonic()
+    engine = create_transcription_engine(recorder_config.get('transcription_engine', 'faster_whisper'), TranscriptionEngineConfig(
+        model=model,
+        download_root=recorder_config.get('download_root'),
+        compute_type=compute_type,
+        device=device,
+        beam_size=beam_size,
+        batch_size=batch_size,
+        vad_filter=False,
+    ))
+    load_seconds = time.monotonic() - load_started
+
+    language = recorder_config.get('language')
+    engine.transcribe(audio, language=language, use_prompt=False)
+    seconds = []
+    for _ in range(UTTERANCES):
+        started = time.monotonic()
+        engine.transcribe(audio, language=language, use_prompt=False)
+        seconds.append(time.monotonic() - started)
+
+    duration = len(audio) / TARGET_RATE
+    return {
+        "model": model,
+        "compute_type": compute_type,
+        "beam_size": beam_size,
+        "batch_size": batch_size,
+        "rtf": sum(seconds) / (duration * len(seconds)),
+        "latency": percentile(seconds, 95),
+        "load_seconds": load_seconds,
+    }
+
+
+def run_grid(device: str, audio: np.ndarray, models: tuple = CALIBRATION_MODELS) -> list[dict]:
+    """
+        Every candidate configuration, skipping the ones that can't be fast enough:
+        the larger beams of one that's already too slow, and the larger models once a whole model is
+    """
+    measurements = []
+    for model in models:
+        model_fits = False
+        for compute_type in CALIBRATION_COMPUTE_TYPES[device]:
+            for batch_size in CALIBRATION_BATCH_SIZES:
+                for beam_size in CALIBRATION_BEAMS:
+                    try:
+                        result = measure(model, compute_type, beam_size, batch_size, device, audio)
+                    except Exception as e:
+                        # e.g. a compute type the hardware doesn't support
+                        print(f"  {model:<8} {compute_type:<13} beam {beam_size} batch {batch_size}  failed: {e}")
+                        break
+                    measurements.append(result)
+                    print(f"  {model:<8} {compute_type:<13} beam {beam_size} batch {batch_size}"
+                          f"  RTF {result['rtf']:.2f}  latency {result['latency']:.2f}s")
+                    if result['rtf'] > MAX_RTF:
+                        break
+                    model_fits = True
+        if not model_fits:
+            break
+    return measurements
+
+
+def choose(measurements: list[dict]) -> tuple[dict, dict]:
+    """
+        The (final, realtime) configurations, both with the same compute type (RealTimeSTT takes one).
+        Accuracy first (model size, then beam size), speed breaks the ties
+    """
+    def accuracy(m: dict) -> tuple:
+        return CALIBRATION_MODELS.index(m['model']), m['beam_size']
+
+    best = None
+    for compute_type in {m['compute_type'] for m in measurements}:
+        fitting = [m for m in measurements if m['compute_type'] == compute_type and m['rtf'] <= MAX_RTF]
+        if not fitting:
+            continue
+        final = max(fitting, key=lambda m: (accuracy(m), -m['rtf']))
+        realtime_candidates = [m for m in fitting if m['latency'] <= REALTIME_MAX_LATENCY and accuracy(m) <= accuracy(final)]
+        if not realtime_candidates:
+            continue
+        realtime = max(realtime_candidates, key=lambda m: (accuracy(m), -m['latency']))
+        key = (accuracy(final), accuracy(realtime), -final['rtf'])
+        if best is None or key > best[0]:
+            best = (key, final, realtime)
+
+    if best is None:
+        # Nothing keeps up, the fastest there is will at least lag the least
+        fastest = min(measurements, key=lambda m: m['rtf'])
+        return fastest, fastest
+    return best[1], best[2]
+
+
+def calibrated_config(final: dict, realtime: dict, device: str, clip: str, measurements: list[dict]) -> dict:
+    # Pausing about as long as a realtime transcription takes leaves half of the time to the final path
+    pause = min(MAX_PROCESSING_PAUSE, max(MIN_PROCESSING_PAUSE, math.ceil(realtime['latency'] * 10) / 10))
+    return {
+        "device": device,
+        "compute_type": final['compute_type'],
+        "model": final['model'],
+        "beam_size": final['beam_size'],
+        "batch_size": final['batch_size'],
+        "realtime_model_type": realtime['model'],
+        "beam_size_realtime": realtime['beam_size'],
+        "realtime_batch_size": realtime['batch_size'],
+        "realtime_processing_pause": pause,
+        "calibration": {
+            "measured_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "host": platform.node(),
+            "processor": platform.processor() or platform.machine(),
+            "clip": clip,
+            "max_rtf": MAX_RTF,
+            "realtime_max_latency": REALTIME_MAX_LATENCY,
+            "keeps_up": final['rtf'] <= MAX_RTF and realtime['rtf'] <= MAX_RTF,
+            "measurements": measurements,
+        },
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pick the fastest Whisper settings that keep up in real time on this machine")
+    parser.add_argument('clip', nargs='?', help="WAV file with speech (default: the clip bundled with RealTimeSTT)")
+    parser.add_argument('--device', choices=sorted(CALIBRATION_COMPUTE_TYPES), help="Default: cuda when available")
+    parser.add_argument('--models', nargs='+', default=CALIBRATION_MODELS, choices=CALIBRATION_MODELS)
+    parser.add_argument('--output', default=STT_CONFIG_FILE)
+    args = parser.parse_args()
+
+    device = args.device
+    if device is None:
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    clip = args.clip or bundled_clip()
+    audio = read_utterance(clip)
+
+    print(f"Calibrating on {device} with {UTTERANCE_SECONDS}s utterances of {clip}")
+    measurements = run_grid(device, audio, tuple(args.models))
+    if not measurements:
+        exit("No configuration could be measured")
+    final, realtime = choose(measurements)
+    config = calibrated_config(final, realtime, device, clip, measurements)
+
+    with open(args.output, 'w', encoding='utf-8') as cf:
+        json.dump(config, cf, indent=2)
+    if not config['calibration']['keeps_up']:
+        print(f"Even the fastest configuration transcribes slower than {MAX_RTF}x real time, expect the text to lag")
+    print(f"Final:    {final['model']} beam {final['beam_size']} batch {final['batch_size']} {final['compute_type']} (RTF {final['rtf']:.2f})")
+    print(f"Realtime: {realtime['model']} beam {realtime['beam_size']} batch {realtime['batch_size']} (RTF {realtime['rtf']:.2f}, "
+          f"latency {realtime['latency']:.2f}s), pause {config['realtime_processing_pause']}s")
+    print("Written to " + args.output)
@@ -1,5 +1,7 @@
 from enum import Enum
 
+from timeline import Timeline
+
 class MESSAGE_TYPE(Enum):
     REALTIME = 'realtime'
     FINAL = 'final'
@@ -8,58 +10,206 @@ class ROLE(Enum):
     USER = 'user'
     ASSISTANT = 'assistant'
 
+
+class ChatRecord:
+    """
+        A single message of the dialogue.
+        Role and type are the (singleton) enum members, so comparing them is an identity check
+    """
+    __slots__ = ('role', 'transcription_type', 'content')
+
+    def __init__(self, role: ROLE, transcription_type: MESSAGE_TYPE, content: str):
+        self.role = role
+        self.transcription_type = transcription_type
+        self.content = content
+
+    def as_message(self) -> dict:
+        """
+            The message in the format LLM providers expect
+        """
+        return {"role": self.role.value, "content": self.content}
+
+
+class _RoleIndex:
+    """
+        Per-role bookkeeping: the message still being transcribed (-1 if none),
+        the latest final one (-1 if none) and the ids of all the messages of the role
+    """
+    __slots__ = ('realtime', 'final', 'ids')
+
+    def __init__(self):
+        self.realtime = -1
+        self.final = -1
+        self.ids = []
+
+
+class ChatHistoryView:
+    """
+        A window [start, stop) over the history that doesn't copy it.
+        The records are shared with the history, so realtime updates show up in the view as well
+    """
+    __slots__ = ('_list', 'start', 'stop')
+
+    def __init__(self, records: list, start: int, stop: int):
+        self._list = records
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i: int) -> ChatRecord:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._list[self.start + i]
+
+    def __iter__(self):
+        for i in range(self.start, self.stop):
+            yield self._list[i]
+
+    def as_messages(self) -> list[dict]:
+        """
+            Exports the window in the LLM provider format, skipping empty messages
+        """
+        return [record.as_message() for record in self if record.content]
+
+
 class ChatHistory:
     def __init__(self):
-        self._list = []
-        self._last_message_id = {
-            "user": {
-                "final": -1,
-                "realtime": -1
-            },
-            "assistant": {
-                "final": -1,
-                "realtime": -1
-            }
-        }
-
-    def get_by_id(self, id:int):
+        # session_store.SessionJournal every change is appended to (if any)
+        self.journal = None
+        # search_index.SearchIndex every final message is added to (if any)
+        self.search_index = None
+        # Both speakers' words in the order they were said, what as_list and the chat show
+        self.timeline = Timeline()
+        self.clear()
+
+    def __len__(self):
+        return len(self._list)
+
+    def get_by_id(self, id:int) -> ChatRecord:
         return self._list[id]
 
     def clear(self):
         self._list = []
-        self._last_message_id = {
-            "user": {
-                "final": -1,
-                "realtime": -1
-            },
-            "assistant": {
-                "final": -1,
-                "realtime": -1
-            }
-        }
-
-    def put(self, role:ROLE, type:MESSAGE_TYPE, content:str):
-        if self._last_message_id[role.value]['realtime'] == -1:
-            self._list.append({"role": role.value, "transcription_type": type.value, "content": content})
-            self._last_message_id[role.value]['realtime'] = len(self._list)-1
-            return (self._last_message_id[role.value]['realtime'], 'new')
-        
-        if type.value == 'final':
-            self._list[self._last_message_id[role.value]['realtime']]['content'] = content
-            self._list[self._last_message_id[role.value]['realtime']]['transcription_type'] = 'final'
-            self._last_message_id[role.value]['final'] = self._last_message_id[role.value]['realtime']
-            self._list.append({"role": role.value, "transcription_type": "realtime", "content": ""})
-            self._last_message_id[role.value]['realtime'] = -1
-            return (self._last_message_id[role.value]['final'], 'existing')
-        else:
-            self._list[self._last_message_id[role.value]['realtime']]['content'] = content
-            return (self._last_message_id[role.value]['realtime'], 'existing')
-        
+        self._roles = {role: _RoleIndex() for role in ROLE}
+        self.timeline.clear()
+        if self.journal is not None:
+            self.journal.clear()
+        if self.search_index is not None:
+            self.search_index.clear()
+
+    def restore(self, messages: list[dict]):
+        """
+            Puts back the messages of a reloaded session (see session_store.load_session), in id order
+        """
+        for message in messages:
+            self.put(ROLE(message['role']), MESSAGE_TYPE(message['type']), message['content'],
+                     message.get('words'), message.get('start'))
+
+    def ids_by_role(self, role: ROLE) -> list[int]:
+        """
+            Ids of all the messages of `role`, in order. Must not be modified by the caller
+        """
+        return self._roles[role].ids
+
+    def put(self, role:ROLE, type:MESSAGE_TYPE, content:str, words:list=None, started_at:float=None):
+        """
+            `words` are the (start, end, word) timestamps of a final transcription, `started_at` when
+            the recording of the phrase started (both time.time()), they place the message on the timeline
+        """
+        index = self._roles[role]
 
-    def as_list(self, realtime=True, until_latest_user_final=False):
+        if index.realtime == -1:
+            message_id = len(self._list)
+            self._list.append(ChatRecord(role, type, content))
+            index.ids.append(message_id)
+            if type is MESSAGE_TYPE.FINAL:
+                index.final = message_id
+                if self.search_index is not None:
+                    self.search_index.add(message_id, role, content)
+            else:
+                index.realtime = message_id
+            self.timeline.update(message_id, role, content, type is MESSAGE_TYPE.FINAL, words, started_at)
+            if self.journal is not None:
+                self.journal.message(message_id, role.value, type.value, content,
+                                     self.timeline.started_at(message_id), words)
+            return (message_id, 'new')
+
+        message_id = index.realtime
+        record = self._list[message_id]
+        record.content = content
+        if type is MESSAGE_TYPE.FINAL:
+            record.transcription_type = type
+            index.final = message_id
+            index.realtime = -1
+            if self.search_index is not None:
+                self.search_index.add(message_id, role, content)
+        self.timeline.update(message_id, role, content, type is MESSAGE_TYPE.FINAL, words, started_at)
+        if self.journal is not None:
+            self.journal.message(message_id, role.value, record.transcription_type.value, content,
+                                 self.timeline.started_at(message_id), words)
+        return (message_id, 'existing')
+
+    def view(self, start: int = 0, stop: int = None) -> ChatHistoryView:
+        stop = len(self._list) if stop is None else min(stop, len(self._list))
+        return ChatHistoryView(self._list, max(0, start), stop)
+
+    def last_turns(self, n: int) -> ChatHistoryView:
+        return self.view(len(self._list) - n)
+
+    def until_latest_user_final(self) -> ChatHistoryView:
+        """
+            Everything up to (and including) the latest final message of the interviewer
+        """
+        return self.view(0, self._roles[ROLE.USER].final + 1)
+
+    def latest_user_final_end(self) -> float:
+        """
+            When the latest final message of the interviewer ended (time.time()), None if there's none
+        """
+        final = self._roles[ROLE.USER].final
+        if final == -1:
+            return None
+        return self.timeline.span(final)[1]
+
+    def as_list(self, realtime=True, until_latest_user_final=False) -> list[dict]:
+        """
+            The dialogue in the order it was said (see timeline.Timeline), overlapping speech split into turns
+        """
         if realtime:
-            return self._list
+            return self.timeline.as_messages()
         if until_latest_user_final:
-            return self._list[:self._last_message_id['user']['final']]
+            until = self.latest_user_final_end()
+            if until is None:
+                return []
+            return self.timeline.as_messages(until=until)
+        else:
+            # Everything said before the phrases that are still being transcribed
+            open_starts = [self.timeline.started_at(index.realtime) for index in self._roles.values() if index.realtime != -1]
+            return self.timeline.as_messages(realtime=False, until=min(open_starts, default=None))
+
+def coalesce_messages(messages: list[dict]) -> list[dict]:
+    """
+        Collapses REALTIME updates that are superseded within the same batch.
+        A run of REALTIME messages from the same role (not interrupted by a FINAL of that role)
+        becomes a single message that keeps the position of the first one (so the order in which
+        phrases were started is unchanged) and the content of the last one.
+    """
+    result = []
+    # role -> index in `result` of the REALTIME message that is still open for that role
+    open_realtime = {}
+    for message in messages:
+        role = message['role']
+        if message['transcription_type'] == MESSAGE_TYPE.REALTIME:
+            if role in open_realtime:
+                result[open_realtime[role]] = message
+            else:
+                open_realtime[role] = len(result)
+                result.append(message)
         else:
-            return self._list[:max(self._last_message_id['user']['realtime'], self._last_message_id['assistant']['realtime'])]
\ No newline at end of file
+            open_realtime.pop(role, None)
+            result.append(message)
+    return result
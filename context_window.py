@@ -0,0 +1,180 @@
+from contextlib import nullcontext
+from threading import Event, Lock, Thread
+
+from chat_history import ChatHistory, ROLE
+from gpt_request import APIProvider, _LLMAPI
+from timeline import Turn
+
+# Prompt token budget (system prompt + summary + transcript) per provider and model.
+#   (provider, None) is the default for models of that provider that aren't listed
+CONTEXT_TOKEN_BUDGET = {
+    (APIProvider.OPENAI, None): 32000,
+    (APIProvider.OPENAI, 'gpt-4.1-nano'): 32000,
+    # Leaves room for the reply in Ollama's default 4096 token context
+    (APIProvider.OLLAMA, None): 3000,
+}
+# Share of the budget kept as verbatim recent turns, the rest is for the system prompt and the summary
+VERBATIM_SHARE = 0.7
+# Don't call the LLM to fold fewer turns than this into the summary
+FOLD_MIN_TURNS = 4
+SUMMARY_MAX_WORDS = 250
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a job interview transcript.
+Update the given summary with the new part of the transcript. Keep the questions asked, the candidate's answers,
+and anything notable about how the interview is going. Reply with the updated summary only, at most {} words.
+""".format(SUMMARY_MAX_WORDS)
+SUMMARY_PREFIX = "Summary of the earlier part of the interview:\n"
+
+_encoding = None
+_encoding_loaded = False
+
+
+def count_tokens(text: str) -> int:
+    """
+        Counts tokens with tiktoken if it's installed, otherwise estimates ~4 characters per token
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception:
+            _encoding = None
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def token_budget(provider: APIProvider, model: str) -> int:
+    return CONTEXT_TOKEN_BUDGET.get((provider, model), CONTEXT_TOKEN_BUDGET[(provider, None)])
+
+
+class ContextWindow:
+    """
+        Sits between ChatHistory and _LLMAPI.chat and keeps the prompt within a token budget.
+        The prompt is the dialogue in the order it was said (the turns of the history's timeline),
+        the most recent whole turns are sent verbatim, older ones are folded into a summary.
+        The summary is updated in the background whenever a FINAL message lands (see `notify_final`),
+        so building the prompt for a request never waits for the LLM.
+        A final transcription that arrives after the part of the dialogue it belongs to was folded
+        is in neither (it would take re-summarizing everything after it)
+    """
+    def __init__(self, llm: _LLMAPI, chat_history: ChatHistory, budget: int, history_lock: Lock = None):
+        self.llm = llm
+        self.chat_history = chat_history
+        self.budget = budget
+        # Held while the history is read (here and on the summary thread), when it's written on another thread
+        self._history_lock = history_lock if history_lock is not None else nullcontext()
+
+        self.summary = ''
+        # Words that started before this time (time.time()) are covered by the summary, None: nothing is
+        self.summarized_before: float = None
+
+        self._lock = Lock()
+        # Bumped by `reset` so that a summary computed for a cleared history is thrown away
+        self._generation = 0
+        # turn key -> (content, tokens), so only the turns that changed are counted again
+        self._token_cache = {}
+        self._wake = Event()
+        self._closed = False
+        Thread(target=self._run, daemon=True).start()
+
+    def notify_final(self) -> None:
+        self._wake.set()
+
+    def close(self) -> None:
+        """
+            Stops the background summarization (e.g. when a server session ends)
+        """
+        self._closed = True
+        self._wake.set()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.summary = ''
+            self.summarized_before = None
+            self._generation += 1
+            self._token_cache = {}
+
+    def messages(self) -> list[dict]:
+        """
+            The prompt for the next request: summary (if any) followed by the recent turns
+            up to the end of the latest final message of the interviewer
+        """
+        with self._lock:
+            summary, summarized_before = self.summary, self.summarized_before
+
+        available = self.budget - count_tokens(self.llm.system_prompt) - count_tokens(summary)
+        turns = self._turns(summarized_before)
+        messages = [turn.as_message() for turn in turns[self._fit_from_end(turns, available):]]
+        if summary and messages:
+            messages.insert(0, {"role": "system", "content": SUMMARY_PREFIX + summary})
+        return messages
+
+    def _turns(self, since: float) -> list[Turn]:
+        with self._history_lock:
+            until = self.chat_history.latest_user_final_end()
+            if until is None:
+                return []
+            return self.chat_history.timeline.select(since=since, until=until)
+
+    def _tokens(self, turn: Turn) -> int:
+        content = turn.content
+        cached = self._token_cache.get(turn.key)
+        if cached is None or cached[0] != content:
+            cached = (content, count_tokens(content))
+            self._token_cache[turn.key] = cached
+        return cached[1]
+
+    def _fit_from_end(self, turns: list[Turn], tokens: int) -> int:
+        """
+            The smallest index such that the whole turns from it on fit into `tokens`
+        """
+        start = len(turns)
+        while start > 0:
+            tokens -= self._tokens(turns[start - 1])
+            if tokens < 0:
+                break
+            start -= 1
+        return start
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            try:
+                self._fold()
+            except Exception:
+                # The summary is best effort, the recent turns are still sent as they are
+                pass
+
+    def _fold(self) -> None:
+        with self._lock:
+            summary, summarized_before, generation = self.summary, self.summarized_before, self._generation
+
+        turns = self._turns(summarized_before)
+        # The latest turn stays, even when it doesn't fit on its own
+        fold = min(self._fit_from_end(turns, int(self.budget * VERBATIM_SHARE)), len(turns) - 1)
+        # Phrases that are still being transcribed can't be summarized yet, and neither can what follows them
+        fold = next((i for i, turn in enumerate(turns[:fold]) if turn.realtime), fold)
+        if fold < FOLD_MIN_TURNS:
+            return
+
+        transcript = '\n'.join(
+            ('Interviewer: ' if turn.role is ROLE.USER else 'Candidate: ') + turn.content for turn in turns[:fold]
+        )
+        request = [{
+            "role": "user",
+            "content": "Current summary:\n" + (summary or '(empty)') + "\n\nNew part of the transcript:\n" + transcript
+        }]
+        new_summary = ''.join(self.llm.chat(request, Event(), system_prompt=SUMMARY_PROMPT))
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.summary = new_summary.strip()
+            self.summarized_before = turns[fold].key[0]
@@ -1,9 +1,18 @@
 import time
 import requests
+from requests.adapters import HTTPAdapter
 from enum import Enum
+import asyncio
+import socket
 import json
-from threading import Event
-from typing import Generator
+from threading import Event, Lock
+from typing import AsyncGenerator, Generator
+
+try:
+    # Optional, a faster drop-in for parsing the streamed JSON
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 SYSTEM_PROMPT = """
 You are roleplaying as a coach for the job applicant being interviewed for a professional position. 
@@ -11,18 +20,216 @@ Your goal is to provide feedback on how the interview is going based on the prov
 The feedback should include potential points of improvements 
 """
 
+# How long the list of available models is reused before it's downloaded again
+MODEL_LIST_TTL = 300
+# Keep-alive connections kept open per provider (feedback, summary and warm-up may run at the same time)
+CONNECTION_POOL_SIZE = 4
+
 from abc import ABC, abstractmethod
 
+
+class StreamStats:
+    """
+        Timings of a single streamed chat request (time.monotonic based)
+    """
+    def __init__(self):
+        self.sent_at: float = time.monotonic()
+        self.first_chunk_at: float = None
+        self.last_chunk_at: float = None
+        self.chunks: int = 0
+        # Filled in from the provider's usage report when it sends one
+        self.completion_tokens: int = None
+        self.prompt_tokens: int = None
+        # Server side timings (Ollama reports them with its last message), in seconds
+        self.load_seconds: float = None
+        self.prompt_eval_seconds: float = None
+        self.eval_seconds: float = None
+        self.total_seconds: float = None
+
+    def chunk(self) -> None:
+        now = time.monotonic()
+        if self.first_chunk_at is None:
+            self.first_chunk_at = now
+        self.last_chunk_at = now
+        self.chunks += 1
+
+    @property
+    def time_to_first_token(self) -> float:
+        if self.first_chunk_at is None:
+            return None
+        return self.first_chunk_at - self.sent_at
+
+    @property
+    def tokens_per_second(self) -> float:
+        tokens = self.completion_tokens if self.completion_tokens is not None else self.chunks
+        if self.first_chunk_at is None or self.last_chunk_at == self.first_chunk_at:
+            return None
+        # The first token marks the start of the generation
+        return (tokens - 1) / (self.last_chunk_at - self.first_chunk_at)
+
+    @property
+    def server_tokens_per_second(self) -> float:
+        """
+            Generation speed as measured by the server, without the network and the client in the way
+        """
+        if not self.completion_tokens or not self.eval_seconds:
+            return None
+        return self.completion_tokens / self.eval_seconds
+
+    @property
+    def prompt_tokens_per_second(self) -> float:
+        if not self.prompt_tokens or not self.prompt_eval_seconds:
+            return None
+        return self.prompt_tokens / self.prompt_eval_seconds
+
+    def ollama_metrics(self, data: dict) -> None:
+        """
+            Reads the counts and the durations (in ns) of Ollama's final (`done`) message
+        """
+        self.completion_tokens = data.get('eval_count', self.completion_tokens)
+        self.prompt_tokens = data.get('prompt_eval_count', self.prompt_tokens)
+        for field in ('load', 'prompt_eval', 'eval', 'total'):
+            if data.get(field + '_duration') is not None:
+                setattr(self, field + '_seconds', data[field + '_duration'] / 1e9)
+
+
+class ThinkFilter:
+    """
+        Drops the reasoning (`<think>…</think>`) from a streamed reply.
+        The text is fed as it arrives, and a tag may be split across any number of chunks:
+        a chunk ending with what could be the start of a tag is held back until the next one tells
+    """
+    OPEN = '<think>'
+    CLOSE = '</think>'
+
+    def __init__(self):
+        self.thinking = False
+        self._pending = ''
+        # The blank lines that follow the reasoning are dropped too
+        self._after_thought = False
+
+    def feed(self, text: str) -> str:
+        """
+            Returns the part of the reply (so far) that is not reasoning, possibly empty
+        """
+        text = self._pending + text
+        self._pending = ''
+        visible = []
+        while text:
+            tag = self.CLOSE if self.thinking else self.OPEN
+            i = text.find(tag)
+            if i >= 0:
+                if not self.thinking:
+                    visible.append(self._visible(text[:i]))
+                text = text[i + len(tag):]
+                self.thinking = not self.thinking
+                self._after_thought = not self.thinking
+                continue
+
+            keep = self._partial_tag(text, tag)
+            if not self.thinking:
+                visible.append(self._visible(text[:len(text) - keep]))
+            self._pending = text[len(text) - keep:]
+            break
+        return ''.join(visible)
+
+    def flush(self) -> str:
+        """
+            The held back text, once the reply is over (it wasn't a tag after all)
+        """
+        pending, self._pending = self._pending, ''
+        return '' if self.thinking else self._visible(pending)
+
+    def _visible(self, text: str) -> str:
+        if self._after_thought:
+            text = text.lstrip()
+            self._after_thought = not text
+        return text
+
+    @staticmethod
+    def _partial_tag(text: str, tag: str) -> int:
+        """
+            Length of the longest end of `text` that is the beginning of `tag`
+        """
+        start = text.find('<', max(0, len(text) - len(tag) + 1))
+        while start >= 0:
+            if tag.startswith(text[start:]):
+                return len(text) - start
+            start = text.find('<', start + 1)
+        return 0
+
+
+class CancelToken(Event):
+    """
+        An Event that, when set, also aborts the HTTP stream attached to it.
+        The socket is shut down, so a thread blocked waiting for the next chunk wakes up right away
+    """
+    def __init__(self):
+        super().__init__()
+        self._response_lock = Lock()
+        self._response = None
+
+    def attach(self, response) -> None:
+        with self._response_lock:
+            self._response = response
+        if self.is_set():
+            self._abort()
+
+    def detach(self) -> None:
+        with self._response_lock:
+            self._response = None
+
+    def set(self) -> None:
+        super().set()
+        self._abort()
+
+    def _abort(self) -> None:
+        with self._response_lock:
+            response, self._response = self._response, None
+        if response is None:
+            return
+        # Once the response is fully read its connection goes back to the pool and `_connection` is None
+        sock = getattr(getattr(response.raw, '_connection', None), 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+
+def _attach(terminate: Event, response) -> None:
+    if isinstance(terminate, CancelToken):
+        terminate.attach(response)
+
+
+def _detach(terminate: Event) -> None:
+    if isinstance(terminate, CancelToken):
+        terminate.detach()
+
+
 # Abstract class from where each LLM provider API will be interited
 class _LLMAPI:
     @abstractmethod
-    def __init__(self):
-        self.baseurl:str = None
+    def __init__(self, baseurl: str = None):
+        self.baseurl:str = baseurl
         self.list_models_endpoint: str = None
         self.header:dict = {"Content-Type": "application/json"}
         self.model:str = None
         self.system_prompt = SYSTEM_PROMPT
 
+        # One pooled keep-alive session per provider, so that requests
+        #   after the first one don't pay for the TCP (and TLS) handshake again
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=CONNECTION_POOL_SIZE, pool_maxsize=CONNECTION_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._models: list[str] = None
+        self._models_fetched_at: float = 0
+        # Timings of the latest chat request
+        self.last_stats: StreamStats = None
+
     @abstractmethod
     def authenticate(self) -> None:
         raise NotImplementedError
@@ -30,149 +237,277 @@ class _LLMAPI:
     def set_system_prompt(self,new_prompt) -> None:
         self.system_prompt = new_prompt
 
+    def list_models(self, refresh: bool = False) -> list[str]:
+        """
+            Names of the available models, cached for MODEL_LIST_TTL seconds
+        """
+        if refresh or self._models is None or time.monotonic() - self._models_fetched_at > MODEL_LIST_TTL:
+            self._models = self._fetch_models()
+            self._models_fetched_at = time.monotonic()
+        return self._models
+
     @abstractmethod
-    def list_models(self) -> list[str]:
+    def _fetch_models(self) -> list[str]:
         raise NotImplementedError
 
-    @abstractmethod
     def select_model(self, model: str) -> None:
-        raise NotImplementedError
-    
+        all_model_names = self.list_models()
+        if model not in all_model_names:
+            raise Exception("Selected model '" + model + "' not in: " + ', '.join(all_model_names))
+        self.model = model
+
+    def warm_up(self) -> None:
+        """
+            Opens the connection ahead of the first real request.
+            Providers may do more (e.g. load the model into memory)
+        """
+        self.list_models(refresh=True)
+
+    def close(self) -> None:
+        self.session.close()
+
     @abstractmethod
-    def chat(self, chat_history) -> Generator[str, None, None]:
+    def chat(self, chat_history, terminate: Event, system_prompt: str = None) -> Generator[str, None, None]:
+        """
+            Streams the reply to `chat_history`. `system_prompt` overrides the instance's one for this request.
+            Stops when `terminate` is set (immediately if it's a CancelToken)
+        """
         raise NotImplementedError
 
+    async def achat(self, chat_history, system_prompt: str = None) -> AsyncGenerator[str, None]:
+        """
+            Async version of `chat`. The (blocking) stream is read on a worker thread
+            and cancelling the task that consumes this generator closes the connection right away
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        terminate = CancelToken()
+        done = object()
+
+        def put(item):
+            try:
+                loop.call_soon_threadsafe(chunks.put_nowait, item)
+            except RuntimeError:
+                # The loop is already closed, nobody is waiting for the chunks
+                pass
+
+        def pump():
+            try:
+                for chunk in self.chat(chat_history, terminate, system_prompt):
+                    put(chunk)
+                put(done)
+            except Exception as e:
+                put(e)
+
+        loop.run_in_executor(None, pump)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            terminate.set()
+
 
 class OpenAIAPI(_LLMAPI):
-    def __init__(self):
-        super().__init__()
-        self.baseurl = "https://api.openai.com/v1"
+    def __init__(self, baseurl: str = "https://api.openai.com/v1"):
+        super().__init__(baseurl)
         self.list_models_endpoint: str = 'models'
         self.chat_endpoint: str = 'chat/completions'
 
     def authenticate(self, apikey_filepath: str = 'apikey') -> None:
         with open(apikey_filepath, 'r') as k:
-            self.header["Authorization"] = "Bearer " + k.read()
+            self.header["Authorization"] = "Bearer " + k.read().strip()
 
-    def list_models(self) -> list[str]:
+    def _fetch_models(self) -> list[str]:
         if not(self.header.get("Authorization")):
             raise Exception("Not authenticated")
-        models_response = requests.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
+        models_response = self.session.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
         models_response.raise_for_status()
 
         all_models = json.loads(models_response.content)
         all_model_names = [x['id'] for x in all_models['data']]
         return all_model_names
-        
 
     def select_model(self, model: str = "gpt-4.1-nano") -> None:
-        if not(self.header.get("Authorization")):
-            raise Exception("Not authenticated")
-        models_response = requests.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
-        models_response.raise_for_status()
-
-        all_models = json.loads(models_response.content)
-        all_model_names = [x['id'] for x in all_models['data']]
-        if model not in all_model_names:
-            raise Exception("Selected model '" + model + "' not in: " + ', '.join(all_model_names))
-        
-        self.select_model = model
+        super().select_model(model)
 
-    def chat(self, chat_history, terminate: Event) -> Generator[str, None, None]:
+    def chat(self, chat_history, terminate: Event, system_prompt: str = None) -> Generator[str, None, None]:
         if not(self.header.get("Authorization")):
             raise Exception("Not authenticated")
-        if not(self.select_model):
+        if not(self.model):
             raise Exception("Model not selected")
 
-        with requests.post(
-            self.baseurl + '/' + self.chat_endpoint, 
+        self.last_stats = stats = StreamStats()
+        with self.session.post(
+            self.baseurl + '/' + self.chat_endpoint,
             headers=self.header,
             json={
-                "model": self.select_model,
-                "messages": [{"role": "system", "content": self.system_prompt}] + chat_history
-            }
+                "model": self.model,
+                "messages": [{"role": "system", "content": system_prompt or self.system_prompt}] + chat_history,
+                "stream": True,
+                "stream_options": {"include_usage": True}
+            },
+            stream=True
         ) as chat_response:
             chat_response.raise_for_status()
-            
-            response_json = json.loads(chat_response.content)
-            yield response_json.get('choices', [{}])[0].get('message', {}).get('content', '')
+            _attach(terminate, chat_response)
+
+            try:
+                for event in self._server_sent_events(chat_response):
+                    if event == '[DONE]':
+                        break
+                    data = json.loads(event)
+
+                    if data.get('usage'):
+                        stats.completion_tokens = data['usage'].get('completion_tokens')
+                        stats.prompt_tokens = data['usage'].get('prompt_tokens')
+                    for choice in data.get('choices', []):
+                        content = choice.get('delta', {}).get('content')
+                        if content:
+                            stats.chunk()
+                            yield content
+
+                    # Leaving the `with` closes the connection, which stops the generation
+                    if terminate.is_set():
+                        break
+            except Exception:
+                # Reading fails once a CancelToken aborts the connection
+                if not terminate.is_set():
+                    raise
+            finally:
+                _detach(terminate)
+
+    @staticmethod
+    def _server_sent_events(response) -> Generator[str, None, None]:
+        """
+            Yields the data of every server-sent event as it arrives.
+            An event may span several `data:` lines and ends with an empty line
+        """
+        data_lines = []
+        # chunk_size=None hands over whatever has arrived instead of waiting for a full block
+        for line in response.iter_lines(chunk_size=None):
+            if not line:
+                if data_lines:
+                    yield '\n'.join(data_lines)
+                    data_lines = []
+                continue
+            if line.startswith(b'data:'):
+                data_lines.append(line[5:].lstrip().decode('utf-8'))
+            # Comments (": keep-alive") and other fields (event:, id:, retry:) are not used by the API
+        if data_lines:
+            yield '\n'.join(data_lines)
 
 
 class OllamaAPI(_LLMAPI):
-    def __init__(self):
-        super().__init__()
-        self.baseurl = "http://localhost:11434/api"
+    def __init__(self, baseurl: str = "http://localhost:11434/api"):
+        super().__init__(baseurl)
         self.list_models_endpoint: str = 'tags'
         self.chat_endpoint: str = 'chat'
 
     def authenticate(self, **kwargs) -> None:
         return
 
-    def list_models(self) -> list[str]:
-        models_response = requests.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
+    def _fetch_models(self) -> list[str]:
+        models_response = self.session.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
         models_response.raise_for_status()
         all_models = json.loads(models_response.content)
         all_model_names = [x['name'] for x in all_models['models']]
         return all_model_names
 
     def select_model(self, model: str = 'deepseek:7b') -> None:
-        models_response = requests.get(self.baseurl + '/' + self.list_models_endpoint, headers=self.header)
-        models_response.raise_for_status()
+        super().select_model(model)
 
-        all_models = json.loads(models_response.content)
-        all_model_names = [x['name'] for x in all_models['models']]
-        if model not in all_model_names:
-            raise Exception("Selected model '" + model + "' not in: " + ', '.join(all_model_names))
-        
-        self.select_model = model
+    def warm_up(self) -> None:
+        super().warm_up()
+        if self.model:
+            # A chat request without messages makes Ollama load the model into memory
+            warm_up_response = self.session.post(
+                self.baseurl + '/' + self.chat_endpoint,
+                headers=self.header,
+                json={"model": self.model, "messages": []}
+            )
+            warm_up_response.raise_for_status()
 
-    def chat(self, chat_history, terminate: Event) -> Generator[str, None, None]:
-        _now_thinking: bool = False
-        
-        if not(self.select_model):
+    def chat(self, chat_history, terminate: Event, system_prompt: str = None) -> Generator[str, None, None]:
+        if not(self.model):
             raise Exception("Model not selected")
-        
-        # Used to terminate the generation of the 
-        #   response if another one was requested
-        terminate.set()
-        time.sleep(0.1)
-        terminate = Event()
-
-        with requests.post(
-            self.baseurl + '/' + self.chat_endpoint, 
+
+        self.last_stats = stats = StreamStats()
+        thoughts = ThinkFilter()
+        with self.session.post(
+            self.baseurl + '/' + self.chat_endpoint,
             headers=self.header,
             json={
-                "model": self.select_model,
-                "messages": [{"role": "system", "content": self.system_prompt}] + chat_history
+                "model": self.model,
+                "messages": [{"role": "system", "content": system_prompt or self.system_prompt}] + chat_history
             },
             stream=True
         ) as chat_response:
             chat_response.raise_for_status()
-            
-            for line in chat_response.iter_lines():
-                data = json.loads(line.decode("utf-8"))
-
-                if (r'<think>' in data['message']['content']):
-                    _now_thinking=True
-                if not(_now_thinking):
-                    yield(data['message']['content'])
-                if r'</think>' in data['message']['content']:
-                    _now_thinking=False
-                
-                if terminate.is_set():
-                    break
+            _attach(terminate, chat_response)
+
+            try:
+                for line in self._json_lines(chat_response):
+                    # The JSON parsers take the bytes as they are
+                    data = json_loads(line)
+                    if data.get('error'):
+                        raise Exception(data['error'])
+
+                    content = thoughts.feed(data.get('message', {}).get('content', ''))
+                    if content:
+                        stats.chunk()
+                        yield content
+                    if data.get('done'):
+                        stats.ollama_metrics(data)
+
+                    if terminate.is_set():
+                        break
+                else:
+                    content = thoughts.flush()
+                    if content:
+                        stats.chunk()
+                        yield content
+            except Exception:
+                if not terminate.is_set():
+                    raise
+            finally:
+                _detach(terminate)
+
+    @staticmethod
+    def _json_lines(response) -> Generator[bytes, None, None]:
+        """
+            Yields every (newline delimited) JSON message as soon as its line is complete
+        """
+        pending = b''
+        # chunk_size=None hands over whatever has arrived instead of waiting for a full block
+        for block in response.iter_content(chunk_size=None):
+            lines = block.split(b'\n')
+            lines[0] = pending + lines[0]
+            pending = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if pending.strip():
+            yield pending
 
 class APIProvider(Enum):
     OLLAMA = 'ollama'
     OPENAI = 'openai'
 
 
-def LLMFactory(provider: APIProvider) -> _LLMAPI:
+def LLMFactory(provider: APIProvider, **kwargs) -> _LLMAPI:
+    """
+        `kwargs` are passed to the provider, e.g. `baseurl` to point it to a local (test) server
+    """
     if provider == APIProvider.OPENAI:
-        return OpenAIAPI()
+        return OpenAIAPI(**kwargs)
     elif provider == APIProvider.OLLAMA:
-        return OllamaAPI()
+        return OllamaAPI(**kwargs)
     elif type(provider) != APIProvider:
         raise Exception("Provide a valid APIProvider enum instance")
     else:
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
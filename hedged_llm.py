@@ -0,0 +1,277 @@
+from collections import deque
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+from typing import Generator
+import time
+
+from gpt_request import _LLMAPI, CancelToken, StreamStats
+from latency import percentile
+
+# How often a waiting request checks whether it was terminated
+HEDGE_POLL_INTERVAL = 0.02
+# Weight of the newest sample in a backend's moving averages
+STATS_SMOOTHING = 0.3
+# A backend that fails every request counts as this many seconds slower to its first token
+ERROR_PENALTY = 5.0
+# A backend's error rate halves every this many seconds, so a backend demoted by an outage
+#   is tried first again once it has had time to recover (it hands over right away if it hasn't)
+ERROR_HALF_LIFE = 60.0
+# Time to first token samples kept per backend
+LATENCY_SAMPLES = 100
+
+
+class _Backend:
+    """
+        One provider of a HedgedLLMAPI and how it has been doing
+    """
+    def __init__(self, llm: _LLMAPI):
+        self.llm = llm
+        self.name = type(llm).__name__.replace('API', '') + ':' + str(llm.model)
+
+        self.requests = 0
+        self.wins = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.last_error: Exception = None
+        # Moving averages of the time to first token (seconds) and of the error rate (0..1, as of `_error_rate_at`)
+        self.ttft: float = None
+        self._error_rate = 0.0
+        self._error_rate_at = time.monotonic()
+        self.ttft_samples = deque(maxlen=LATENCY_SAMPLES)
+
+    @property
+    def error_rate(self) -> float:
+        return self._error_rate * 0.5 ** ((time.monotonic() - self._error_rate_at) / ERROR_HALF_LIFE)
+
+    def _set_error_rate(self, error_rate: float) -> None:
+        self._error_rate = error_rate
+        self._error_rate_at = time.monotonic()
+
+    def expected_ttft(self) -> float:
+        """
+            What the next request is expected to cost, the lowest goes first.
+            A backend that was never measured goes first, so that every backend gets measured
+        """
+        return (self.ttft or 0.0) + ERROR_PENALTY * self.error_rate
+
+    def record_ttft(self, seconds: float) -> None:
+        self.ttft = seconds if self.ttft is None else STATS_SMOOTHING * seconds + (1 - STATS_SMOOTHING) * self.ttft
+        self._set_error_rate(self.error_rate * (1 - STATS_SMOOTHING))
+
+    def record_slower_than(self, seconds: float) -> None:
+        """
+            Lost the race: its time to first token is unknown, but at least `seconds`
+        """
+        if self.ttft is None or self.ttft < seconds:
+            self.record_ttft(seconds)
+
+    def record_error(self, error: Exception) -> None:
+        self.errors += 1
+        self.last_error = error
+        self._set_error_rate(STATS_SMOOTHING + (1 - STATS_SMOOTHING) * self.error_rate)
+
+
+class _Attempt:
+    """
+        One backend's stream of a hedged request, read on its own thread into the shared queue
+    """
+    def __init__(self, backend: _Backend, events: Queue):
+        self.backend = backend
+        self.events = events
+        self.terminate = CancelToken()
+        self.started_at = time.monotonic()
+        self.first_chunk_at: float = None
+
+    def start(self, chat_history, system_prompt: str) -> None:
+        Thread(target=self._run, args=[chat_history, system_prompt], name="Hedge-" + self.backend.name, daemon=True).start()
+
+    def _run(self, chat_history, system_prompt: str) -> None:
+        try:
+            for chunk in self.backend.llm.chat(chat_history, self.terminate, system_prompt):
+                self.events.put((self, chunk))
+            self.events.put((self, None))
+        except Exception as e:
+            self.events.put((self, e))
+
+
+class HedgedLLMAPI(_LLMAPI):
+    """
+        Sends every request to several providers and streams whichever answers first.
+        The request goes to the primary (the backend with the best recent time to first token
+        and error rate) and, if it hasn't produced a token within `hedge_delay` seconds, to the next one too,
+        and so on. The first backend to produce a token wins, the others are cancelled (their connections closed).
+        A backend that fails before anyone wins hands over to the next one right away.
+        With hedge_delay=0 every backend is asked at once
+    """
+    def __init__(self, backends: list[_LLMAPI], hedge_delay: float = 1.0):
+        if not backends:
+            raise Exception("A hedged provider needs at least one backend")
+        self.baseurl = None
+        self.backends = [_Backend(llm) for llm in backends]
+        self.hedge_delay = hedge_delay
+        self.last_stats: StreamStats = None
+        self._lock = Lock()
+
+    @property
+    def model(self) -> str:
+        return '+'.join(backend.name for backend in self.backends)
+
+    @property
+    def system_prompt(self) -> str:
+        return self.backends[0].llm.system_prompt
+
+    def authenticate(self, **kwargs) -> None:
+        # The backends are authenticated before they're combined
+        return
+
+    def set_system_prompt(self, new_prompt) -> None:
+        for backend in self.backends:
+            backend.llm.set_system_prompt(new_prompt)
+
+    def list_models(self, refresh: bool = False) -> list[str]:
+        return [backend.name for backend in self.backends]
+
+    def _fetch_models(self) -> list[str]:
+        return self.list_models()
+
+    def select_model(self, model: str) -> None:
+        raise Exception("Select the model of each backend before combining them")
+
+    def warm_up(self) -> None:
+        for backend in self.backends:
+            try:
+                backend.llm.warm_up()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        for backend in self.backends:
+            backend.llm.close()
+
+    def ranked(self) -> list[_Backend]:
+        """
+            The backends in the order they're asked, the primary first
+        """
+        with self._lock:
+            # sorted() is stable: the configured order breaks ties
+            return sorted(self.backends, key=_Backend.expected_ttft)
+
+    def chat(self, chat_history, terminate: Event, system_prompt: str = None) -> Generator[str, None, None]:
+        events = Queue()
+        waiting = self.ranked()
+        running: list[_Attempt] = []
+        winner: _Attempt = None
+        error: Exception = None
+
+        def launch() -> None:
+            backend = waiting.pop(0)
+            with self._lock:
+                backend.requests += 1
+            attempt = _Attempt(backend, events)
+            running.append(attempt)
+            attempt.start(chat_history, system_prompt)
+
+        launch()
+        next_hedge_at = time.monotonic() + self.hedge_delay
+        try:
+            # The race: wait for a first chunk, hedging with the next backend every hedge_delay
+            while winner is None:
+                while waiting and (not running or time.monotonic() >= next_hedge_at):
+                    launch()
+                    next_hedge_at = time.monotonic() + self.hedge_delay
+                if not running:
+                    raise error
+                if terminate.is_set():
+                    return
+
+                timeout = HEDGE_POLL_INTERVAL
+                if waiting:
+                    timeout = min(timeout, max(0.0, next_hedge_at - time.monotonic()))
+                try:
+                    attempt, item = events.get(timeout=timeout)
+                except Empty:
+                    continue
+
+                if isinstance(item, Exception) or item is None:
+                    # Failed (or finished without a single chunk) before producing anything
+                    running.remove(attempt)
+                    if isinstance(item, Exception):
+                        error = item
+                        with self._lock:
+                            attempt.backend.record_error(item)
+                    elif not running and not waiting:
+                        # An empty reply is still a reply
+                        return
+                    continue
+
+                winner = attempt
+                winner.first_chunk_at = time.monotonic()
+                self._finish_race(winner, running)
+                self.last_stats = winner.backend.llm.last_stats
+                yield item
+
+            # The winner's stream, other backends' leftovers in the queue are ignored
+            while True:
+                try:
+                    attempt, item = events.get(timeout=HEDGE_POLL_INTERVAL)
+                except Empty:
+                    if terminate.is_set():
+                        return
+                    continue
+                if attempt is not winner:
+                    continue
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    with self._lock:
+                        winner.backend.record_error(item)
+                    raise item
+                yield item
+                if terminate.is_set():
+                    return
+        finally:
+            for attempt in running:
+                attempt.terminate.set()
+
+    def _finish_race(self, winner: _Attempt, running: list[_Attempt]) -> None:
+        with self._lock:
+            winner.backend.wins += 1
+            ttft = winner.first_chunk_at - winner.started_at
+            winner.backend.record_ttft(ttft)
+            winner.backend.ttft_samples.append(ttft)
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.terminate.set()
+                    attempt.backend.cancelled += 1
+                    attempt.backend.record_slower_than(winner.first_chunk_at - attempt.started_at)
+        running[:] = [winner]
+
+    def stats(self) -> dict:
+        """
+            Per backend, in the order the next request will ask them
+        """
+        result = {}
+        for backend in self.ranked():
+            with self._lock:
+                samples_ms = [s * 1000 for s in backend.ttft_samples]
+                result[backend.name] = {
+                    "requests": backend.requests,
+                    "wins": backend.wins,
+                    "cancelled": backend.cancelled,
+                    "errors": backend.errors,
+                    "error_rate": backend.error_rate,
+                    "ttft_ms": backend.ttft * 1000 if backend.ttft is not None else None,
+                    "ttft_p50_ms": percentile(samples_ms, 50),
+                    "ttft_p95_ms": percentile(samples_ms, 95),
+                    "last_error": repr(backend.last_error) if backend.last_error is not None else None,
+                }
+        return result
+
+    def report(self) -> str:
+        lines = ["LLM backends (primary first):"]
+        for name, stats in self.stats().items():
+            line = f"  {name:<28} {stats['wins']}/{stats['requests']} won, {stats['errors']} errors"
+            if stats['ttft_ms'] is not None:
+                line += f", first token ~{stats['ttft_ms']:.0f} ms"
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,184 @@
+from collections import deque
+from threading import Lock
+import json
+import time
+
+# Set by `app.py --profile`. Everything below is a no-op while it's None
+profiler: 'LatencyProfiler' = None
+
+# The stages a transcribed message goes through, in order. Not every message has all of them
+#   (the mic recorder captures the audio itself, a message is either realtime or final)
+MESSAGE_STAGES = ('capture', 'feed', 'realtime', 'final', 'enqueue', 'history', 'render')
+LLM_STAGES = ('press', 'send', 'first_chunk', 'last_chunk')
+
+# Upper bounds (in ms) of the histogram buckets in the JSON dump
+HISTOGRAM_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Samples kept per series, the oldest are dropped first
+MAX_SAMPLES = 10000
+# Ended utterances kept per role for their FINAL messages (more would mean the FINALs got lost)
+MAX_PENDING_UTTERANCES = 16
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def enable() -> 'LatencyProfiler':
+    global profiler
+    profiler = LatencyProfiler()
+    return profiler
+
+
+def mark_audio(role, stage: str, at: float = None) -> None:
+    """
+        Marks an audio side stage of `role`'s voiced audio (see StageClock)
+    """
+    if profiler is not None:
+        profiler.clock(role).mark(stage, at)
+
+
+def end_utterance(role) -> None:
+    """
+        Called when `role`'s recorder stops recording (its VAD found the end of the utterance)
+    """
+    if profiler is not None:
+        profiler.clock(role).end_utterance()
+
+
+def stamp(message: dict, role, stage: str) -> None:
+    """
+        Starts the timestamps of a message that just came out of `role`'s recorder
+    """
+    if profiler is not None:
+        message['timestamps'] = profiler.clock(role).stamp(stage)
+
+
+def mark(message: dict, stage: str) -> None:
+    timestamps = message.get('timestamps')
+    if timestamps is not None:
+        timestamps[stage] = time.monotonic()
+
+
+def record_message(message: dict) -> None:
+    timestamps = message.get('timestamps')
+    if profiler is not None and timestamps is not None:
+        profiler.record(message['transcription_type'].value, timestamps)
+
+
+def record_llm(timestamps: dict[str, float]) -> None:
+    if profiler is not None:
+        profiler.record('llm', timestamps, LLM_STAGES)
+
+
+class StageClock:
+    """
+        The audio side stages (capture, feed) of one role, marked for voiced audio only: the times are
+        those of the last speech the recorder got, not of the silence or noise after it.
+        When the recorder ends an utterance, its times are queued for the FINAL message that transcribes it,
+        so a FINAL is stamped with the end of its own utterance even if the next one has started by then.
+        Realtime messages are stamped with the times of the utterance in progress
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.times: dict[str, float] = {}
+        self._ended: deque[dict[str, float]] = deque(maxlen=MAX_PENDING_UTTERANCES)
+
+    def mark(self, stage: str, at: float = None) -> None:
+        with self._lock:
+            self.times[stage] = at if at is not None else time.monotonic()
+
+    def end_utterance(self) -> None:
+        with self._lock:
+            # Queued even when empty, so the FINALs keep matching their utterances in order
+            self._ended.append(self.times)
+            self.times = {}
+
+    def stamp(self, stage: str) -> dict[str, float]:
+        """
+            The timestamps a message starts with: 'final' takes the oldest ended utterance's
+        """
+        with self._lock:
+            if stage == 'final':
+                timestamps = self._ended.popleft() if self._ended else {}
+            else:
+                timestamps = self.times.copy()
+        timestamps[stage] = time.monotonic()
+        return timestamps
+
+
+class LatencyProfiler:
+    """
+        Collects the time between consecutive stages of every message (and LLM request)
+        into one series per stage pair, e.g. "final feed→final"
+    """
+    def __init__(self):
+        self._clocks: dict = {}
+        self._series: dict[str, list[float]] = {}
+        self._lock = Lock()
+
+    def clock(self, role) -> StageClock:
+        clock = self._clocks.get(role)
+        if clock is None:
+            clock = self._clocks.setdefault(role, StageClock())
+        return clock
+
+    def record(self, kind: str, timestamps: dict[str, float], stages: tuple = MESSAGE_STAGES) -> None:
+        """
+            `kind` prefixes the series names (realtime / final / llm)
+        """
+        present = [(stage, timestamps[stage]) for stage in stages if stage in timestamps]
+        if len(present) < 2:
+            return
+        with self._lock:
+            for (a, started), (b, finished) in zip(present, present[1:]):
+                self._add(f"{kind} {a}→{b}", finished - started)
+            self._add(f"{kind} end to end", present[-1][1] - present[0][1])
+
+    def sample(self, name: str, seconds: float) -> None:
+        """
+            Adds a single measurement (not a stage pair) to a series, e.g. how long a realtime pass took
+        """
+        with self._lock:
+            self._add(name, seconds)
+
+    def _add(self, name: str, seconds: float) -> None:
+        samples = self._series.setdefault(name, [])
+        samples.append(seconds)
+        if len(samples) > MAX_SAMPLES:
+            del samples[:len(samples) - MAX_SAMPLES]
+
+    def summary(self) -> dict[str, dict]:
+        """
+            Per series: sample count, p50 / p95 / p99 / max (in ms) and a histogram
+        """
+        with self._lock:
+            series = {name: list(samples) for name, samples in self._series.items()}
+
+        result = {}
+        for name in sorted(series):
+            samples_ms = [s * 1000 for s in series[name]]
+            histogram = {f"<={bound}ms": 0 for bound in HISTOGRAM_BUCKETS_MS}
+            histogram[f">{HISTOGRAM_BUCKETS_MS[-1]}ms"] = 0
+            for ms in samples_ms:
+                for bound in HISTOGRAM_BUCKETS_MS:
+                    if ms <= bound:
+                        histogram[f"<={bound}ms"] += 1
+                        break
+                else:
+                    histogram[f">{HISTOGRAM_BUCKETS_MS[-1]}ms"] += 1
+            result[name] = {
+                "count": len(samples_ms),
+                "p50": percentile(samples_ms, 50),
+                "p95": percentile(samples_ms, 95),
+                "p99": percentile(samples_ms, 99),
+                "max": max(samples_ms),
+                "histogram": histogram,
+            }
+        return result
+
+    def dump(self, file_path: str) -> None:
+        with open(file_path, 'w', encoding='utf-8') as jf:
+            json.dump(self.summary(), jf, indent=2, ensure_ascii=False)
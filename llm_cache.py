@@ -0,0 +1,224 @@
+from collections import OrderedDict
+from threading import Event, Lock
+from typing import Generator
+import hashlib
+import json
+import os
+
+from gpt_request import _LLMAPI, StreamStats
+
+# Responses kept in memory
+LLM_CACHE_ENTRIES = 64
+# Responses kept on disk (in LLM_CACHE_DIR) take up at most this many bytes, the least recently used go first
+LLM_CACHE_DISK_BYTES = 20 * 1024 * 1024
+
+
+def request_key(llm: _LLMAPI, messages: list[dict], system_prompt: str = None) -> str:
+    """
+        Identifies a request: the provider (and its server), the model, the system prompt and the messages
+    """
+    messages_hash = hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode('utf-8')).hexdigest()
+    payload = json.dumps([type(llm).__name__, llm.baseurl, llm.model, system_prompt or llm.system_prompt, messages_hash],
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+        Complete responses (as the chunks they were streamed in) by request key.
+        An LRU in memory and, when `directory` is given, a second LRU tier on disk that outlives the app.
+        Thread-safe
+    """
+    def __init__(self, entries: int = LLM_CACHE_ENTRIES, directory: str = None, disk_bytes: int = LLM_CACHE_DISK_BYTES):
+        self.entries = entries
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._memory: OrderedDict[str, list[str]] = OrderedDict()
+        # key -> file size, least recently used first
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        self._lock = Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            files = []
+            for entry in os.scandir(directory):
+                if entry.is_file() and entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name[:-len('.json')], stat.st_size))
+            for _, key, size in sorted(files):
+                self._disk[key] = size
+                self._disk_size += size
+            with self._lock:
+                self._evict_disk()
+
+    def get(self, key: str) -> list[str]:
+        with self._lock:
+            chunks = self._memory.get(key)
+            if chunks is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return chunks
+            if key in self._disk:
+                chunks = self._read(key)
+                if chunks is not None:
+                    self._disk.move_to_end(key)
+                    self._remember(key, chunks)
+                    self.disk_hits += 1
+                    return chunks
+            self.misses += 1
+            return None
+
+    def put(self, key: str, chunks: list[str]) -> None:
+        with self._lock:
+            self._remember(key, chunks)
+            if self.directory is not None:
+                self._write(key, chunks)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._disk):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            requests = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / requests if requests else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+                "evictions": self.evictions,
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (f"LLM response cache: {stats['hits']} hits ({stats['memory_hits']} memory, {stats['disk_hits']} disk), "
+                f"{stats['misses']} misses, {stats['hit_rate']:.0%} hit rate")
+
+    def _remember(self, key: str, chunks: list[str]) -> None:
+        self._memory[key] = chunks
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def _read(self, key: str) -> list[str]:
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as cf:
+                chunks = json.load(cf)['chunks']
+            # The file's modification time is its last use, the order is rebuilt from it at the next start
+            os.utime(self._path(key))
+            return chunks
+        except (OSError, ValueError, KeyError):
+            self._remove(key)
+            return None
+
+    def _write(self, key: str, chunks: list[str]) -> None:
+        data = json.dumps({"chunks": chunks}, ensure_ascii=False).encode('utf-8')
+        if len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        try:
+            with open(path + '.tmp', 'wb') as cf:
+                cf.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            # The disk tier is best effort, the response is still in memory
+            return
+        self._disk_size += len(data) - self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        while self._disk_size > self.disk_bytes and self._disk:
+            self._remove(next(iter(self._disk)))
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        self._disk_size -= self._disk.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+class CachedLLMAPI(_LLMAPI):
+    """
+        Puts a ResponseCache in front of a provider. A repeated request (e.g. F7 pressed again
+        with nothing new said) is replayed from the cache through the same `chat` / `achat` generators,
+        chunk by chunk, so the consumers can't tell the difference.
+        Only responses that streamed to the end are cached, a cancelled or failed one is not
+    """
+    def __init__(self, llm: _LLMAPI, cache: ResponseCache):
+        self.llm = llm
+        self.cache = cache
+        self.last_stats: StreamStats = None
+
+    def __getattr__(self, name: str):
+        # Everything provider specific (baseurl, header, session, ...) is the wrapped provider's
+        return getattr(self.llm, name)
+
+    @property
+    def model(self) -> str:
+        return self.llm.model
+
+    @property
+    def system_prompt(self) -> str:
+        return self.llm.system_prompt
+
+    def authenticate(self, *args, **kwargs) -> None:
+        self.llm.authenticate(*args, **kwargs)
+
+    def set_system_prompt(self, new_prompt) -> None:
+        self.llm.set_system_prompt(new_prompt)
+
+    def list_models(self, refresh: bool = False) -> list[str]:
+        return self.llm.list_models(refresh)
+
+    def _fetch_models(self) -> list[str]:
+        return self.llm._fetch_models()
+
+    def select_model(self, model: str) -> None:
+        self.llm.select_model(model)
+
+    def warm_up(self) -> None:
+        self.llm.warm_up()
+
+    def close(self) -> None:
+        self.llm.close()
+
+    def chat(self, chat_history, terminate: Event, system_prompt: str = None) -> Generator[str, None, None]:
+        key = request_key(self.llm, chat_history, system_prompt)
+        chunks = self.cache.get(key)
+        if chunks is not None:
+            self.last_stats = stats = StreamStats()
+            for chunk in chunks:
+                if terminate.is_set():
+                    return
+                stats.chunk()
+                yield chunk
+            return
+
+        response = []
+        for chunk in self.llm.chat(chat_history, terminate, system_prompt):
+            self.last_stats = self.llm.last_stats
+            response.append(chunk)
+            yield chunk
+        # A stopped provider simply stops yielding, only a response that wasn't terminated is complete
+        if response and not terminate.is_set():
+            self.cache.put(key, response)
@@ -0,0 +1,61 @@
+from concurrent.futures import Future
+from threading import Thread
+import asyncio
+
+
+class LLMClient:
+    """
+        Runs LLM requests as asyncio tasks on a dedicated event loop thread,
+        so that callers (e.g. the keyboard hook thread) never block on them.
+        Requests are named: submitting a request under a name that is still running
+        cancels the running one first (which closes its connection, see _LLMAPI.achat).
+        Requests under different names (e.g. feedback and summary) run concurrently.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._tasks: dict[str, asyncio.Task] = {}
+        Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def submit(self, name: str, coroutine) -> Future:
+        """
+            Thread-safe. Returns a concurrent.futures.Future of the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(self._replace(name, coroutine), self.loop)
+
+    def cancel(self, name: str) -> None:
+        self.loop.call_soon_threadsafe(self._cancel, name)
+
+    def is_running(self, name: str) -> bool:
+        task = self._tasks.get(name)
+        return task is not None and not task.done()
+
+    def stop(self) -> None:
+        def _stop():
+            for task in self._tasks.values():
+                task.cancel()
+            self.loop.stop()
+        self.loop.call_soon_threadsafe(_stop)
+
+    def _cancel(self, name: str) -> None:
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    async def _replace(self, name: str, coroutine):
+        previous = self._tasks.get(name)
+        current = asyncio.current_task()
+        self._tasks[name] = current
+        started = False
+        try:
+            if previous is not None and not previous.done():
+                previous.cancel()
+                # Let the previous request finish cancelling before the new one starts producing output
+                await asyncio.gather(previous, return_exceptions=True)
+            started = True
+            return await coroutine
+        finally:
+            if not started:
+                # Replaced by an even newer request before it got to run
+                coroutine.close()
+            if self._tasks.get(name) is current:
+                del self._tasks[name]
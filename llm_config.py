@@ -0,0 +1,72 @@
+"""
+    The LLM provider settings and how the provider is loaded, shared by the app (textual_ui.py) and server.py
+"""
+from os import path
+
+from gpt_request import LLMFactory, APIProvider, _LLMAPI
+from llm_cache import CachedLLMAPI, ResponseCache
+from hedged_llm import HedgedLLMAPI
+from context_window import token_budget
+
+LLM_PROVIDER = APIProvider.OPENAI
+LLM_MODEL = 'gpt-4.1-nano'
+# More providers to send the requests to, e.g. [(APIProvider.OLLAMA, 'deepseek:7b')]. Each request goes to
+#   the one that has been answering fastest and, if there's no answer after LLM_HEDGE_DELAY seconds, to the next
+#   one as well. The first to answer is streamed, the others are cancelled (0 asks all of them at once)
+LLM_HEDGE_BACKENDS = []
+LLM_HEDGE_DELAY = 1.0
+# Open the connection to the LLM provider (and for Ollama, load the model) right at startup
+LLM_WARM_UP = True
+# Replay the response of a request that was already answered (same model, system prompt and transcript)
+#   instead of sending it again. Responses are kept in memory and, unless LLM_CACHE_DIR is None, on disk
+LLM_CACHE = True
+LLM_CACHE_DIR = 'llm_cache'
+
+
+def load_backend(provider: APIProvider, model: str) -> _LLMAPI:
+    llm = LLMFactory(provider)
+    llm.authenticate()
+    llm.select_model(model)
+
+    if path.isfile('systemprompt.txt'):
+        with open('systemprompt.txt', 'r', encoding='utf-8') as spf:
+            llm.set_system_prompt(spf.read())
+    return llm
+
+
+def load_llm() -> _LLMAPI:
+    """
+        Checks the credentials and the model with the provider (a network round trip), runs on a startup thread
+    """
+    if not LLM_HEDGE_BACKENDS:
+        gptService = load_backend(LLM_PROVIDER, LLM_MODEL)
+    else:
+        backends, error = [], None
+        for provider, model in [(LLM_PROVIDER, LLM_MODEL)] + LLM_HEDGE_BACKENDS:
+            try:
+                backends.append(load_backend(provider, model))
+            except Exception as e:
+                # The others can still answer
+                error = error or e
+        if not backends:
+            raise error
+        gptService = HedgedLLMAPI(backends, LLM_HEDGE_DELAY)
+
+    if LLM_CACHE:
+        gptService = CachedLLMAPI(gptService, ResponseCache(directory=LLM_CACHE_DIR))
+    return gptService
+
+
+def context_budget() -> int:
+    """
+        The prompt has to fit every provider it may be sent to
+    """
+    return min(token_budget(provider, model) for provider, model in [(LLM_PROVIDER, LLM_MODEL)] + LLM_HEDGE_BACKENDS)
+
+
+def warm_up(gptService: _LLMAPI):
+    try:
+        gptService.warm_up()
+    except Exception:
+        # Only an optimization, the first request will simply open the connection itself
+        pass
@@ -0,0 +1,209 @@
+"""
+    Offline replay of a recorded interview.
+
+    Feeds two WAV files (the interviewer's and the candidate's track) through the same
+    resample -> AudioToTextRecorder.feed_audio -> message_queue -> ChatHistory path as the live app,
+    without any audio devices or UI, and reports throughput and latency at the end.
+
+    python replay.py interviewer.wav candidate.wav --speed 1    # real time
+    python replay.py interviewer.wav candidate.wav --speed 4    # 4x
+    python replay.py interviewer.wav candidate.wav --speed 0    # as fast as possible
+"""
+from RealtimeSTT import AudioToTextRecorder
+from collections import deque
+from queue import Queue, Empty
+import numpy as np
+import argparse
+import threading
+import json
+import time
+
+from audio_capture import SpeakerCapture, read_wav
+from chat_history import ChatHistory, MESSAGE_TYPE, ROLE
+from latency import percentile
+from shared_engine import SharedTranscriptionEngine
+from transcription import recorder_config, make_recorder_config, poll_recorder, realtime_transcription, TARGET_RATE, MESSAGE_QUEUE_SIZE, END_OF_UTTERANCE_SILENCE, SHARE_TRANSCRIPTION_MODELS, ADAPTIVE_REALTIME_PAUSE
+from scheduler import RealtimeScheduler
+
+# Frames pushed per block, same as the live speaker stream
+CHUNK = 5024
+# A block whose RMS is above this is treated as speech when measuring latency
+VOICED_RMS = 300
+# A voiced segment of a track ends after this much unvoiced audio, as the recorder's VAD ends an utterance
+SEGMENT_GAP = recorder_config['post_speech_silence_duration']
+# Stop waiting for more FINAL messages after this much time without any
+IDLE_TIMEOUT = 10
+
+
+class TrackFeeder:
+    """
+        Pushes one track into its capture pipeline block by block, paced to `speed`
+        (0 means as fast as the pipeline accepts it), and remembers when the last voiced block
+        of every voiced segment was pushed, so that each FINAL message can be timed against
+        the end of the utterance it transcribes (see `take_segment_end`).
+    """
+    def __init__(self, samples: np.ndarray, rate: int, channels: int, capture: SpeakerCapture, speed: float):
+        self.samples = samples
+        self.rate = rate
+        self.channels = channels
+        self.capture = capture
+        self.speed = speed
+        self.duration = len(samples) / channels / rate
+        self.done = threading.Event()
+
+        self._lock = threading.Lock()
+        # When the last voiced block of every closed segment was pushed, oldest first, not matched to a FINAL yet
+        self._segment_ends = deque()
+        # Same for the segment still going on (None if there is none), and the unvoiced audio since it
+        self._open_end = None
+        self._quiet_seconds = 0.0
+
+    def take_segment_end(self) -> float:
+        """
+            The end of the oldest voiced segment no FINAL was matched to yet (None if there is none).
+            With the feeder running ahead (--speed 0) several segments may be waiting, the FINALs come in order
+        """
+        with self._lock:
+            if self._segment_ends:
+                return self._segment_ends.popleft()
+            # The recorder closed the utterance before the feeder saw a whole gap
+            end, self._open_end = self._open_end, None
+            return end
+
+    def _track_voice(self, chunk: np.ndarray) -> None:
+        with self._lock:
+            if np.sqrt(np.mean(chunk.astype(np.float32) ** 2)) > VOICED_RMS:
+                self._open_end = time.monotonic()
+                self._quiet_seconds = 0.0
+                return
+            self._quiet_seconds += len(chunk) / self.channels / self.rate
+            if self._quiet_seconds >= SEGMENT_GAP:
+                self._close_segment()
+
+    def _close_segment(self) -> None:
+        if self._open_end is not None:
+            self._segment_ends.append(self._open_end)
+            self._open_end = None
+
+    def run(self):
+        block = CHUNK * self.channels
+        # The last utterance is closed by the capture's end of utterance silence, like on a live stream
+        track = self.samples
+        started = time.monotonic()
+
+        for offset in range(0, len(track), block):
+            chunk = track[offset:offset + block]
+            # Backpressure instead of overrunning the ring buffer when running faster than real time
+            while self.capture.ring.capacity - self.capture.ring.available() < len(chunk):
+                time.sleep(0.001)
+            self.capture.push(chunk.tobytes())
+
+            self._track_voice(chunk)
+
+            if self.speed > 0:
+                fed_seconds = (offset + len(chunk)) / self.channels / self.rate
+                delay = started + fed_seconds / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        with self._lock:
+            self._close_segment()
+        self.done.set()
+
+
+def replay(interviewer_wav: str, candidate_wav: str, speed: float = 0) -> dict:
+    message_queue = Queue(maxsize=MESSAGE_QUEUE_SIZE)
+    chat_history = ChatHistory()
+
+    tracks = {ROLE.USER: interviewer_wav, ROLE.ASSISTANT: candidate_wav}
+    recorders, captures, feeders = {}, {}, {}
+    shared_engine = SharedTranscriptionEngine(recorder_config) if SHARE_TRANSCRIPTION_MODELS else None
+    scheduler = RealtimeScheduler(message_queue, recorder_config['realtime_processing_pause']) if ADAPTIVE_REALTIME_PAUSE else None
+    for role, file_path in tracks.items():
+        overrides = {}
+        if scheduler is not None and shared_engine is not None:
+            overrides['realtime_transcription_executor'] = scheduler.timed(role, shared_engine.realtime)
+        config = make_recorder_config((lambda text, role=role: realtime_transcription(text, role, message_queue, recorders[role].recording_start_time)), shared_engine, **overrides)
+        recorders[role] = AudioToTextRecorder(**config)
+        if scheduler is not None:
+            scheduler.add(role, recorders[role])
+
+        samples, rate, channels = read_wav(file_path)
+        captures[role] = SpeakerCapture(recorders[role], rate, channels, TARGET_RATE, CHUNK, END_OF_UTTERANCE_SILENCE)
+        feeders[role] = TrackFeeder(samples, rate, channels, captures[role], speed)
+
+    for role in tracks:
+        threading.Thread(target=poll_recorder, args=[recorders[role], role, message_queue], daemon=True).start()
+        captures[role].start()
+
+    if scheduler is not None:
+        scheduler.start()
+    started = time.monotonic()
+    for feeder in feeders.values():
+        threading.Thread(target=feeder.run, daemon=True).start()
+
+    latencies = []
+    last_final_at = started
+    last_message_at = started
+    while True:
+        try:
+            message = message_queue.get(timeout=0.1)
+        except Empty:
+            feeding_done = all(f.done.is_set() for f in feeders.values())
+            if feeding_done and time.monotonic() - last_message_at > IDLE_TIMEOUT:
+                break
+            continue
+
+        now = time.monotonic()
+        last_message_at = now
+        chat_history.put(message['role'], message['transcription_type'], message['content'],
+                         message.get('words'), message.get('started_at'))
+        if message['transcription_type'] == MESSAGE_TYPE.FINAL:
+            last_final_at = now
+            ended_at = feeders[message['role']].take_segment_end()
+            if ended_at is not None:
+                latencies.append(now - ended_at)
+
+    for role in tracks:
+        captures[role].stop()
+        recorders[role].shutdown()
+
+    audio_seconds = max(f.duration for f in feeders.values())
+    wall_seconds = last_final_at - started
+    return {
+        "speed": speed,
+        "audio_seconds": audio_seconds,
+        "wall_seconds": wall_seconds,
+        # Below 1 means the pipeline keeps up faster than real time
+        "real_time_factor": wall_seconds / audio_seconds if audio_seconds else 0.0,
+        "utterances": len(latencies),
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies, default=0.0),
+        "capture": {role.value: captures[role].stats() for role in tracks},
+        "shared_engine": shared_engine.stats() if shared_engine is not None else None,
+        "scheduler": scheduler.metrics() if scheduler is not None else None,
+        "transcript": chat_history.as_list(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded interview through the transcription pipeline")
+    parser.add_argument('interviewer', help="WAV file with the interviewer's track (what the speakers play)")
+    parser.add_argument('candidate', help="WAV file with the candidate's track (what the microphone hears)")
+    parser.add_argument('--speed', type=float, default=0, help="1 for real time, N for Nx, 0 for as fast as possible")
+    parser.add_argument('--json', dest='json_path', help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = replay(args.interviewer, args.candidate, args.speed)
+    print("Audio: {audio_seconds:.1f}s  Wall: {wall_seconds:.1f}s  RTF: {real_time_factor:.3f}".format(**report))
+    print("Utterances: {utterances}  Audio end -> FINAL latency mean {latency_mean:.3f}s  "
+          "p50 {latency_p50:.3f}s  p95 {latency_p95:.3f}s  max {latency_max:.3f}s".format(**report))
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as jf:
+            json.dump(report, jf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
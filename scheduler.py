@@ -0,0 +1,171 @@
+from collections import deque
+from queue import Queue
+from threading import Event, Lock, Thread
+import time
+
+from chat_history import ROLE
+from latency import percentile
+import latency
+
+# How often the realtime pauses are re-evaluated
+SCHEDULER_INTERVAL = 0.5
+# Bounds of the pause between two realtime transcription passes of a recorder
+MIN_REALTIME_PAUSE = 0.2
+MAX_REALTIME_PAUSE = 2.0
+# Share of the time a recorder's realtime passes may keep the realtime model busy: the pause is
+#   pass * (1 / TARGET_UTILIZATION - 1), i.e. as long as a pass at 0.5
+TARGET_UTILIZATION = 0.5
+# Once the message queue is fuller than this (0..1) the UI is falling behind and the pauses grow
+#   by up to BACKLOG_GAIN times (at a full queue)
+BACKLOG_THRESHOLD = 0.1
+BACKLOG_GAIN = 4.0
+# Weight of a new target pause, smooths out single slow passes
+PAUSE_SMOOTHING = 0.5
+# Weight of the newest pass in the moving average of the pass duration
+PASS_SMOOTHING = 0.3
+# A recorder that made a realtime pass this recently is taking a speaker's words
+ACTIVE_WINDOW = 2.0
+# When both people talk at once, PRIORITY_ROLE (the interviewer, whose questions the feedback is about)
+#   keeps the pause and the other recorder's is multiplied by DEPRIORITIZED_FACTOR
+PRIORITY_ROLE = ROLE.USER
+DEPRIORITIZED_FACTOR = 2.0
+# Pass durations kept per role for the report
+PASS_SAMPLES = 1000
+
+
+class _TimedExecutor:
+    """
+        Wraps a recorder's realtime transcription executor to time every pass it makes
+    """
+    def __init__(self, scheduler: 'RealtimeScheduler', role: ROLE, executor):
+        self.scheduler = scheduler
+        self.role = role
+        self.executor = executor
+
+    def transcribe(self, audio, language=None, use_prompt=True, **options):
+        started = time.monotonic()
+        try:
+            return self.executor.transcribe(audio, language=language, use_prompt=use_prompt, **options)
+        finally:
+            self.scheduler.record_pass(self.role, time.monotonic() - started)
+
+
+class RealtimeScheduler:
+    """
+        Adapts the recorders' realtime_processing_pause (which RealTimeSTT reads before every pass)
+        to the load: how long the realtime passes take (longer when both people talk at once or
+        something else, e.g. a local LLM, is using the machine) and how far behind the UI is
+        (the message queue's backlog). The pause shrinks towards MIN_REALTIME_PAUSE when the machine
+        has headroom and grows towards MAX_REALTIME_PAUSE when it doesn't.
+        The passes are only timed when the recorders use the shared models (see `timed`),
+        otherwise the backlog alone drives the pause
+    """
+    def __init__(self, message_queue: Queue, pause: float):
+        self.message_queue = message_queue
+        self.pause = min(MAX_REALTIME_PAUSE, max(MIN_REALTIME_PAUSE, pause))
+        self._recorders: dict[ROLE, object] = {}
+        self._pauses: dict[ROLE, float] = {}
+        self._lock = Lock()
+        self._stop = Event()
+
+        # Moving average of the pass duration (all recorders), None until the first pass
+        self.pass_seconds: float = None
+        self._last_pass_at: dict[ROLE, float] = {}
+        self._pass_samples: dict[ROLE, deque] = {}
+
+        self.priority: ROLE = None
+        self.backlog = 0.0
+        self.adjustments = 0
+        self.deprioritized = 0
+        self.lowest_pause = self.pause
+        self.highest_pause = self.pause
+
+    def timed(self, role: ROLE, executor) -> _TimedExecutor:
+        """
+            `executor` (e.g. the shared realtime model) timed for the scheduler, to pass as the role's
+            recorder's realtime_transcription_executor
+        """
+        return _TimedExecutor(self, role, executor)
+
+    def add(self, role: ROLE, recorder) -> None:
+        with self._lock:
+            self._recorders[role] = recorder
+            self._pauses[role] = self.pause
+        recorder.realtime_processing_pause = self.pause
+
+    def record_pass(self, role: ROLE, seconds: float) -> None:
+        with self._lock:
+            self.pass_seconds = seconds if self.pass_seconds is None else \
+                PASS_SMOOTHING * seconds + (1 - PASS_SMOOTHING) * self.pass_seconds
+            self._last_pass_at[role] = time.monotonic()
+            self._pass_samples.setdefault(role, deque(maxlen=PASS_SAMPLES)).append(seconds)
+        if latency.profiler is not None:
+            latency.profiler.sample(f"realtime pass {role.value}", seconds)
+
+    def start(self) -> None:
+        Thread(target=self._run, name="RealtimeScheduler", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(SCHEDULER_INTERVAL):
+            self.adjust()
+
+    def adjust(self) -> None:
+        now = time.monotonic()
+        maxsize = self.message_queue.maxsize
+        backlog = self.message_queue.qsize() / maxsize if maxsize else 0.0
+
+        with self._lock:
+            target = self.pause
+            if self.pass_seconds is not None:
+                target = self.pass_seconds * (1 / TARGET_UTILIZATION - 1)
+            if backlog > BACKLOG_THRESHOLD:
+                target *= 1 + (BACKLOG_GAIN - 1) * (backlog - BACKLOG_THRESHOLD) / (1 - BACKLOG_THRESHOLD)
+            target = min(MAX_REALTIME_PAUSE, max(MIN_REALTIME_PAUSE, target))
+            self.pause += PAUSE_SMOOTHING * (target - self.pause)
+            self.backlog = backlog
+            self.adjustments += 1
+            self.lowest_pause = min(self.lowest_pause, self.pause)
+            self.highest_pause = max(self.highest_pause, self.pause)
+
+            active = [role for role, at in self._last_pass_at.items() if now - at <= ACTIVE_WINDOW]
+            overlap = len(active) > 1
+            self.priority = PRIORITY_ROLE if overlap else (active[0] if active else None)
+            if overlap:
+                self.deprioritized += 1
+
+            for role, recorder in self._recorders.items():
+                pause = self.pause
+                if overlap and role is not self.priority:
+                    pause = min(MAX_REALTIME_PAUSE, pause * DEPRIORITIZED_FACTOR)
+                self._pauses[role] = pause
+                recorder.realtime_processing_pause = pause
+                if latency.profiler is not None and role in active:
+                    latency.profiler.sample(f"realtime pause {role.value}", pause)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "pause": dict((role.value, pause) for role, pause in self._pauses.items()),
+                "priority": self.priority.value if self.priority is not None else None,
+                "pass_seconds": self.pass_seconds,
+                "pass_p50": dict((role.value, percentile(list(samples), 50)) for role, samples in self._pass_samples.items()),
+                "pass_p95": dict((role.value, percentile(list(samples), 95)) for role, samples in self._pass_samples.items()),
+                "backlog": self.backlog,
+                "lowest_pause": self.lowest_pause,
+                "highest_pause": self.highest_pause,
+                "adjustments": self.adjustments,
+                "deprioritized": self.deprioritized,
+            }
+
+    def report(self) -> str:
+        metrics = self.metrics()
+        line = f"Realtime pause: {metrics['lowest_pause']:.2f}s..{metrics['highest_pause']:.2f}s"
+        if metrics['pass_seconds'] is not None:
+            line += ", passes " + ", ".join(
+                f"{role} p50 {metrics['pass_p50'][role]:.2f}s p95 {metrics['pass_p95'][role]:.2f}s" for role in metrics['pass_p50'])
+        if metrics['adjustments']:
+            line += f", both talking {metrics['deprioritized'] / metrics['adjustments']:.0%} of the time"
+        return line
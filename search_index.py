@@ -0,0 +1,343 @@
+from collections import OrderedDict
+from threading import Lock
+from array import array
+import heapq
+import struct
+import math
+import mmap
+import re
+import os
+
+from chat_history import ROLE
+from session_store import SESSIONS_DIR, JOURNAL_FILE, load_session, read_messages
+
+# The index of a session is saved next to its journal
+SEARCH_INDEX_FILE = 'search.idx'
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Number of words shown around the first match
+SNIPPET_WORDS = 12
+# Past sessions' indexes kept open (memory-mapped) between queries
+OPEN_SEGMENTS = 256
+
+_TOKEN = re.compile(r"\w+")
+_PHRASE = re.compile(r'"([^"]*)"')
+_ROLES = list(ROLE)
+
+_SEGMENT_MAGIC = b'IASX'
+# magic, format version, documents, terms, total length of the documents (in tokens)
+_SEGMENT_HEADER = struct.Struct('<4sIIIQ')
+# message id, length (in tokens), role
+_SEGMENT_DOC = struct.Struct('<IIB')
+# term offset in the term blob, term length, postings offset, postings length (in u32), document frequency
+_SEGMENT_TERM = struct.Struct('<IHIII')
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def parse_query(query: str) -> list[tuple[str, ...]]:
+    """
+        The clauses of a query: every "quoted phrase" is one clause, every other word is a clause of its own.
+        A message has to match all of them
+    """
+    clauses = [tuple(tokenize(phrase)) for phrase in _PHRASE.findall(query)]
+    clauses = [clause for clause in clauses if clause]
+    clauses += [(term,) for term in tokenize(_PHRASE.sub(' ', query))]
+    return clauses
+
+
+def snippet(content: str, clauses: list[tuple[str, ...]], words: int = SNIPPET_WORDS) -> str:
+    tokens = content.split()
+    terms = {term for clause in clauses for term in clause}
+    first = next((i for i, token in enumerate(tokens) if terms.intersection(tokenize(token))), 0)
+    start = max(0, first - words // 3)
+    text = ' '.join(tokens[start:start + words])
+    return ('…' if start > 0 else '') + text + ('…' if start + words < len(tokens) else '')
+
+
+def _clause_frequencies(index, clause: tuple[str, ...]) -> dict[int, int]:
+    """
+        doc -> number of occurrences of the clause (consecutive terms) in it, for the docs that have all the terms
+    """
+    if len(clause) == 1:
+        return index.frequencies(clause[0])
+
+    postings = [index.positions(term) for term in clause]
+    docs = set(postings[0])
+    for term_postings in postings[1:]:
+        docs.intersection_update(term_postings)
+    frequencies = {}
+    for doc in docs:
+        following = [set(term_postings[doc]) for term_postings in postings[1:]]
+        count = sum(1 for p in postings[0][doc] if all(p + 1 + i in positions for i, positions in enumerate(following)))
+        if count:
+            frequencies[doc] = count
+    return frequencies
+
+
+class SearchIndex:
+    """
+        Positional inverted index of the current session's final messages, updated as they land in ChatHistory
+        (see ChatHistory.search_index). `save` writes it as a segment that past session searches read.
+        Updated on the UI thread and searched from a worker, the lock keeps the two apart
+    """
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # term -> message id -> positions
+            self._postings: dict[str, dict[int, array]] = {}
+            # message id -> (length in tokens, role)
+            self._docs: dict[int, tuple[int, ROLE]] = {}
+            self.total_length = 0
+
+    @property
+    def doc_count(self) -> int:
+        return len(self._docs)
+
+    def add(self, message_id: int, role: ROLE, content: str):
+        tokens = tokenize(content)
+        with self._lock:
+            self._docs[message_id] = (len(tokens), role)
+            self.total_length += len(tokens)
+            for position, term in enumerate(tokens):
+                docs = self._postings.get(term)
+                if docs is None:
+                    docs = self._postings[term] = {}
+                positions = docs.get(message_id)
+                if positions is None:
+                    positions = docs[message_id] = array('I')
+                positions.append(position)
+
+    def frequencies(self, term: str) -> dict[int, int]:
+        """
+            message id -> number of occurrences of `term`
+        """
+        with self._lock:
+            return {doc: len(positions) for doc, positions in self._postings.get(term, {}).items()}
+
+    def positions(self, term: str) -> dict[int, array]:
+        with self._lock:
+            return dict(self._postings.get(term, {}))
+
+    def doc(self, doc: int) -> tuple[int, int, ROLE]:
+        """
+            (message id, length, role) of a document
+        """
+        length, role = self._docs[doc]
+        return doc, length, role
+
+    def search(self, query: str, limit: int = 20) -> list[dict]:
+        return rank([(None, self)], parse_query(query), limit)
+
+    def save(self, file_path: str):
+        with self._lock:
+            self._save(file_path)
+
+    def _save(self, file_path: str):
+        """
+            Writes the index as a segment: header, document table, term table sorted by the terms' bytes
+            (so a lookup is a binary search), the term bytes and the postings.
+            A term's postings are its documents, then their term frequencies, then all the positions,
+            so a term query reads two flat arrays and only a phrase query decodes positions
+        """
+        docs = sorted(self._docs)
+        doc_index = {message_id: i for i, message_id in enumerate(docs)}
+        terms = sorted((term.encode('utf-8'), term) for term in self._postings)
+
+        term_table, term_blob, postings_blob = [], bytearray(), array('I')
+        for term_bytes, term in terms:
+            postings = self._postings[term]
+            start = len(postings_blob)
+            message_ids = sorted(postings, key=doc_index.get)
+            postings_blob.extend(doc_index[message_id] for message_id in message_ids)
+            postings_blob.extend(len(postings[message_id]) for message_id in message_ids)
+            for message_id in message_ids:
+                postings_blob.extend(postings[message_id])
+            term_table.append(_SEGMENT_TERM.pack(len(term_blob), len(term_bytes), start, len(postings_blob) - start, len(postings)))
+            term_blob += term_bytes
+
+        with open(file_path + '.tmp', 'wb') as sf:
+            sf.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, 1, len(docs), len(terms), self.total_length))
+            for message_id in docs:
+                length, role = self._docs[message_id]
+                sf.write(_SEGMENT_DOC.pack(message_id, length, _ROLES.index(role)))
+            sf.write(b''.join(term_table))
+            sf.write(term_blob)
+            sf.write(postings_blob.tobytes())
+        os.replace(file_path + '.tmp', file_path)
+
+
+class _Segment:
+    """
+        A saved SearchIndex, memory-mapped. Only the parts a query touches are read:
+        the term table is binary searched and only the matching terms' postings are decoded
+    """
+    def __init__(self, file_path: str):
+        with open(file_path, 'rb') as sf:
+            self._map = mmap.mmap(sf.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, self.doc_count, self._term_count, self.total_length = _SEGMENT_HEADER.unpack_from(self._map, 0)
+        if magic != _SEGMENT_MAGIC:
+            raise ValueError(f"{file_path} is not a search index")
+        self._docs_at = _SEGMENT_HEADER.size
+        self._terms_at = self._docs_at + self.doc_count * _SEGMENT_DOC.size
+        self._blob_at = self._terms_at + self._term_count * _SEGMENT_TERM.size
+        last = self._term(self._term_count - 1) if self._term_count else None
+        self._postings_at = self._blob_at + (last[0] + last[1] if last else 0)
+
+    def _term(self, i: int) -> tuple:
+        return _SEGMENT_TERM.unpack_from(self._map, self._terms_at + i * _SEGMENT_TERM.size)
+
+    def _lookup(self, term: str) -> tuple[int, int, int]:
+        """
+            (offset, length in u32, document frequency) of the term's postings, None if it's not in the segment
+        """
+        key = term.encode('utf-8')
+        low, high = 0, self._term_count
+        while low < high:
+            middle = (low + high) // 2
+            term_at, term_length, postings_at, postings_length, doc_frequency = self._term(middle)
+            candidate = self._map[self._blob_at + term_at:self._blob_at + term_at + term_length]
+            if candidate < key:
+                low = middle + 1
+            elif candidate > key:
+                high = middle
+            else:
+                return self._postings_at + 4 * postings_at, postings_length, doc_frequency
+        return None
+
+    def frequencies(self, term: str) -> dict[int, int]:
+        found = self._lookup(term)
+        if found is None:
+            return {}
+        start, _, df = found
+        values = array('I', self._map[start:start + 8 * df])
+        return dict(zip(values[:df], values[df:]))
+
+    def positions(self, term: str) -> dict[int, array]:
+        found = self._lookup(term)
+        if found is None:
+            return {}
+        start, length, df = found
+        values = array('I', self._map[start:start + 4 * length])
+        postings, at = {}, 2 * df
+        for doc, tf in zip(values[:df], values[df:2 * df]):
+            postings[doc] = values[at:at + tf]
+            at += tf
+        return postings
+
+    def doc(self, doc: int) -> tuple[int, int, ROLE]:
+        message_id, length, role = _SEGMENT_DOC.unpack_from(self._map, self._docs_at + doc * _SEGMENT_DOC.size)
+        return message_id, length, _ROLES[role]
+
+    def close(self):
+        self._map.close()
+
+
+def rank(sources: list, clauses: list[tuple[str, ...]], limit: int = 20) -> list[dict]:
+    """
+        BM25 over the messages of all `sources` ((session name, index) pairs) together,
+        a phrase clause counts its occurrences as its term frequency
+    """
+    if not clauses:
+        return []
+    doc_count = sum(index.doc_count for _, index in sources)
+    if doc_count == 0:
+        return []
+    average_length = sum(index.total_length for _, index in sources) / doc_count
+
+    matches = []
+    clause_docs = [0] * len(clauses)
+    for session, index in sources:
+        # Every clause is counted in every source, or a clause's IDF would depend on the ones before it
+        frequencies = [_clause_frequencies(index, clause) for clause in clauses]
+        for i, clause_frequencies in enumerate(frequencies):
+            clause_docs[i] += len(clause_frequencies)
+        if all(frequencies):
+            docs = set(frequencies[0]).intersection(*frequencies[1:])
+            matches.extend((session, index, doc, [f[doc] for f in frequencies]) for doc in docs)
+
+    idf = [math.log(1 + (doc_count - n + 0.5) / (n + 0.5)) for n in clause_docs]
+
+    def score(match) -> float:
+        _, index, doc, frequencies = match
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * index.doc(doc)[1] / average_length)
+        return sum(w * tf * (BM25_K1 + 1) / (tf + norm) for w, tf in zip(idf, frequencies))
+
+    results = []
+    for match_score, (session, index, doc, _) in heapq.nlargest(limit, ((score(m), m) for m in matches), key=lambda sm: sm[0]):
+        message_id, _, role = index.doc(doc)
+        results.append({"session": session, "id": message_id, "role": role, "score": match_score})
+    return results
+
+
+_segments: OrderedDict[str, tuple[float, _Segment]] = OrderedDict()
+
+
+def _open_segment(session_path: str) -> _Segment:
+    """
+        The session's saved index (built from its journal first if it has none or it's older than the journal)
+    """
+    file_path = os.path.join(session_path, SEARCH_INDEX_FILE)
+    try:
+        mtime = os.path.getmtime(file_path)
+        if mtime < os.path.getmtime(os.path.join(session_path, JOURNAL_FILE)):
+            mtime = None
+    except OSError:
+        mtime = None
+    cached = _segments.get(session_path)
+    if cached is not None and cached[0] == mtime:
+        _segments.move_to_end(session_path)
+        return cached[1]
+
+    if mtime is None:
+        # Crashed before saving it (or resumed and crashed), or recorded before there was search
+        index = SearchIndex()
+        for message in load_session(os.path.basename(session_path), os.path.dirname(session_path)).messages:
+            if message['type'] == 'final':
+                index.add(message['id'], ROLE(message['role']), message['content'])
+        index.save(file_path)
+        mtime = os.path.getmtime(file_path)
+
+    if cached is not None:
+        cached[1].close()
+    segment = _Segment(file_path)
+    _segments[session_path] = (mtime, segment)
+    while len(_segments) > OPEN_SEGMENTS:
+        _segments.popitem(last=False)[1][1].close()
+    return segment
+
+
+def search_sessions(query: str, limit: int = 20, current: tuple = None, sessions_dir: str = SESSIONS_DIR) -> list[dict]:
+    """
+        Ranked messages matching `query` across every saved session (and `current`, a (session name, SearchIndex)
+        pair for the session that's still being recorded). Every result has the session name, the message id,
+        the role, the score and a snippet of the message
+    """
+    clauses = parse_query(query)
+    sources = []
+    if current is not None:
+        sources.append(current)
+    if os.path.isdir(sessions_dir):
+        for name in sorted(os.listdir(sessions_dir)):
+            session_path = os.path.join(sessions_dir, name)
+            if (current is not None and name == current[0]) or not os.path.isdir(session_path):
+                continue
+            try:
+                sources.append((name, _open_segment(session_path)))
+            except (OSError, ValueError):
+                continue
+
+    results = rank(sources, clauses, limit)
+    contents = {}
+    for session in {r["session"] for r in results if current is None or r["session"] != current[0]}:
+        contents[session] = read_messages(session, [r["id"] for r in results if r["session"] == session], sessions_dir)
+    for result in results:
+        content = contents.get(result["session"], {}).get(result["id"])
+        result["snippet"] = snippet(content["content"], clauses) if content is not None else None
+    return results
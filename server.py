@@ -0,0 +1,421 @@
+"""
+    Headless server mode: many interview sessions at once on one machine, without audio devices or UI.
+
+    Every client connection is a session with its own recorders (one per role), ChatHistory,
+    context window and journal. The transcription of all sessions runs on a pool of worker
+    processes (see stt_pool.py), sized to the cores. The client streams 16-bit PCM for both roles
+    and gets the transcript and the LLM feedback back over the same connection.
+
+    Every message, both ways, is a frame: a header (kind, role, payload length; see _HEADER)
+    followed by the payload. The role byte is the index into FRAME_ROLES (0: interviewer, 1: candidate).
+    - HELLO (first frame): {"rate": 48000, "channels": 2}, or a format per role: {"user": {...}, "assistant": {...}}
+    - AUDIO: the role's interleaved int16 samples, any number of frames
+    - FEEDBACK: asks for feedback on what was said so far (F7 in the app). A new request cancels the running one
+    - CLEAR: starts the dialogue over
+    The server answers HELLO with READY {"session": name}, then sends TRANSCRIPT {"id", "role", "type", "content"}
+    for every update of a message (the same id until its final text), FEEDBACK_START, FEEDBACK_CHUNKs
+    and FEEDBACK_END for every feedback request (a cancelled one ends early, before the next FEEDBACK_START),
+    and ERROR (text) for anything that went wrong.
+    See server_client.py for a client.
+
+    python server.py --port 8765 --workers 8
+"""
+from queue import Queue, Empty
+from threading import Event, Lock, Thread
+from enum import IntEnum
+import argparse
+import asyncio
+import struct
+import json
+import time
+
+from chat_history import ChatHistory, ROLE, MESSAGE_TYPE, coalesce_messages
+from session_store import SessionJournal, new_session_name
+from startup import Startup, COMPONENT_STATUS
+from transcription import recorder_config, make_recorder_config, poll_recorder, realtime_transcription, TARGET_RATE, MESSAGE_QUEUE_SIZE, END_OF_UTTERANCE_SILENCE, ADAPTIVE_REALTIME_PAUSE
+from scheduler import RealtimeScheduler
+from stt_pool import TranscriptionPool
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+# Connections beyond this many sessions are turned away
+MAX_SESSIONS = 16
+# A frame claiming a larger payload is a protocol error (a second of 48 kHz stereo audio is 192 kB)
+MAX_FRAME_BYTES = 4 * 1024 * 1024
+# Audio is handed to a session's capture in blocks of at most this many frames
+SERVER_BLOCK_FRAMES = 1024
+# How long the client has to send HELLO
+HELLO_TIMEOUT = 10.0
+
+# kind, role, payload length
+_HEADER = struct.Struct('<BBI')
+FRAME_ROLES = (ROLE.USER, ROLE.ASSISTANT)
+
+
+class FRAME(IntEnum):
+    # client -> server
+    HELLO = 1
+    AUDIO = 2
+    FEEDBACK = 3
+    CLEAR = 4
+    # server -> client
+    READY = 16
+    TRANSCRIPT = 17
+    FEEDBACK_START = 18
+    FEEDBACK_CHUNK = 19
+    FEEDBACK_END = 20
+    ERROR = 21
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def pack_frame(kind: FRAME, payload: bytes = b'', role: ROLE = ROLE.USER) -> bytes:
+    return _HEADER.pack(kind, FRAME_ROLES.index(role), len(payload)) + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[FRAME, ROLE, bytes]:
+    """
+        The next frame, None when the connection was closed between two frames
+    """
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError("Connection closed in the middle of a frame header")
+        return None
+    kind, role, length = _HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"Frame of {length} bytes, at most {MAX_FRAME_BYTES} are accepted")
+    try:
+        kind, role = FRAME(kind), FRAME_ROLES[role]
+    except (ValueError, IndexError):
+        raise ProtocolError(f"Unknown frame kind {kind} or role {role}")
+    return kind, role, await reader.readexactly(length)
+
+
+def _audio_formats(hello: dict) -> dict[ROLE, tuple[int, int]]:
+    """
+        role -> (rate, channels) from a HELLO payload
+    """
+    formats = {}
+    for role in FRAME_ROLES:
+        audio_format = hello.get(role.value, hello)
+        rate, channels = int(audio_format.get('rate', TARGET_RATE)), int(audio_format.get('channels', 1))
+        if not 8000 <= rate <= 192000 or not 1 <= channels <= 8:
+            raise ProtocolError(f"Unsupported audio format for {role.value}: {rate} Hz, {channels} channels")
+        formats[role] = (rate, channels)
+    return formats
+
+
+class ServerSession:
+    """
+        One client connection: the recorders and captures of both roles, the dialogue and the feedback.
+        Transcription results go through the session's message queue like in the app, a thread
+        moves them into the ChatHistory and sends them to the client
+    """
+    def __init__(self, server: 'InterviewServer', name: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+
+        self.message_queue = Queue(maxsize=MESSAGE_QUEUE_SIZE)
+        self.chat_history = ChatHistory()
+        self.journal = SessionJournal(name) if server.journal else None
+        self.chat_history.journal = self.journal
+        self.scheduler = RealtimeScheduler(self.message_queue, recorder_config['realtime_processing_pause']) if ADAPTIVE_REALTIME_PAUSE else None
+        self.context_window = None
+
+        self.recorders = {}
+        self.captures = {}
+        self._stop = Event()
+        # The history is written by the forwarding thread, cleared by the connection's reads
+        #   and read by the context window (on the loop for a feedback request, and on its summary thread)
+        self._history_lock = Lock()
+        self._send_lock = asyncio.Lock()
+        self._feedback: asyncio.Task = None
+
+        self.started_at = time.monotonic()
+        self.audio_bytes = 0
+        self.feedback_requests = 0
+
+    async def run(self) -> None:
+        try:
+            frame = await asyncio.wait_for(read_frame(self.reader), HELLO_TIMEOUT)
+            if frame is None:
+                return
+            kind, _, payload = frame
+            if kind is not FRAME.HELLO:
+                raise ProtocolError("The first frame must be HELLO")
+            formats = _audio_formats(json.loads(payload or b'{}'))
+
+            await self.loop.run_in_executor(None, self._start, formats)
+            await self.send(FRAME.READY, json.dumps({"session": self.name}).encode('utf-8'))
+
+            while (frame := await read_frame(self.reader)) is not None:
+                kind, role, payload = frame
+                if kind is FRAME.AUDIO:
+                    await self._feed(role, payload)
+                elif kind is FRAME.FEEDBACK:
+                    self._request_feedback()
+                elif kind is FRAME.CLEAR:
+                    with self._history_lock:
+                        self.chat_history.clear()
+                        if self.context_window is not None:
+                            self.context_window.reset()
+                else:
+                    raise ProtocolError(f"Unexpected {kind.name} frame")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.TimeoutError:
+            await self._error(f"No HELLO within {HELLO_TIMEOUT}s")
+        except Exception as e:
+            # A protocol error, or the recorders failed to load
+            await self._error(e)
+        finally:
+            await self.close()
+
+    def _start(self, formats: dict[ROLE, tuple[int, int]]) -> None:
+        """
+            Loads the recorders (their VADs) and starts capturing, on a worker thread
+        """
+        from RealtimeSTT import AudioToTextRecorder
+        from audio_capture import SpeakerCapture
+
+        for role, (rate, channels) in formats.items():
+            overrides = {'use_microphone': False}
+            if self.scheduler is not None:
+                overrides['realtime_transcription_executor'] = self.scheduler.timed(role, self.server.pool.realtime)
+            config = make_recorder_config(
+                (lambda text, role=role: realtime_transcription(text, role, self.message_queue, self.recorders[role].recording_start_time)),
+                self.server.pool, **overrides)
+            self.recorders[role] = AudioToTextRecorder(**config)
+            if self.scheduler is not None:
+                self.scheduler.add(role, self.recorders[role])
+            # A client stops sending when its side goes quiet, like a loopback device
+            self.captures[role] = SpeakerCapture(self.recorders[role], rate, channels, TARGET_RATE, SERVER_BLOCK_FRAMES, END_OF_UTTERANCE_SILENCE)
+            self.captures[role].start()
+            Thread(target=poll_recorder, args=[self.recorders[role], role, self.message_queue, self._stop],
+                   name=f"Poll-{self.name}-{role.value}", daemon=True).start()
+
+        if self.scheduler is not None:
+            self.scheduler.start()
+        Thread(target=self._forward_messages, name="Forward-" + self.name, daemon=True).start()
+
+    async def _feed(self, role: ROLE, payload: bytes) -> None:
+        capture = self.captures[role]
+        frame_bytes = 2 * capture.channels
+        block = SERVER_BLOCK_FRAMES * frame_bytes
+        # A partial frame at the end can't be split between channels, it's dropped
+        payload = payload[:len(payload) - len(payload) % frame_bytes]
+        for offset in range(0, len(payload), block):
+            chunk = payload[offset:offset + block]
+            # Waiting for room in the ring buffer stops reading the socket, which slows the client down
+            while capture.ring.capacity - capture.ring.available() < len(chunk) // 2:
+                await asyncio.sleep(0.005)
+            capture.push(chunk)
+        self.audio_bytes += len(payload)
+
+    def _forward_messages(self) -> None:
+        """
+            Moves the transcription results into the history and sends them to the client, in coalesced batches
+        """
+        while not self._stop.is_set():
+            try:
+                batch = [self.message_queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            while True:
+                try:
+                    batch.append(self.message_queue.get_nowait())
+                except Empty:
+                    break
+
+            frames = []
+            for message in coalesce_messages(batch):
+                with self._history_lock:
+                    message_id, _ = self.chat_history.put(message['role'], message['transcription_type'], message['content'],
+                                                          message.get('words'), message.get('started_at'))
+                frames.append(pack_frame(FRAME.TRANSCRIPT, json.dumps({
+                    "id": message_id,
+                    "role": message['role'].value,
+                    "type": message['transcription_type'].value,
+                    "content": message['content'],
+                }, ensure_ascii=False).encode('utf-8'), message['role']))
+                if message['transcription_type'] is MESSAGE_TYPE.FINAL and self.context_window is not None:
+                    self.context_window.notify_final()
+            try:
+                # Waits until the client took them, a slow client throttles the draining (and then the recorders)
+                asyncio.run_coroutine_threadsafe(self._write(b''.join(frames)), self.loop).result()
+            except Exception:
+                return
+
+    def _request_feedback(self) -> None:
+        if self.server.startup.status('llm') is not COMPONENT_STATUS.READY:
+            error = self.server.startup.error('llm')
+            self.loop.create_task(self._error("LLM provider " + ("unavailable: " + str(error) if error else "still loading")))
+            return
+        llm = self.server.startup.result('llm')
+        if self.context_window is None:
+            from llm_config import context_budget
+            from context_window import ContextWindow
+            self.context_window = ContextWindow(llm, self.chat_history, context_budget(), self._history_lock)
+            self.context_window.notify_final()
+
+        previous = self._feedback
+        if previous is not None:
+            previous.cancel()
+        self.feedback_requests += 1
+        self._feedback = self.loop.create_task(self._stream_feedback(llm, self.context_window.messages(), previous))
+
+    async def _stream_feedback(self, llm, messages: list[dict], previous: asyncio.Task = None) -> None:
+        """
+            Sends FEEDBACK_START, the chunks and FEEDBACK_END, also when a newer request cancels it midway.
+            A request starts once the one it replaced has sent its FEEDBACK_END
+        """
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.send(FRAME.FEEDBACK_START)
+            if messages:
+                response = []
+                try:
+                    async for chunk in llm.achat(messages):
+                        await self.send(FRAME.FEEDBACK_CHUNK, chunk.encode('utf-8'))
+                        response.append(chunk)
+                    if self.journal is not None:
+                        self.journal.feedback(''.join(response))
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    await self.send(FRAME.FEEDBACK_CHUNK, ("\n\nRequest failed: " + str(e)).encode('utf-8'))
+        finally:
+            try:
+                await asyncio.shield(self.send(FRAME.FEEDBACK_END))
+            except ConnectionError:
+                pass
+
+    async def send(self, kind: FRAME, payload: bytes = b'', role: ROLE = ROLE.USER) -> None:
+        await self._write(pack_frame(kind, payload, role))
+
+    async def _write(self, data: bytes) -> None:
+        async with self._send_lock:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def _error(self, error) -> None:
+        try:
+            await self.send(FRAME.ERROR, str(error).encode('utf-8'))
+        except ConnectionError:
+            pass
+
+    async def close(self) -> None:
+        self._stop.set()
+        if self._feedback is not None:
+            self._feedback.cancel()
+        if self.scheduler is not None:
+            self.scheduler.stop()
+        if self.context_window is not None:
+            self.context_window.close()
+
+        def shutdown():
+            for capture in self.captures.values():
+                capture.stop()
+            for recorder in self.recorders.values():
+                recorder.shutdown()
+            if self.journal is not None:
+                self.journal.close()
+        await self.loop.run_in_executor(None, shutdown)
+        self.writer.close()
+
+    def stats(self) -> dict:
+        return {
+            "seconds": time.monotonic() - self.started_at,
+            "audio_bytes": self.audio_bytes,
+            "messages": len(self.chat_history),
+            "feedback_requests": self.feedback_requests,
+            "capture": {role.value: capture.stats() for role, capture in self.captures.items()},
+            "scheduler": self.scheduler.metrics() if self.scheduler is not None else None,
+        }
+
+
+class InterviewServer:
+    def __init__(self, pool: TranscriptionPool, startup: Startup, max_sessions: int = MAX_SESSIONS, journal: bool = True):
+        self.pool = pool
+        self.startup = startup
+        self.max_sessions = max_sessions
+        self.journal = journal
+        self.sessions: dict[str, ServerSession] = {}
+        self.sessions_served = 0
+        self.sessions_refused = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if len(self.sessions) >= self.max_sessions:
+            self.sessions_refused += 1
+            writer.write(pack_frame(FRAME.ERROR, f"The server is full ({self.max_sessions} sessions)".encode('utf-8')))
+            await writer.drain()
+            writer.close()
+            return
+
+        self.sessions_served += 1
+        # Sessions started within the same second still get their own directory
+        name = f"{new_session_name()}_{self.sessions_served}"
+        session = ServerSession(self, name, reader, writer)
+        self.sessions[name] = session
+        try:
+            await session.run()
+        finally:
+            del self.sessions[name]
+            stats = session.stats()
+            print(f"{name}: {stats['seconds']:.0f}s, {stats['audio_bytes'] / 1e6:.1f} MB of audio, "
+                  f"{stats['messages']} messages, {stats['feedback_requests']} feedback requests")
+
+    async def serve(self, host: str = SERVER_HOST, port: int = SERVER_PORT) -> None:
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Listening on {host}:{port}, {self.pool.workers} transcription workers, up to {self.max_sessions} sessions")
+        async with server:
+            await server.serve_forever()
+
+    def report(self) -> str:
+        stats = self.pool.stats()
+        lines = [f"Sessions: {self.sessions_served} served, {self.sessions_refused} refused"]
+        for lane in ('final', 'realtime'):
+            lane_stats = stats[lane]
+            line = f"  {lane:<9} {lane_stats['transcriptions']} transcriptions"
+            if lane_stats['transcriptions']:
+                line += (f", {lane_stats['busy_seconds'] / lane_stats['transcriptions']:.2f}s each"
+                         f" + {lane_stats['wait_seconds'] / lane_stats['transcriptions']:.2f}s waiting")
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def load_llm():
+    from llm_config import load_llm
+    return load_llm()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Interview Assistant server: transcription and feedback for many sessions at once")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--workers', type=int, help="Transcription worker processes (default: one per STT_WORKER_THREADS cores)")
+    parser.add_argument('--max-sessions', type=int, default=MAX_SESSIONS)
+    parser.add_argument('--no-journal', action='store_true', help="Don't save the sessions to disk")
+    args = parser.parse_args()
+
+    pool = TranscriptionPool(recorder_config, args.workers)
+    startup = Startup()
+    # The LLM provider is checked while the workers load their models
+    startup.start('stt workers', pool.warm_up)
+    startup.start('llm', load_llm)
+    server = InterviewServer(pool, startup, args.max_sessions, not args.no_journal)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    print(startup.report())
+    print(server.report())
+    pool.close()
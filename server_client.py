@@ -0,0 +1,104 @@
+"""
+    Streams two recorded tracks to a running server.py as one session, paced like live audio,
+    prints the transcript as it arrives and asks for feedback once both tracks are over.
+
+    python server_client.py interviewer.wav candidate.wav
+    python server_client.py interviewer.wav candidate.wav --port 8765 --speed 2
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from chat_history import ROLE, MESSAGE_TYPE
+from audio_capture import read_wav
+from server import FRAME, SERVER_HOST, SERVER_PORT, pack_frame, read_frame
+
+# Audio is sent in frames of this many seconds
+CLIENT_FRAME_SECONDS = 0.05
+# After the tracks are over, the feedback is requested once no transcript arrived for this long
+SETTLE_SECONDS = 3.0
+
+
+async def stream_track(writer: asyncio.StreamWriter, role: ROLE, track: tuple, speed: float) -> None:
+    samples, rate, channels = track
+    block = int(rate * CLIENT_FRAME_SECONDS) * channels
+    started = time.monotonic()
+    for offset in range(0, len(samples), block):
+        if writer.is_closing():
+            return
+        writer.write(pack_frame(FRAME.AUDIO, samples[offset:offset + block].tobytes(), role))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The server closed the session, the receiving side says why
+            return
+        if speed > 0:
+            sent_seconds = (offset + block) / channels / rate
+            await asyncio.sleep(max(0.0, started + sent_seconds / speed - time.monotonic()))
+
+
+async def run(interviewer_wav: str, candidate_wav: str, host: str = SERVER_HOST, port: int = SERVER_PORT, speed: float = 1.0) -> dict:
+    tracks = {ROLE.USER: read_wav(interviewer_wav), ROLE.ASSISTANT: read_wav(candidate_wav)}
+    reader, writer = await asyncio.open_connection(host, port)
+    formats = {role.value: {"rate": rate, "channels": channels} for role, (_, rate, channels) in tracks.items()}
+    writer.write(pack_frame(FRAME.HELLO, json.dumps(formats).encode('utf-8')))
+
+    transcript: dict[int, dict] = {}
+    feedback = []
+    last_message_at = time.monotonic()
+    feedback_done = asyncio.Event()
+
+    async def receive():
+        nonlocal last_message_at
+        while (frame := await read_frame(reader)) is not None:
+            kind, _, payload = frame
+            if kind is FRAME.READY:
+                print("Session " + json.loads(payload)["session"])
+            elif kind is FRAME.TRANSCRIPT:
+                message = json.loads(payload)
+                transcript[message["id"]] = message
+                last_message_at = time.monotonic()
+                if message["type"] == MESSAGE_TYPE.FINAL.value:
+                    print(f"{message['role']:>9}: {message['content']}")
+            elif kind is FRAME.FEEDBACK_START:
+                feedback.clear()
+            elif kind is FRAME.FEEDBACK_CHUNK:
+                feedback.append(payload.decode('utf-8'))
+            elif kind is FRAME.FEEDBACK_END:
+                feedback_done.set()
+            elif kind is FRAME.ERROR:
+                print("Server error: " + payload.decode('utf-8'))
+                feedback_done.set()
+        writer.close()
+
+    receiving = asyncio.create_task(receive())
+    await asyncio.gather(*(stream_track(writer, role, track, speed) for role, track in tracks.items()))
+    while time.monotonic() - last_message_at < SETTLE_SECONDS and not receiving.done():
+        await asyncio.sleep(0.1)
+
+    if not receiving.done():
+        writer.write(pack_frame(FRAME.FEEDBACK))
+        await writer.drain()
+    waiting = asyncio.create_task(feedback_done.wait())
+    await asyncio.wait([receiving, waiting], return_when=asyncio.FIRST_COMPLETED)
+    writer.close()
+    receiving.cancel()
+    waiting.cancel()
+    return {
+        "transcript": [transcript[i] for i in sorted(transcript)],
+        "feedback": ''.join(feedback),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream two recorded tracks to the Interview Assistant server")
+    parser.add_argument('interviewer', help="WAV file with the interviewer's track")
+    parser.add_argument('candidate', help="WAV file with the candidate's track")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--speed', type=float, default=1.0, help="1 for real time, N for Nx, 0 for as fast as the server accepts it")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.interviewer, args.candidate, args.host, args.port, args.speed))
+    print("\nFeedback:\n" + result["feedback"])
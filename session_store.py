@@ -0,0 +1,396 @@
+from threading import Thread, Event, Lock
+from datetime import datetime
+import struct
+import json
+import mmap
+import time
+import os
+
+# Every session is a directory in here
+SESSIONS_DIR = 'sessions'
+JOURNAL_FILE = 'journal.jsonl'
+MESSAGE_INDEX_FILE = 'messages.idx'
+FEEDBACK_INDEX_FILE = 'feedback.idx'
+# Pending records are written (and fsync-ed) at most this often, a crash loses at most this much
+JOURNAL_FLUSH_INTERVAL = 1.0
+
+_INDEX_MAGIC = b'IAIX'
+# magic, format version, bytes of the journal the index covers, number of slots in use
+_INDEX_HEADER = struct.Struct('<4sIQQ')
+_INDEX_SLOT = struct.Struct('<Q')
+
+
+def new_session_name() -> str:
+    return datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+
+
+def latest_session_name(sessions_dir: str = SESSIONS_DIR) -> str:
+    """
+        The most recent session with something recorded (names sort chronologically), None if there's none
+    """
+    if not os.path.isdir(sessions_dir):
+        return None
+    names = sorted(n for n in os.listdir(sessions_dir) if _has_records(os.path.join(sessions_dir, n)))
+    return names[-1] if names else None
+
+
+def _has_records(session_path: str) -> bool:
+    journal_path = os.path.join(session_path, JOURNAL_FILE)
+    return os.path.isfile(journal_path) and os.path.getsize(journal_path) > 0
+
+
+class _OffsetIndex:
+    """
+        A memory-mapped array of journal offsets: slot i holds (offset + 1) of the latest record
+        for item i (0 = no record). The header says how much of the journal the slots account for,
+        anything after that is found by scanning the journal's tail.
+        `read_only` never creates or changes the file (another process may be journaling the session):
+        a missing or unreadable index covers nothing, so the whole journal is scanned instead
+    """
+    def __init__(self, file_path: str, read_only: bool = False):
+        if read_only:
+            self._open_read_only(file_path)
+            return
+        self._file = open(file_path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < _INDEX_HEADER.size:
+            self._file.truncate(_INDEX_HEADER.size + 1024 * _INDEX_SLOT.size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self.covered, self.count = 0, 0
+            self._write_header()
+        else:
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            magic, _, self.covered, self.count = _INDEX_HEADER.unpack_from(self._map, 0)
+            if magic != _INDEX_MAGIC:
+                raise ValueError(f"{file_path} is not a session index")
+
+    def _open_read_only(self, file_path: str) -> None:
+        self._file, self._map = None, None
+        self.covered, self.count = 0, 0
+        try:
+            self._file = open(file_path, 'rb')
+            if os.fstat(self._file.fileno()).st_size < _INDEX_HEADER.size:
+                return
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            return
+        magic, _, covered, count = _INDEX_HEADER.unpack_from(self._map, 0)
+        if magic == _INDEX_MAGIC:
+            self.covered, self.count = covered, count
+
+    def get(self, i: int) -> int:
+        """
+            Offset of item i's latest record, -1 if there's none
+        """
+        position = _INDEX_HEADER.size + i * _INDEX_SLOT.size
+        if i >= self.count or position + _INDEX_SLOT.size > len(self._map):
+            return -1
+        return _INDEX_SLOT.unpack_from(self._map, position)[0] - 1
+
+    def set(self, i: int, offset: int) -> None:
+        position = _INDEX_HEADER.size + i * _INDEX_SLOT.size
+        if position + _INDEX_SLOT.size > len(self._map):
+            # Double the capacity, so growing the file stays rare
+            self._map.close()
+            self._file.truncate(2 * position)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+        _INDEX_SLOT.pack_into(self._map, position, offset + 1)
+        self.count = max(self.count, i + 1)
+
+    def reset(self) -> None:
+        self.count = 0
+
+    def commit(self, covered: int) -> None:
+        self.covered = covered
+        self._write_header()
+        self._map.flush()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _write_header(self) -> None:
+        _INDEX_HEADER.pack_into(self._map, 0, _INDEX_MAGIC, 1, self.covered, self.count)
+
+
+class SessionData:
+    """
+        What a reloaded session contains: the latest version of every message (in id order)
+        and every completed feedback
+    """
+    def __init__(self):
+        # dicts with 'id', 'role', 'type', 'content' and, if they were recorded, 'start' and 'words'
+        self.messages: list[dict] = []
+        # dicts with 'feedback' and 'at' (unix time)
+        self.feedback: list[dict] = []
+
+
+class SessionJournal:
+    """
+        Append-only, line-per-record journal of a session: ChatHistory updates and completed LLM feedback.
+        Records are collected in memory and a background thread writes them out every JOURNAL_FLUSH_INTERVAL
+        with a single write and fsync. Realtime updates of a message that are superseded within a batch
+        never reach the disk, the ones that are superseded later are dropped by `close` (compaction).
+        Two memory-mapped indexes point at the latest record of every message and at every feedback,
+        so reloading reads exactly one record per message however long the journal is.
+        The session's files are only created with the first record, a run that records nothing leaves no session behind.
+    """
+    def __init__(self, name: str = None, sessions_dir: str = SESSIONS_DIR):
+        self.name = name if name is not None else new_session_name()
+        self.path = os.path.join(sessions_dir, self.name)
+        self._journal = None
+        self._messages = None
+        self._feedback = None
+        if _has_records(self.path):
+            # Resuming: start from a compacted journal with indexes that cover all of it
+            #   (after a crash the last records may not be indexed yet)
+            compact_session(self.path)
+            self._open()
+
+        # Records waiting for the next flush, and where in `_pending` each message's record is
+        #   (a newer version replaces it in place). Reset by clear, as message ids start over
+        self._pending: list = []
+        self._pending_messages: dict[int, int] = {}
+        self._lock = Lock()
+        self._stop = Event()
+        self._closed = False
+
+        self.records_written = 0
+        self.records_coalesced = 0
+        self.flushes = 0
+
+        self._thread = Thread(target=self._run, name="SessionJournal", daemon=True)
+        self._thread.start()
+
+    def message(self, message_id: int, role: str, transcription_type: str, content: str,
+                start: float = None, words: list = None) -> None:
+        """
+            A message was added or updated. Cheap, meant to be called from ChatHistory.put.
+            `start` and `words` are its timestamps (see timeline.Timeline), kept so a reloaded session is ordered the same
+        """
+        record = ('message', message_id, role, transcription_type, content, start, words)
+        with self._lock:
+            position = self._pending_messages.get(message_id)
+            if position is None:
+                self._pending_messages[message_id] = len(self._pending)
+                self._pending.append(record)
+            else:
+                self._pending[position] = record
+                self.records_coalesced += 1
+
+    def feedback(self, text: str) -> None:
+        with self._lock:
+            self._pending.append(('feedback', time.time(), text))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pending.append(('clear',))
+            self._pending_messages = {}
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending, self._pending_messages = self._pending, [], {}
+        if not pending:
+            return
+        if self._journal is None:
+            self._open()
+
+        offset = self._journal.tell()
+        lines = []
+        for record in pending:
+            if record[0] == 'message':
+                _, message_id, role, transcription_type, content, start, words = record
+                line = {"id": message_id, "role": role, "type": transcription_type, "content": content}
+                if start is not None:
+                    line["start"] = start
+                if words:
+                    line["words"] = words
+                self._messages.set(message_id, offset)
+            elif record[0] == 'feedback':
+                line = {"feedback": record[2], "at": record[1]}
+                self._feedback.set(self._feedback.count, offset)
+            else:
+                line = {"clear": True}
+                self._messages.reset()
+            data = json.dumps(line, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+            lines.append(data)
+            offset += len(data)
+
+        self._journal.write(b''.join(lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        # The index only ever points at records that are already on disk
+        self._messages.commit(offset)
+        self._feedback.commit(offset)
+        self.records_written += len(lines)
+        self.flushes += 1
+
+    def close(self, compact: bool = True) -> None:
+        """
+            Writes out what's pending and (by default) rewrites the journal with only
+            the latest version of every message and the feedback
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+        if self._journal is None:
+            return
+        self._journal.close()
+        self._messages.close()
+        self._feedback.close()
+        if compact:
+            compact_session(self.path)
+
+    @property
+    def exists(self) -> bool:
+        """
+            Whether anything was recorded, i.e. the session is on disk
+        """
+        return self._journal is not None
+
+    def stats(self) -> dict:
+        return {
+            "records_written": self.records_written,
+            "records_coalesced": self.records_coalesced,
+            "flushes": self.flushes,
+        }
+
+    def _run(self) -> None:
+        while not self._stop.wait(JOURNAL_FLUSH_INTERVAL):
+            self.flush()
+
+    def _open(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self._journal = open(os.path.join(self.path, JOURNAL_FILE), 'ab')
+        self._messages = _OffsetIndex(os.path.join(self.path, MESSAGE_INDEX_FILE))
+        self._feedback = _OffsetIndex(os.path.join(self.path, FEEDBACK_INDEX_FILE))
+
+
+def _read_records(session_path: str) -> tuple[list[bytes], list[bytes]]:
+    """
+        The raw journal lines of every message's latest record (in id order) and of every feedback.
+        Missing or inconsistent indexes are replaced by a full scan of the journal (the files are only read)
+    """
+    journal_path = os.path.join(session_path, JOURNAL_FILE)
+    with open(journal_path, 'rb') as jf:
+        size = os.fstat(jf.fileno()).st_size
+        if size == 0:
+            return [], []
+        messages = _OffsetIndex(os.path.join(session_path, MESSAGE_INDEX_FILE), read_only=True)
+        feedback = _OffsetIndex(os.path.join(session_path, FEEDBACK_INDEX_FILE), read_only=True)
+        try:
+            with mmap.mmap(jf.fileno(), 0, access=mmap.ACCESS_READ) as journal:
+                def line_at(offset: int) -> bytes:
+                    # Every record starts right after a newline, anything else means the index is stale
+                    if offset < 0 or offset >= size or (offset > 0 and journal[offset - 1] != 0x0A):
+                        raise ValueError(offset)
+                    return journal[offset:journal.find(b'\n', offset)]
+
+                position = min(messages.covered, feedback.covered)
+                try:
+                    if position > size:
+                        raise ValueError(position)
+                    message_lines = [line_at(messages.get(i)) for i in range(messages.count)]
+                    feedback_lines = [line_at(feedback.get(i)) for i in range(feedback.count)]
+                except ValueError:
+                    message_lines, feedback_lines, position = [], [], 0
+
+                # Whatever was written after the index was last committed (e.g. a crash in between)
+                tail = journal[position:size].split(b'\n')
+        finally:
+            messages.close()
+            feedback.close()
+
+    by_id = dict(enumerate(message_lines))
+    for line in tail:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # An empty or half written last line
+            continue
+        if "clear" in record:
+            by_id = {}
+        elif "id" in record:
+            by_id[record["id"]] = line
+        else:
+            feedback_lines.append(line)
+    return [by_id[i] for i in sorted(by_id)], feedback_lines
+
+
+def load_session(name: str, sessions_dir: str = SESSIONS_DIR) -> SessionData:
+    data = SessionData()
+    message_lines, feedback_lines = _read_records(os.path.join(sessions_dir, name))
+    data.messages = [json.loads(line) for line in message_lines]
+    data.feedback = [json.loads(line) for line in feedback_lines]
+    return data
+
+
+def read_messages(name: str, message_ids: list[int], sessions_dir: str = SESSIONS_DIR) -> dict[int, dict]:
+    """
+        Just the given messages of a session (id -> message), read through the index
+    """
+    session_path = os.path.join(sessions_dir, name)
+    with open(os.path.join(session_path, JOURNAL_FILE), 'rb') as jf:
+        size = os.fstat(jf.fileno()).st_size
+        messages = _OffsetIndex(os.path.join(session_path, MESSAGE_INDEX_FILE), read_only=True)
+        try:
+            if size and messages.covered == size:
+                with mmap.mmap(jf.fileno(), 0, access=mmap.ACCESS_READ) as journal:
+                    result = {}
+                    for message_id in message_ids:
+                        offset = messages.get(message_id)
+                        if 0 <= offset < size and (offset == 0 or journal[offset - 1] == 0x0A):
+                            result[message_id] = json.loads(journal[offset:journal.find(b'\n', offset)])
+                    if len(result) == len(message_ids):
+                        return result
+        finally:
+            messages.close()
+
+    # The index doesn't cover the whole journal (the session is still being recorded or crashed)
+    wanted = set(message_ids)
+    return {m['id']: m for m in load_session(name, sessions_dir).messages if m['id'] in wanted}
+
+
+def compact_session(session_path: str) -> None:
+    """
+        Rewrites the journal with only the latest record of every message, then the feedback,
+        and rebuilds the indexes. Superseded realtime updates (and whatever was cleared) are dropped
+    """
+    message_lines, feedback_lines = _read_records(session_path)
+
+    journal_path = os.path.join(session_path, JOURNAL_FILE)
+    message_index_path = os.path.join(session_path, MESSAGE_INDEX_FILE)
+    feedback_index_path = os.path.join(session_path, FEEDBACK_INDEX_FILE)
+    for file_path in (journal_path + '.tmp', message_index_path + '.tmp', feedback_index_path + '.tmp'):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    messages = _OffsetIndex(message_index_path + '.tmp')
+    feedback = _OffsetIndex(feedback_index_path + '.tmp')
+    offset = 0
+    with open(journal_path + '.tmp', 'wb') as jf:
+        for i, line in enumerate(message_lines):
+            messages.set(i, offset)
+            jf.write(line + b'\n')
+            offset += len(line) + 1
+        for i, line in enumerate(feedback_lines):
+            feedback.set(i, offset)
+            jf.write(line + b'\n')
+            offset += len(line) + 1
+        jf.flush()
+        os.fsync(jf.fileno())
+    messages.commit(offset)
+    feedback.commit(offset)
+    messages.close()
+    feedback.close()
+
+    # Without indexes, load rebuilds them from the journal, so a crash anywhere in between is safe
+    os.remove(message_index_path)
+    os.remove(feedback_index_path)
+    os.replace(journal_path + '.tmp', journal_path)
+    os.replace(message_index_path + '.tmp', message_index_path)
+    os.replace(feedback_index_path + '.tmp', feedback_index_path)
@@ -0,0 +1,116 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue, Empty
+import threading
+import time
+
+
+class _Lane:
+    """
+        One loaded model and the worker thread that serves its request queue.
+        Every request that is pending when the worker wakes up is taken as one batch,
+        so when both recorders finish an utterance at once, neither waits for a model
+        switch or for the other lane's work in between. The worker never waits for more requests
+        to arrive: a lone final transcription (one person speaking) starts right away.
+    """
+    def __init__(self, name: str, engine):
+        self.name = name
+        self.engine = engine
+        self.requests = Queue()
+
+        self.batches = 0
+        self.transcriptions = 0
+        self.busy_seconds = 0.0
+        threading.Thread(target=self._run, name="SharedTranscription-" + name, daemon=True).start()
+
+    def transcribe(self, audio, language=None, use_prompt=True, **options):
+        """
+            The executor interface RealTimeSTT calls (from its own threads), blocks until the result is ready
+        """
+        future = Future()
+        self.requests.put((audio, language, use_prompt, options, future))
+        return future.result()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.requests.get()]
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except Empty:
+                    break
+
+            started = time.monotonic()
+            for audio, language, use_prompt, options, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(self.engine.transcribe(audio, language=language, use_prompt=use_prompt, **options))
+                except Exception as e:
+                    future.set_exception(e)
+            self.busy_seconds += time.monotonic() - started
+            self.batches += 1
+            self.transcriptions += len(batch)
+
+
+def load_engines(config: dict) -> tuple:
+    """
+        The (final, realtime) transcription engines described by a recorder config
+    """
+    from RealtimeSTT.transcription_engines import create_transcription_engine, TranscriptionEngineConfig
+
+    device = config.get('device', 'cuda')
+    if device == 'cuda':
+        import torch
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def load(model: str, beam_size: int, batch_size: int, initial_prompt: str):
+        return create_transcription_engine(config.get('transcription_engine', 'faster_whisper'), TranscriptionEngineConfig(
+            model=model,
+            download_root=config.get('download_root'),
+            compute_type=config.get('compute_type', 'default'),
+            device=device,
+            beam_size=beam_size,
+            initial_prompt=initial_prompt,
+            batch_size=batch_size,
+            vad_filter=config.get('faster_whisper_vad_filter', True),
+        ))
+
+    # Both models load at the same time (the loading is mostly I/O and native code)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        final = pool.submit(load,
+            config['model'], config.get('beam_size', 5), config.get('batch_size', 0), config.get('initial_prompt'))
+        realtime = pool.submit(load,
+            config['realtime_model_type'], config.get('beam_size_realtime', 3), config.get('realtime_batch_size', 0),
+            config.get('initial_prompt_realtime'))
+        return final.result(), realtime.result()
+
+
+class SharedTranscriptionEngine:
+    """
+        Loads the final and the realtime Whisper models once and serves every recorder from them.
+        Each recorder keeps its own VAD, buffers and callbacks; only the transcription is shared,
+        through `recorder_options()` which plugs the two lanes in as RealTimeSTT's external executors.
+    """
+    def __init__(self, config: dict):
+        final, realtime = load_engines(config)
+        self.final = _Lane('final', final)
+        self.realtime = _Lane('realtime', realtime)
+
+    def recorder_options(self) -> dict:
+        """
+            Extra AudioToTextRecorder arguments that make a recorder use the shared models
+        """
+        return {
+            'transcription_executor': self.final,
+            'realtime_transcription_executor': self.realtime,
+        }
+
+    def stats(self) -> dict:
+        return {
+            lane.name: {
+                "batches": lane.batches,
+                "transcriptions": lane.transcriptions,
+                "busy_seconds": lane.busy_seconds,
+            }
+            for lane in (self.final, self.realtime)
+        }
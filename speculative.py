@@ -0,0 +1,179 @@
+from collections import OrderedDict
+from typing import AsyncGenerator
+import hashlib
+import asyncio
+import json
+
+from context_window import ContextWindow
+from gpt_request import _LLMAPI
+from llm_client import LLMClient
+
+# Wait this long after the interviewer's latest final phrase before generating,
+#   so that a burst of phrases results in a single request
+SPECULATIVE_DEBOUNCE = 1.5
+# At most this many speculative requests run at the same time
+SPECULATIVE_MAX_CONCURRENT = 2
+# Number of precomputed responses kept
+SPECULATIVE_CACHE_SIZE = 16
+
+
+def history_key(llm: _LLMAPI, messages: list[dict]) -> str:
+    """
+        Identifies a prompt: the model, the system prompt and the messages
+    """
+    payload = json.dumps([llm.model, llm.system_prompt, messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Generation:
+    """
+        A (possibly still running) response for one prompt. Readers follow `chunks` as they're added
+    """
+    def __init__(self, key: str, messages: list[dict]):
+        self.key = key
+        self.messages = messages
+        self.chunks: list[str] = []
+        self.done = False
+        self.failed = False
+        # What the request failed with (None if it didn't, or was cancelled), re-raised to the followers
+        self.error: Exception = None
+        self.followers = 0
+        self.task: asyncio.Task = None
+        self.changed = asyncio.Condition()
+
+    async def add(self, chunk: str) -> None:
+        async with self.changed:
+            self.chunks.append(chunk)
+            self.changed.notify_all()
+
+    async def finish(self, failed: bool = False, error: Exception = None) -> None:
+        async with self.changed:
+            self.done = True
+            self.failed = failed
+            self.error = error
+            self.changed.notify_all()
+
+    async def follow(self) -> AsyncGenerator[str, None]:
+        self.followers += 1
+        try:
+            i = 0
+            while True:
+                async with self.changed:
+                    await self.changed.wait_for(lambda: len(self.chunks) > i or self.done)
+                    new_chunks = self.chunks[i:]
+                    finished = self.done
+                for chunk in new_chunks:
+                    yield chunk
+                i += len(new_chunks)
+                if finished and i == len(self.chunks):
+                    if self.error is not None:
+                        # The follower reports it like a request of its own that failed
+                        raise self.error
+                    return
+        finally:
+            self.followers -= 1
+
+
+class SpeculativeFeedback:
+    """
+        Generates the feedback in the background every time the interviewer finishes a phrase,
+        so that F7 can show it without waiting for the LLM.
+        Responses are cached by a hash of the prompt. A newer phrase cancels the speculative requests
+        for older prompts (unless F7 is already showing them).
+        All the state lives on the LLMClient's event loop.
+    """
+    def __init__(self, llm: _LLMAPI, context_window: ContextWindow, llm_client: LLMClient):
+        self.llm = llm
+        self.context_window = context_window
+        self.loop = llm_client.loop
+        self._cache: OrderedDict[str, _Generation] = OrderedDict()
+        self._in_flight: list[_Generation] = []
+        self._debounce: asyncio.TimerHandle = None
+        self._semaphore = asyncio.Semaphore(SPECULATIVE_MAX_CONCURRENT)
+
+        self.hits = 0
+        self.misses = 0
+
+    def on_user_final(self) -> None:
+        """
+            Thread-safe. Called for every final phrase of the interviewer
+        """
+        self.loop.call_soon_threadsafe(self._schedule)
+
+    def reset(self) -> None:
+        self.loop.call_soon_threadsafe(self._reset)
+
+    def _reset(self) -> None:
+        if self._debounce is not None:
+            self._debounce.cancel()
+        for generation in self._in_flight:
+            generation.task.cancel()
+        self._cache.clear()
+
+    def _schedule(self) -> None:
+        if self._debounce is not None:
+            self._debounce.cancel()
+        self._debounce = self.loop.call_later(SPECULATIVE_DEBOUNCE, self._start)
+
+    def _start(self) -> None:
+        self._debounce = None
+        messages = self.context_window.messages()
+        if not messages:
+            return
+        key = history_key(self.llm, messages)
+        if key in self._cache:
+            return
+
+        # Anything still generating for an older transcript is stale now
+        for generation in list(self._in_flight):
+            if generation.followers == 0:
+                generation.task.cancel()
+
+        self._generate(key, messages)
+
+    def _generate(self, key: str, messages: list[dict]) -> _Generation:
+        generation = _Generation(key, messages)
+        self._cache[key] = generation
+        while len(self._cache) > SPECULATIVE_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        self._in_flight.append(generation)
+        generation.task = self.loop.create_task(self._run(generation))
+        return generation
+
+    async def _run(self, generation: _Generation) -> None:
+        failed = True
+        error = None
+        try:
+            async with self._semaphore:
+                async for chunk in self.llm.achat(generation.messages):
+                    await generation.add(chunk)
+            failed = False
+        except Exception as e:
+            error = e
+        finally:
+            self._in_flight.remove(generation)
+            if failed and self._cache.get(generation.key) is generation:
+                # Cancelled or errored, don't serve a partial response later
+                del self._cache[generation.key]
+            await generation.finish(failed, error)
+
+    async def stream(self, messages: list[dict]) -> AsyncGenerator[str, None]:
+        """
+            The response for `messages`: the precomputed (or still generating) one for the same prompt,
+            else the newest speculative one in flight, else a new request
+        """
+        key = history_key(self.llm, messages)
+        generation = self._cache.get(key)
+        if generation is not None:
+            self._cache.move_to_end(key)
+        elif self._in_flight:
+            generation = self._in_flight[-1]
+
+        if generation is None or (generation.done and generation.failed):
+            self.misses += 1
+            generation = self._generate(key, messages)
+        else:
+            self.hits += 1
+
+        async for chunk in generation.follow():
+            yield chunk
@@ -0,0 +1,157 @@
+from enum import Enum
+import threading
+import time
+
+
+class COMPONENT_STATUS(Enum):
+    WAITING = 'waiting'
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class _Component:
+    def __init__(self, name: str, after: tuple):
+        self.name = name
+        self.after = after
+        self.status = COMPONENT_STATUS.WAITING
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error: BaseException = None
+        self.finished = threading.Event()
+
+
+class Startup:
+    """
+        Loads the app's components (the STT models, the recorders, the LLM provider) on their own threads,
+        so the slow ones overlap instead of running one after the other and the UI can show up right away.
+        A component may list the components it needs (`after`), it starts loading once they're ready.
+        Every component's status and timing can be read at any time, from any thread.
+    """
+    def __init__(self, started_at: float = None):
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self._components: dict[str, _Component] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._components
+
+    def start(self, name: str, target, *args, after: tuple = ()) -> None:
+        """
+            Runs target(*args) on a new thread (once everything in `after` is ready),
+            its return value becomes the component's result
+        """
+        component = _Component(name, tuple(after))
+        self._components[name] = component
+        threading.Thread(target=self._run, args=[component, target, args], name="Startup-" + name, daemon=True).start()
+
+    def record(self, name: str, started_at: float, finished_at: float = None) -> None:
+        """
+            Adds a step that ran synchronously (e.g. the imports) to the breakdown
+        """
+        component = _Component(name, ())
+        component.started_at = started_at
+        component.finished_at = finished_at if finished_at is not None else time.monotonic()
+        component.status = COMPONENT_STATUS.READY
+        component.finished.set()
+        self._components[name] = component
+
+    def wait(self, name: str, timeout: float = None):
+        """
+            Blocks until the component is loaded and returns its result (raises if it failed)
+        """
+        component = self._components[name]
+        if not component.finished.wait(timeout):
+            raise TimeoutError(f"{name} is still loading")
+        if component.error is not None:
+            raise RuntimeError(f"{name} failed to load") from component.error
+        return component.result
+
+    def status(self, name: str) -> COMPONENT_STATUS:
+        return self._components[name].status
+
+    def result(self, name: str):
+        return self._components[name].result
+
+    def error(self, name: str) -> BaseException:
+        return self._components[name].error
+
+    def done(self) -> bool:
+        return all(c.finished.is_set() for c in list(self._components.values()))
+
+    def _run(self, component: _Component, target, args) -> None:
+        try:
+            for dependency in component.after:
+                self.wait(dependency)
+            component.started_at = time.monotonic()
+            component.status = COMPONENT_STATUS.LOADING
+            component.result = target(*args)
+        except BaseException as e:
+            # SystemExit included, e.g. get_default_speaker exits when there's no loopback device
+            component.error = e
+        finally:
+            # The timing is in place before the status says the component is done
+            component.finished_at = time.monotonic()
+            component.status = COMPONENT_STATUS.FAILED if component.error is not None else COMPONENT_STATUS.READY
+            component.finished.set()
+
+    def breakdown(self) -> dict:
+        """
+            Per component: when it started (relative to the app start), how long it waited
+            for the components it needs and how long it took to load
+        """
+        components = {}
+        for c in list(self._components.values()):
+            started_at = c.started_at if c.started_at is not None else c.finished_at
+            components[c.name] = {
+                "status": c.status.value,
+                "started": round(started_at - self.started_at, 3) if started_at is not None else None,
+                "waited": round(started_at - c.created_at, 3) if c.after and started_at is not None else 0.0,
+                "seconds": round(c.finished_at - started_at, 3) if c.finished_at is not None and started_at is not None else None,
+                "error": repr(c.error) if c.error is not None else None,
+            }
+        finished = [c.finished_at for c in self._components.values() if c.finished_at is not None]
+        return {
+            "total": round(max(finished) - self.started_at, 3) if self.done() and finished else None,
+            "components": components,
+        }
+
+    def summary(self) -> str:
+        """
+            One line for the UI header
+        """
+        parts = []
+        for c in list(self._components.values()):
+            if c.status is COMPONENT_STATUS.READY:
+                parts.append(f"{c.name} ✓ {c.finished_at - c.started_at:.1f}s")
+            elif c.status is COMPONENT_STATUS.FAILED:
+                parts.append(f"{c.name} ✗ {c.error}")
+            else:
+                parts.append(f"{c.name} {c.status.value}…")
+        if self.done():
+            breakdown = self.breakdown()
+            if breakdown["total"] is not None:
+                parts.insert(0, f"Started in {breakdown['total']:.1f}s")
+        return " · ".join(parts)
+
+    def report(self) -> str:
+        """
+            Multi-line startup time breakdown, for the console
+        """
+        breakdown = self.breakdown()
+        lines = ["Startup time breakdown (seconds since launch):"]
+        for name, c in breakdown["components"].items():
+            line = f"  {name:<12} {c['status']:<8}"
+            if c['started'] is not None:
+                line += f"  started {c['started']:.3f}"
+            if c['waited']:
+                line += f"  waited {c['waited']:.3f}"
+            if c['seconds'] is not None:
+                line += f"  took {c['seconds']:.3f}"
+            if c['error']:
+                line += "  " + c['error']
+            lines.append(line)
+        if breakdown["total"] is not None:
+            lines.append(f"  total        {breakdown['total']:.3f}")
+        return "\n".join(lines)
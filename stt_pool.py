@@ -0,0 +1,116 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+import time
+import os
+
+# Threads each worker process gives its Whisper models, the pool gets one worker per this many cores
+STT_WORKER_THREADS = 2
+# At most this share of the workers runs realtime passes at a time, so a final transcription
+#   never waits behind a pile of realtime ones (which are redone every pass anyway)
+REALTIME_WORKER_SHARE = 0.5
+
+# The models of the worker process, loaded once by _init_worker
+_engines: dict = {}
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) // STT_WORKER_THREADS)
+
+
+def _init_worker(config: dict, threads: int) -> None:
+    # Before the models are loaded, their thread pools are sized from these
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    from shared_engine import load_engines
+
+    _engines['final'], _engines['realtime'] = load_engines(config)
+
+
+def _transcribe(lane: str, audio, language, use_prompt: bool, options: dict):
+    started = time.monotonic()
+    result = _engines[lane].transcribe(audio, language=language, use_prompt=use_prompt, **options)
+    return result, time.monotonic() - started
+
+
+class _PoolLane:
+    """
+        RealTimeSTT's executor interface over the pool, for one of the two models
+    """
+    def __init__(self, pool: 'TranscriptionPool', name: str, limit: int = None):
+        self.pool = pool
+        self.name = name
+        self._slots = threading.BoundedSemaphore(limit) if limit else None
+
+        self._lock = threading.Lock()
+        self.transcriptions = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def transcribe(self, audio, language=None, use_prompt=True, **options):
+        """
+            Blocks the calling (recorder) thread until a worker process has transcribed the audio
+        """
+        submitted = time.monotonic()
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            result, seconds = self.pool.executor.submit(_transcribe, self.name, audio, language, use_prompt, options).result()
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+        with self._lock:
+            self.transcriptions += 1
+            self.busy_seconds += seconds
+            # Queued behind other sessions' requests, plus moving the audio to the worker and the result back
+            self.wait_seconds += time.monotonic() - submitted - seconds
+        return result
+
+
+class TranscriptionPool:
+    """
+        The final and realtime Whisper models loaded in each of `workers` processes, serving any number
+        of recorders (two per server session) the way SharedTranscriptionEngine serves the app's two.
+        Separate processes make the transcriptions of different sessions run in parallel on a many-core
+        CPU, where threads would take turns on the GIL between the native calls
+    """
+    def __init__(self, config: dict, workers: int = None, threads: int = STT_WORKER_THREADS):
+        self.workers = workers or default_workers()
+        # Not forked: the parent may already hold threads and native state (torch, CUDA) a child can't inherit safely
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(config, threads))
+        self.final = _PoolLane(self, 'final')
+        self.realtime = _PoolLane(self, 'realtime', max(1, int(self.workers * REALTIME_WORKER_SHARE)))
+
+    def warm_up(self) -> None:
+        """
+            Starts every worker process and waits until all of them have loaded their models
+        """
+        # The executor spawns its workers on demand, one per pending task: as many sleeps as there are workers
+        for future in [self.executor.submit(time.sleep, 0.1) for _ in range(self.workers)]:
+            future.result()
+
+    def recorder_options(self) -> dict:
+        """
+            Extra AudioToTextRecorder arguments that make a recorder use the pool
+        """
+        return {
+            'transcription_executor': self.final,
+            'realtime_transcription_executor': self.realtime,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            **{
+                lane.name: {
+                    "transcriptions": lane.transcriptions,
+                    "busy_seconds": lane.busy_seconds,
+                    "wait_seconds": lane.wait_seconds,
+                }
+                for lane in (self.final, self.realtime)
+            },
+        }
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -1,18 +1,32 @@
 from textual.app import App
-from textual.containers import VerticalScroll, Container
-from textual.widgets import Static, Header, Footer
+from textual import work
+from textual.worker import get_current_worker
+from textual.containers import VerticalScroll, Container, Vertical
+from textual.widgets import Static, Header, Footer, Input, OptionList
+from textual.widgets.option_list import Option
 from textual.binding import Binding
 from rich.panel import Panel
 from rich.align import Align
-from threading import Event
+from threading import Thread, Lock
+from rich.table import Table
 from rich.text import Text
-from queue import Queue
+from queue import Queue, Empty
 import functools
 import keyboard
-from os import path
+import asyncio
+import time
+import io
 
 from chat_history import *
-from gpt_request import LLMFactory, APIProvider, _LLMAPI
+from gpt_request import _LLMAPI
+from context_window import ContextWindow
+from llm_config import LLM_WARM_UP, load_llm, context_budget, warm_up
+from llm_client import LLMClient
+from speculative import SpeculativeFeedback
+from startup import Startup, COMPONENT_STATUS
+from session_store import SessionJournal, SessionData
+from search_index import SearchIndex, search_sessions, snippet, parse_query
+import latency
 
 # import logging
 # from textual.logging import TextualHandler
@@ -22,11 +36,48 @@ from gpt_request import LLMFactory, APIProvider, _LLMAPI
 # )
 # logger = logging.Logger("logger")
 
-LLM_PROVIDER = APIProvider.OPENAI
-LLM_MODEL = 'gpt-4.1-nano'
+# Generate the feedback in the background after every phrase of the interviewer, so that F7 shows it
+#   right away. Costs an LLM request per phrase
+SPECULATIVE_FEEDBACK = False
 
 gpt_queue = Queue()
-terminate_event = Event()
+
+# The GPT pane is repainted at most this many times per second, however fast the chunks arrive
+GPT_FRAME_RATE = 60
+# The chat pane keeps this many turns mounted (the ones around the scroll position),
+#   the window slides by CHAT_WINDOW_STEP turns when scrolled within CHAT_WINDOW_MARGIN rows of its edge
+CHAT_WINDOW = 100
+CHAT_WINDOW_STEP = 25
+CHAT_WINDOW_MARGIN = 3
+# Number of search results shown
+SEARCH_RESULTS = 30
+# How often the header's startup status is refreshed while components are loading
+STARTUP_STATUS_INTERVAL = 0.25
+# How often the latency panel is refreshed (with --profile)
+LATENCY_PANEL_INTERVAL = 1
+
+
+class StreamBuffer:
+    """
+        Append-only buffer for the streamed LLM response.
+        Chunks are written into a StringIO (no re-concatenating the whole response per chunk)
+        and the `dirty` flag tells whether the text changed since it was last rendered
+    """
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self.dirty = False
+
+    def append(self, chunk: str) -> None:
+        self._buffer.write(chunk)
+        self.dirty = True
+
+    def clear(self) -> None:
+        self._buffer = io.StringIO()
+        self.dirty = True
+
+    def render(self) -> Text:
+        self.dirty = False
+        return Text(self._buffer.getvalue())
 
 class ChatMessage(Static):
     def __init__(self, sender: ROLE, text: str, id: str, classes: str):
@@ -48,23 +99,260 @@ class ChatMessage(Static):
         self.refresh()
 
 class ChatView(VerticalScroll):
+    """
+        The transcript: the turns of ChatHistory's timeline, i.e. both speakers' words in the order they
+        were said, a phrase interrupted by the other person split around the interruption.
+        Only a window of consecutive turns is mounted (CHAT_WINDOW of them, plus up to
+        CHAT_WINDOW_STEP more before it slides), whatever is outside of it lives in ChatHistory only.
+        Scrolling to the top of the window mounts the previous CHAT_WINDOW_STEP turns from the timeline
+        (and unmounts as many at the bottom), scrolling to its bottom does the opposite.
+        Mounted turns are reached through an index -> widget map instead of DOM queries,
+        so the cost of an update doesn't grow with the length of the session
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._widgets: dict[int, Static] = {}
+        self._containers: dict[int, Container] = {}
+        self._roles: dict[int, ROLE] = {}
+        # The mounted turns are the indexes in [_start, _stop), _count is how many turns there were at the last update
+        self._start = 0
+        self._stop = 0
+        self._count = 0
+        self._sliding = False
+        # Updates, slides and clearing all move the window, one at a time
+        self._window_lock = asyncio.Lock()
+
     def on_mount(self):
         self.border_title = "Chat History"
 
-    async def process_message(self, message_id: int, message_type: str):
-        chat_message = self.app._chat_history.get_by_id(message_id)            
+    @property
+    def _turns(self) -> list:
+        return self.app._chat_history.timeline.turns
+
+    async def process_turns(self, dirty: int):
+        """
+            Shows the timeline after an update that changed the turns from index `dirty` on (see Timeline.refresh)
+        """
+        turns = self._turns
+        count = len(turns)
+        async with self._window_lock:
+            at_tail = self._stop == self._count
+            self._count = count
+            if count <= self._start:
+                # The turns the window showed were merged away, start over at the tail
+                await self._remove_all()
+                self._start = self._stop = max(0, count - CHAT_WINDOW)
+                at_tail = True
+
+            for i in range(max(dirty, self._start), min(self._stop, count)):
+                if self._roles[i] is turns[i].role:
+                    self._widgets[i].update(turns[i].content)
+                else:
+                    # The other speaker's words now, e.g. a turn was split by an interruption
+                    old = self._containers[i]
+                    await self.mount(self._make(i), before=old)
+                    await old.remove()
+            if self._stop > count:
+                await self._unmount(count, self._stop)
+                self._stop = count
+
+            if not at_tail or self._stop == count:
+                return
+            # Scrolled back in history, new turns are mounted once the window slides down to them
+            await self.mount_all([self._make(i) for i in range(self._stop, count)])
+            self._stop = count
+            if self._stop - self._start > CHAT_WINDOW + CHAT_WINDOW_STEP:
+                start = self._stop - CHAT_WINDOW
+                await self._unmount(self._start, start)
+                self._start = start
+
+        self.scroll_end(animate=False)
+
+    async def show_tail(self):
+        """
+            Mounts the latest turns that are already in the timeline (a resumed session)
+        """
+        self.app._chat_history.timeline.refresh()
+        async with self._window_lock:
+            stop = len(self._turns)
+            start = max(self._stop, stop - CHAT_WINDOW)
+            await self.mount_all([self._make(i) for i in range(start, stop)])
+            self._start, self._stop, self._count = start, stop, stop
+        self.scroll_end(animate=False)
+
+    async def show_message(self, message_id: int):
+        """
+            Scrolls to the turn a message starts in and highlights it, moving the window onto it first if it isn't mounted
+        """
+        turn = self.app._chat_history.timeline.turn_of(message_id)
+        if turn is None:
+            return
+        self._sliding = True
+        async with self._window_lock:
+            if not self._start <= turn < self._stop:
+                await self._remove_all()
+                total = len(self._turns)
+                start = max(0, min(turn - CHAT_WINDOW // 2, total - CHAT_WINDOW))
+                stop = min(total, start + CHAT_WINDOW)
+                await self.mount_all([self._make(i) for i in range(start, stop)])
+                self._start, self._stop, self._count = start, stop, total
+            container = self._containers[turn]
 
-        if message_type == 'new':
-            align = 'left' if chat_message['role'] == ROLE.USER.value else 'right'
+        for widget in self.query('.search_hit'):
+            widget.remove_class('search_hit')
+        self._widgets[turn].add_class('search_hit')
 
-            container = Container(classes = 'align_'+align)
-            await self.mount(container)
-            await container.mount(Static(chat_message['content'], classes='chat_message chat_message_' + align, id="msg"+str(message_id)))
+        def jump():
+            self.scroll_to_widget(container, animate=False, top=True, immediate=True)
+            self._sliding = False
+        self.call_after_refresh(jump)
+
+    async def clear(self):
+        async with self._window_lock:
+            await self._remove_all()
+            self._start = self._stop = self._count = 0
+
+    def _make(self, i: int) -> Container:
+        turn = self._turns[i]
+        align = 'left' if turn.role is ROLE.USER else 'right'
+
+        widget = Static(turn.content, classes='chat_message chat_message_' + align)
+        container = Container(widget, classes = 'align_'+align)
+        self._widgets[i] = widget
+        self._containers[i] = container
+        self._roles[i] = turn.role
+        return container
+
+    async def _unmount(self, start: int, stop: int):
+        containers = [self._containers.pop(i) for i in range(start, stop)]
+        for i in range(start, stop):
+            del self._widgets[i]
+            del self._roles[i]
+        await self.remove_children(containers)
+
+    async def _remove_all(self):
+        containers = list(self._containers.values())
+        self._widgets.clear()
+        self._containers.clear()
+        self._roles.clear()
+        await self.remove_children(containers)
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if self._sliding:
+            return
+        if new_value < old_value and new_value <= CHAT_WINDOW_MARGIN and self._start > 0:
+            self._sliding = True
+            self.call_later(self._slide_up)
+        elif new_value > old_value and new_value >= self.max_scroll_y - CHAT_WINDOW_MARGIN \
+                and self._stop < self._count:
+            self._sliding = True
+            self.call_later(self._slide_down)
+
+    async def _slide_up(self):
+        async with self._window_lock:
+            if self._start == 0:
+                self._sliding = False
+                return
+            start = max(0, self._start - CHAT_WINDOW_STEP)
+            added = [self._make(i) for i in range(start, self._start)]
+            await self.mount_all(added, before=self._containers[self._start])
+            self._start = start
+            if self._stop - self._start > CHAT_WINDOW + CHAT_WINDOW_STEP:
+                await self._unmount(self._stop - CHAT_WINDOW_STEP, self._stop)
+                self._stop -= CHAT_WINDOW_STEP
+
+        def keep_position():
+            # What was on screen got pushed down by the new turns, scroll along with it
+            self.scroll_to(y=self.scroll_y + sum(c.outer_size.height for c in added), animate=False, immediate=True)
+            self._sliding = False
+        self.call_after_refresh(keep_position)
+
+    async def _slide_down(self):
+        async with self._window_lock:
+            stop = min(self._count, self._stop + CHAT_WINDOW_STEP)
+            if stop <= self._stop:
+                self._sliding = False
+                return
+            await self.mount_all([self._make(i) for i in range(self._stop, stop)])
+            self._stop = stop
+            removed = 0
+            if self._stop - self._start > CHAT_WINDOW + CHAT_WINDOW_STEP:
+                removed = sum(self._containers[i].outer_size.height for i in range(self._start, self._start + CHAT_WINDOW_STEP))
+                await self._unmount(self._start, self._start + CHAT_WINDOW_STEP)
+                self._start += CHAT_WINDOW_STEP
+
+        def keep_position():
+            # What was on screen moved up by the height of the unmounted turns
+            self.scroll_to(y=self.scroll_y - removed, animate=False, immediate=True)
+            self._sliding = False
+        self.call_after_refresh(keep_position)
+
+class LatencyPanel(Static):
+    """
+        p50 / p95 / p99 of every profiled stage, in ms (only shown with --profile)
+    """
+    def on_mount(self):
+        self.border_title = "Latency (ms)"
+        self.set_interval(LATENCY_PANEL_INTERVAL, self.refresh_stats)
 
-            self.scroll_end(animate=False)
-        else:
-            existing_element = self.query_exactly_one("#msg"+str(message_id))
-            existing_element.update(chat_message['content'])
+    def refresh_stats(self):
+        table = Table(box=None, expand=True)
+        for column in ("stage", "n", "p50", "p95", "p99"):
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for name, stats in latency.profiler.summary().items():
+            table.add_row(name, str(stats["count"]), f"{stats['p50']:.0f}", f"{stats['p95']:.0f}", f"{stats['p99']:.0f}")
+        self.update(table)
+
+class SearchPanel(Vertical):
+    """
+        Full-text search over this session and the saved ones ("quoted phrases" match as a whole).
+        Picking a result of this session scrolls the chat to it
+    """
+    def compose(self):
+        yield Input(placeholder='Search the transcripts, e.g. kubernetes "rolling update"', id='search-input')
+        yield OptionList(id='search-results')
+
+    def on_mount(self):
+        self.border_title = "Search (Esc to close)"
+
+    def on_input_submitted(self, event: Input.Submitted):
+        self.search(event.value)
+
+    @work(thread=True, exclusive=True, group="search")
+    def search(self, query: str):
+        app = self.app
+        current = (app.current_session_name(), app._chat_history.search_index)
+        started = time.perf_counter()
+        results = search_sessions(query, SEARCH_RESULTS, current)
+        elapsed = time.perf_counter() - started
+        self.app.call_from_thread(self.show_results, query, results, elapsed)
+
+    def show_results(self, query: str, results: list[dict], elapsed: float):
+        clauses = parse_query(query)
+        results_list = self.query_one('#search-results', OptionList)
+        results_list.clear_options()
+        for result in results:
+            if result["session"] == self.app.current_session_name():
+                record = self.app._chat_history.get_by_id(result["id"])
+                label = f"{result['role'].value}: {snippet(record.content, clauses)}"
+                option_id = str(result["id"])
+            else:
+                label = f"[{result['session']}] {result['role'].value}: {result['snippet']}"
+                option_id = None
+            results_list.add_option(Option(Text(label, no_wrap=True, overflow="ellipsis"), id=option_id))
+        self.border_subtitle = f"{len(results)} results in {elapsed * 1000:.0f} ms"
+        if results:
+            results_list.highlighted = 0
+            results_list.focus()
+
+    async def on_option_list_option_selected(self, event: OptionList.OptionSelected):
+        if event.option.id is not None:
+            await self.app.chat.show_message(int(event.option.id))
+
+    def key_escape(self):
+        self.display = False
+        self.app.chat.focus()
 
 class ChatApp(App):
     BINDINGS = [
@@ -72,15 +360,31 @@ class ChatApp(App):
         Binding(key='-', action="decrease_gpt_window_width", description="Decrease GPT container width"),
         Binding(key="f7", action="generate_gpt_feedback", description="Generate Feedback"),
         Binding(key="f8", action="clear_chat", description="Clear the chat"),
+        Binding(key="ctrl+f", action="search", description="Search"),
         Binding(key="Ctrl +", action="zoom_in", description="Zoom In"),
         Binding(key="Ctrl -", action="zoom_out", description="Zoom Out"),
     ]
     CSS_PATH = "dom.tcss"
 
-    def __init__(self, message_queue: Queue, **kwargs):
+    def __init__(self, message_queue: Queue, startup: Startup = None, journal: SessionJournal = None, session: SessionData = None, **kwargs):
         super().__init__(**kwargs)
         self.message_queue = message_queue
+        self.startup = startup if startup is not None else Startup()
+        self.journal = journal
+        self.session = session
         self._chat_history = ChatHistory()
+        self._chat_history.search_index = SearchIndex()
+        if session is not None:
+            self._chat_history.restore(session.messages)
+        self._chat_history.journal = journal
+        # The history is written on the UI loop and read by the context window from other threads
+        #   (F7 on the keyboard hook thread, the summary thread, the speculative feedback on the LLM client's loop)
+        self._history_lock = Lock()
+        self._gpt_buffer = StreamBuffer()
+        # Set up once the LLM provider is loaded (see llm_ready)
+        self._context_window: ContextWindow = None
+        self._llm_client: LLMClient = None
+        self._speculative: SpeculativeFeedback = None
 
     def action_increase_gpt_window_width(self):
         modify_gpt_window_width(self, increase=True)
@@ -88,55 +392,136 @@ class ChatApp(App):
     def action_decrease_gpt_window_width(self):
         modify_gpt_window_width(self, increase=False)
 
-    def action_clear_chat(self):
+    def action_search(self):
+        self.search_panel.display = True
+        self.search_panel.query_one('#search-input', Input).focus()
+
+    def current_session_name(self) -> str:
+        return self.journal.name if self.journal is not None else None
+
+    async def action_clear_chat(self):
         # logger.info("Chat history cleared")
-        self._chat_history.clear()
-        for wdgt in self.chat.children:
-            wdgt.remove()
+        with self._history_lock:
+            self._chat_history.clear()
+            if self._context_window is not None:
+                self._context_window.reset()
+        if self._speculative is not None:
+            self._speculative.reset()
+        await self.chat.clear()
 
     def compose(self):
         self.header = Header(name="Interview Assist")   
         self.chat = ChatView(id="chatcontainer", name = "Chat History")
         self.footer = Footer(show_command_palette=True)
-        self.gpt = VerticalScroll(Static("", id='gpt-content'), id='gpt')
+        self.gpt_content = Static("", id='gpt-content')
+        self.gpt = VerticalScroll(self.gpt_content, id='gpt')
+        self.search_panel = SearchPanel(id='search')
+        self.search_panel.display = False
         yield self.chat
         yield self.header
         yield self.gpt
         yield self.footer
+        yield self.search_panel
+        if latency.profiler is not None:
+            yield LatencyPanel(id='latency')
 
     def on_mount(self):
-        gptService = LLMFactory(LLM_PROVIDER)
-        gptService.authenticate()
-        gptService.select_model(LLM_MODEL)
+        if 'llm' not in self.startup:
+            self.startup.start('llm', load_llm)
 
-        if path.isfile('systemprompt.txt'):
-            with open('systemprompt.txt', 'r', encoding='utf-8') as spf:
-                gptService.set_system_prompt(spf.read())
+        self.gpt.border_title = "GPT Feedback"
+        if len(self._chat_history):
+            self.call_later(self.chat.show_tail)
+        if self.session is not None and self.session.feedback:
+            gpt_queue.put("|||")
+            gpt_queue.put(self.session.feedback[-1]['feedback'])
+        self.watch_message_queue()
+        self.set_interval(1 / GPT_FRAME_RATE, self.check_gpt_queue)
+        self._startup_timer = self.set_interval(STARTUP_STATUS_INTERVAL, self.check_startup)
+        self.check_startup()
 
-        keyboard.on_press_key('F7', functools.partial(generate_reply, gptService, self._chat_history))
+    def check_startup(self):
+        """
+            Shows the components' readiness in the header and sets up the LLM side once its provider is loaded
+        """
+        self.sub_title = self.startup.summary()
 
-        # Start polling queue every 100ms
-        self.gpt.border_title = "GPT Feedback"
-        self.set_interval(0.1, self.check_message_queue)
-        self.set_interval(0.01, self.check_gpt_queue)
+        if self._llm_client is None and self.startup.status('llm') is COMPONENT_STATUS.READY:
+            self.llm_ready(self.startup.result('llm'))
+
+        if self.startup.done():
+            self._startup_timer.stop()
+            if self.startup.status('llm') is COMPONENT_STATUS.FAILED:
+                gpt_queue.put("LLM provider unavailable: " + str(self.startup.error('llm')))
+
+    def llm_ready(self, gptService: _LLMAPI):
+        if LLM_WARM_UP:
+            Thread(target=warm_up, args=[gptService], daemon=True).start()
+
+        self._context_window = ContextWindow(gptService, self._chat_history, context_budget(), self._history_lock)
+        # Whatever was said while the provider was loading counts too
+        self._context_window.notify_final()
+
+        self._llm_client = LLMClient()
+        self._speculative = SpeculativeFeedback(gptService, self._context_window, self._llm_client) if SPECULATIVE_FEEDBACK else None
 
-    async def check_message_queue(self):
-        """Process all pending messages from the thread-safe queue."""
-        if not self.message_queue.empty():
-            chat_message = self.message_queue.get_nowait()
-            message_id, message_type = self._chat_history.put(chat_message['role'], chat_message['transcription_type'], chat_message['content'])
-            await self.chat.process_message(message_id, message_type)
+        keyboard.on_press_key('F7', functools.partial(generate_reply, gptService, self._context_window, self._llm_client, self._speculative, self.journal))
+
+    @work(thread=True, exclusive=True, group="message_queue")
+    def watch_message_queue(self):
+        """
+            Waits on the thread-safe queue and, as soon as something arrives,
+            hands everything pending over to the UI as one coalesced batch.
+        """
+        worker = get_current_worker()
+        while not worker.is_cancelled:
+            try:
+                batch = [self.message_queue.get(timeout=0.1)]
+            except Empty:
+                continue
+            while True:
+                try:
+                    batch.append(self.message_queue.get_nowait())
+                except Empty:
+                    break
+            # Waits until the batch is rendered, so a slow UI throttles the draining
+            self.call_from_thread(self.process_messages, coalesce_messages(batch))
+
+    async def process_messages(self, chat_messages: list[dict]):
+        with self._history_lock:
+            for chat_message in chat_messages:
+                self._chat_history.put(chat_message['role'], chat_message['transcription_type'], chat_message['content'],
+                                       chat_message.get('words'), chat_message.get('started_at'))
+                latency.mark(chat_message, 'history')
+            # The whole batch is placed on the timeline first, then the turns it changed are shown at once
+            changed = self._chat_history.timeline.refresh()
+        await self.chat.process_turns(changed)
+        for chat_message in chat_messages:
+            latency.mark(chat_message, 'render')
+            latency.record_message(chat_message)
+            if chat_message['transcription_type'] == MESSAGE_TYPE.FINAL and self._context_window is not None:
+                self._context_window.notify_final()
+                if self._speculative is not None and chat_message['role'] == ROLE.USER:
+                    self._speculative.on_user_final()
 
     async def check_gpt_queue(self):
+        """
+            Takes every chunk that arrived since the last frame and repaints the GPT pane once
+        """
         global gpt_queue
-        
-        if not(gpt_queue.empty()):
-            chunk = gpt_queue.get()
-            object_to_update = self.query_exactly_one('#gpt-content')
+
+        while True:
+            try:
+                chunk = gpt_queue.get_nowait()
+            except Empty:
+                break
             if chunk == '|||':
-                object_to_update.update("")
+                self._gpt_buffer.clear()
             else:
-                object_to_update.update(object_to_update.renderable + chunk)
+                self._gpt_buffer.append(chunk)
+
+        if self._gpt_buffer.dirty:
+            self.gpt_content.update(self._gpt_buffer.render())
 
 
 
@@ -151,11 +536,36 @@ def modify_gpt_window_width(app: ChatApp, increase: bool=False, increment: int =
     app.refresh()
 
 
-def generate_reply(gptService: _LLMAPI, chat_history: ChatHistory, event=None):
-    global gpt_queue, terminate_event
+def generate_reply(gptService: _LLMAPI, context_window: ContextWindow, llm_client: LLMClient, speculative: SpeculativeFeedback = None,
+                   journal: SessionJournal = None, event=None):
+    """
+        Runs on the keyboard hook thread and only schedules the request.
+        A request that is still streaming is cancelled (and its connection closed) first
+    """
+    pressed_at = time.monotonic()
+    llm_client.submit('feedback', stream_reply(gptService, context_window.messages(), speculative, pressed_at, journal))
+
+
+async def stream_reply(gptService: _LLMAPI, chat_history_llm: list[dict], speculative: SpeculativeFeedback = None, pressed_at: float = None,
+                       journal: SessionJournal = None):
+    global gpt_queue
 
     gpt_queue.put("|||")
-    chat_history_llm = chat_history.as_list(until_latest_user_final=True)
     if chat_history_llm:
-        for z in gptService.chat(chat_history_llm, terminate_event):
-            gpt_queue.put(z)
\ No newline at end of file
+        timestamps = {'press': pressed_at} if pressed_at is not None else {}
+        timestamps['send'] = time.monotonic()
+        chunks = speculative.stream(chat_history_llm) if speculative is not None else gptService.achat(chat_history_llm)
+        response = []
+        try:
+            async for z in chunks:
+                if 'first_chunk' not in timestamps:
+                    timestamps['first_chunk'] = time.monotonic()
+                gpt_queue.put(z)
+                response.append(z)
+            timestamps['last_chunk'] = time.monotonic()
+            latency.record_llm(timestamps)
+            if journal is not None:
+                # Only completed responses are kept, a cancelled one never gets here
+                journal.feedback(''.join(response))
+        except Exception as e:
+            gpt_queue.put("\n\nRequest failed: " + str(e))
@@ -0,0 +1,277 @@
+from bisect import bisect_left, bisect_right, insort
+from itertools import takewhile
+from operator import attrgetter
+import time
+
+# Entries per chunk of the sorted entry list, a chunk is split in two once it holds twice as many
+TIMELINE_CHUNK = 256
+
+_key = attrgetter('key')
+
+
+class _Entry:
+    """
+        A word (or, when there are no word timestamps, a whole phrase) of one message.
+        The key (start, message id, position in the message) orders the timeline, ties included
+    """
+    __slots__ = ('key', 'end', 'role', 'text', 'message_id', 'final')
+
+    def __init__(self, start: float, end: float, role, text: str, message_id: int, position: int, final: bool):
+        self.key = (start, message_id, position)
+        self.end = end
+        self.role = role
+        self.text = text
+        self.message_id = message_id
+        self.final = final
+
+    @property
+    def start(self) -> float:
+        return self.key[0]
+
+
+class _SortedEntries:
+    """
+        Entries sorted by key in a list of bounded chunks: finding an entry's chunk is a binary search over
+        the chunks' last keys, then a binary search and an insert / delete within one short chunk.
+        So adding and removing stays O(log n) (plus a bounded shift) however long the session gets
+    """
+    def __init__(self):
+        self._chunks: list[list[_Entry]] = []
+        self._maxes: list[tuple] = []
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self._chunks)
+
+    def add(self, entry: _Entry) -> None:
+        if not self._chunks:
+            self._chunks.append([entry])
+            self._maxes.append(entry.key)
+            return
+        i = min(bisect_left(self._maxes, entry.key), len(self._chunks) - 1)
+        chunk = self._chunks[i]
+        insort(chunk, entry, key=_key)
+        self._maxes[i] = chunk[-1].key
+        if len(chunk) > 2 * TIMELINE_CHUNK:
+            self._chunks[i:i + 1] = [chunk[:TIMELINE_CHUNK], chunk[TIMELINE_CHUNK:]]
+            self._maxes[i:i + 1] = [chunk[TIMELINE_CHUNK - 1].key, chunk[-1].key]
+
+    def remove(self, key: tuple) -> None:
+        i = bisect_left(self._maxes, key)
+        chunk = self._chunks[i]
+        j = bisect_left(chunk, key, key=_key)
+        del chunk[j]
+        if chunk:
+            self._maxes[i] = chunk[-1].key
+        else:
+            del self._chunks[i]
+            del self._maxes[i]
+
+    def iter_from(self, key: tuple = None):
+        """
+            The entries from `key` on (all of them if None), in order
+        """
+        if key is None:
+            i, j = 0, 0
+        else:
+            i = bisect_left(self._maxes, key)
+            j = bisect_left(self._chunks[i], key, key=_key) if i < len(self._chunks) else 0
+        for chunk in self._chunks[i:]:
+            yield from chunk[j:] if j else chunk
+            j = 0
+
+
+class Turn:
+    """
+        Consecutive entries of the same speaker: what the chat shows as one bubble
+    """
+    __slots__ = ('role', 'entries')
+
+    def __init__(self, entry: _Entry):
+        self.role = entry.role
+        self.entries = [entry]
+
+    @property
+    def key(self) -> tuple:
+        return self.entries[0].key
+
+    @property
+    def realtime(self) -> bool:
+        return any(not entry.final for entry in self.entries)
+
+    @property
+    def message_ids(self) -> list[int]:
+        return list(dict.fromkeys(entry.message_id for entry in self.entries))
+
+    @property
+    def content(self) -> str:
+        return ' '.join(entry.text for entry in self.entries)
+
+    def as_message(self) -> dict:
+        return {"role": self.role.value, "content": self.content}
+
+
+def _group(entries, turns: list[Turn] = None) -> list[Turn]:
+    """
+        Appends the entries to `turns`, continuing its last turn when the speaker is the same
+    """
+    turns = [] if turns is None else turns
+    for entry in entries:
+        if turns and turns[-1].role is entry.role:
+            turns[-1].entries.append(entry)
+        else:
+            turns.append(Turn(entry))
+    return turns
+
+
+class Timeline:
+    """
+        Both speakers' words merged in the order they were said, from the recorders' word timestamps.
+        A phrase that the other speaker interrupted (a "yes" in the middle of a long question) is split there
+        instead of being kept whole and ordered by who started first.
+        Messages are updated as the transcription goes: a realtime phrase is one entry starting when its
+        recording started, the final text replaces it with its words. Results may arrive in any order,
+        each one only re-groups the turns from the first one it touches (see `refresh`)
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self) -> None:
+        self._entries = _SortedEntries()
+        # message id -> its entries, in order
+        self._messages: dict[int, list[_Entry]] = {}
+        # message id -> when it started (kept when the message is empty for now)
+        self._starts: dict[int, float] = {}
+        self.turns: list[Turn] = []
+        self._turn_keys: list[tuple] = []
+        # Lowest and highest keys that changed since the turns were last grouped (None: nothing changed)
+        self._dirty: tuple = None
+        self._dirty_high: tuple = None
+
+    def update(self, message_id: int, role, content: str, final: bool, words: list = None, started_at: float = None) -> None:
+        """
+            Adds or replaces a message. `words` are (start, end, text) in time.time() seconds.
+            Without them the message is a single entry at `started_at`, or where it started before,
+            or now (which keeps messages without any timing, e.g. from an older session, in arrival order)
+        """
+        for entry in self._messages.pop(message_id, ()):
+            self._entries.remove(entry.key)
+            self._touch(entry.key)
+
+        start = self._starts.get(message_id)
+        if start is None:
+            if started_at is not None:
+                start = started_at
+            else:
+                start = words[0][0] if words else time.time()
+            self._starts[message_id] = start
+
+        if words:
+            entries = [_Entry(word_start, word_end, role, text.strip(), message_id, position, final)
+                       for position, (word_start, word_end, text) in enumerate(words) if text.strip()]
+        elif content:
+            entries = [_Entry(start, start, role, content, message_id, 0, final)]
+        else:
+            entries = []
+
+        self._messages[message_id] = entries
+        for entry in entries:
+            self._entries.add(entry)
+            self._touch(entry.key)
+
+    def _touch(self, key: tuple) -> None:
+        if self._dirty is None or key < self._dirty:
+            self._dirty = key
+        if self._dirty_high is None or key > self._dirty_high:
+            self._dirty_high = key
+
+    def refresh(self) -> int:
+        """
+            Re-groups the turns affected by the updates since the last call.
+            Returns the index of the first turn that may have changed (len(turns) if none did)
+        """
+        if self._dirty is None:
+            return len(self.turns)
+        low, high = self._dirty, self._dirty_high
+        self._dirty = self._dirty_high = None
+
+        # A turn boundary only depends on the two entries around it, so only the turns the changed keys
+        #   fall into are grouped again: the one `low` falls into keeps its entries before it,
+        #   the ones after the one `high` falls into are kept whole
+        i = bisect_right(self._turn_keys, low) - 1
+        end = bisect_right(self._turn_keys, high)
+        keep = 0
+        # Whether the turn before the regrouped ones lost or gained entries
+        continued = False
+        if i >= 0:
+            entries = self.turns[i].entries
+            cut = bisect_left(entries, low, key=_key)
+            continued = 0 < cut < len(entries)
+            del entries[cut:]
+            keep = i + 1 if entries else i
+        bound = self._turn_keys[end] if end < len(self.turns) else None
+
+        regrouped = []
+        for entry in self._entries.iter_from(low):
+            if bound is not None and entry.key >= bound:
+                break
+            _group((entry,), regrouped)
+
+        # Stitch the regrouped turns to their neighbours when the speaker is the same on both sides
+        before = self.turns[keep - 1] if keep else None
+        if before is not None and regrouped and regrouped[0].role is before.role:
+            before.entries.extend(regrouped.pop(0).entries)
+            continued = True
+        last = regrouped[-1] if regrouped else before
+        if last is not None and end < len(self.turns) and self.turns[end].role is last.role:
+            last.entries.extend(self.turns[end].entries)
+            end += 1
+            continued = continued or last is before
+
+        self.turns[keep:end] = regrouped
+        self._turn_keys[keep:end] = [turn.key for turn in regrouped]
+        return keep - 1 if continued else keep
+
+    def turn_of(self, message_id: int) -> int:
+        """
+            Index of the turn the message starts in (None if the message has no words)
+        """
+        entries = self._messages.get(message_id)
+        if not entries:
+            return None
+        self.refresh()
+        return max(0, bisect_right(self._turn_keys, entries[0].key) - 1)
+
+    def started_at(self, message_id: int) -> float:
+        return self._starts.get(message_id)
+
+    def span(self, message_id: int) -> tuple[float, float]:
+        """
+            When the message started and ended (both its start if it has no words yet)
+        """
+        entries = self._messages.get(message_id)
+        if not entries:
+            start = self._starts[message_id]
+            return start, start
+        return entries[0].start, max(entry.end for entry in entries)
+
+    def select(self, realtime: bool = True, since: float = None, until: float = None) -> list[Turn]:
+        """
+            The turns of the words that started between `since` and `until` (both included, None: no limit),
+            grouped on their own. `realtime=False` leaves out the phrases that are still being transcribed
+        """
+        entries = self._entries.iter_from((since,) if since is not None else None)
+        if until is not None:
+            entries = takewhile(lambda entry: entry.key[0] <= until, entries)
+        if not realtime:
+            entries = (entry for entry in entries if entry.final)
+        return _group(entries)
+
+    def as_messages(self, realtime: bool = True, until: float = None) -> list[dict]:
+        """
+            The merged dialogue in the LLM provider format. `realtime=False` leaves out the phrases that are
+            still being transcribed, `until` whatever started after that time
+        """
+        if realtime and until is None:
+            self.refresh()
+            return [turn.as_message() for turn in self.turns]
+        return [turn.as_message() for turn in self.select(realtime, until=until)]
@@ -0,0 +1,150 @@
+from queue import Queue, Full
+from threading import Event
+from os import path
+import json
+
+from chat_history import MESSAGE_TYPE, ROLE
+import latency
+
+# Shared by the live app and the offline replay.
+#   RealTimeSST requires specifically 16khz sound
+TARGET_RATE = 16000
+
+VOICETOTEXT_MODEL_REALTIME = 'tiny'
+VOICETOTEXT_MODEL = 'base'
+VOICETOTEXT_LANGUAGE = 'en'
+
+# Load the final and realtime models once and share them between the mic and speaker recorders
+#   (see shared_engine.py) instead of loading both models in each recorder
+SHARE_TRANSCRIPTION_MODELS = True
+# Adapt the pause between realtime transcription passes to the load (see scheduler.py).
+#   recorder_config's realtime_processing_pause is where it starts from
+ADAPTIVE_REALTIME_PAUSE = True
+# Ask the final transcription for word timestamps, so overlapping speech of the two people is merged
+#   word by word (see timeline.py) rather than one whole phrase after the other
+WORD_TIMESTAMPS = True
+
+# Written by calibrate.py: the models and settings measured to keep up in real time on this machine.
+#   When it exists, its values replace the ones in recorder_config below
+STT_CONFIG_FILE = 'stt_config.json'
+CALIBRATED_KEYS = ('device', 'compute_type', 'model', 'beam_size', 'batch_size',
+                   'realtime_model_type', 'beam_size_realtime', 'realtime_batch_size', 'realtime_processing_pause')
+
+# The transcription -> UI queue is bounded. FINAL messages wait for room (backpressure on the
+#   recorder's polling thread), REALTIME ones are dropped when it's full as a newer one will follow anyway
+MESSAGE_QUEUE_SIZE = 256
+
+# Configuration for RealTimeSST
+recorder_config = {
+    'spinner': False,
+    'model': VOICETOTEXT_MODEL, # or large-v2 or deepdml/faster-whisper-large-v3-turbo-ct2 or ...
+    'download_root': '.', # default download root location. Ex. ~/.cache/huggingface/hub/ in Linux
+    'realtime_model_type': VOICETOTEXT_MODEL_REALTIME, # or small.en or distil-small.en or ...
+    'language': VOICETOTEXT_LANGUAGE,
+    'silero_sensitivity': 0.05,
+    'webrtc_sensitivity': 3,
+    'post_speech_silence_duration': 1,
+    'min_length_of_recording': 1.1,        
+    'min_gap_between_recordings': 0,                
+    'enable_realtime_transcription': True,
+    'realtime_processing_pause': 1,
+    'silero_deactivity_detection': True,
+    'early_transcription_on_silence': 0,
+    'beam_size': 5,
+    'beam_size_realtime': 3,
+    'batch_size': 0,
+    'realtime_batch_size': 0,        
+    'no_log_file': True,
+    'initial_prompt_realtime': (
+        "End incomplete sentences with ellipses.\n"
+        "Examples:\n"
+        "Complete: The sky is blue.\n"
+        "Incomplete: When the sky...\n"
+        "Complete: She walked home.\n"
+        "Incomplete: Because he...\n"
+    ),
+    'silero_use_onnx': True,
+    'use_microphone': False,
+    'faster_whisper_vad_filter': False,
+    'final_transcription_word_timestamps': WORD_TIMESTAMPS,
+    # 'level': logging.DEBUG
+}
+
+
+def load_calibration(file_path: str = STT_CONFIG_FILE) -> dict:
+    if not path.isfile(file_path):
+        return {}
+    with open(file_path, 'r', encoding='utf-8') as cf:
+        calibration = json.load(cf)
+    return {key: calibration[key] for key in CALIBRATED_KEYS if key in calibration}
+
+
+recorder_config.update(load_calibration())
+
+# Silence fed to the speaker recorder when the loopback stream goes quiet after speech:
+#   the recorder's post speech silence plus a margin for its VAD to notice it
+END_OF_UTTERANCE_SILENCE = recorder_config['post_speech_silence_duration'] + 0.3
+
+
+def make_recorder_config(on_realtime_transcription, shared_engine=None, **overrides) -> dict:
+    """
+        recorder_config for one recorder: its realtime callback, the shared models (if any) and `overrides`
+    """
+    config = recorder_config.copy()
+    config['on_realtime_transcription_stabilized'] = on_realtime_transcription
+    if shared_engine is not None:
+        config.update(shared_engine.recorder_options())
+    config.update(overrides)
+    return config
+
+
+def realtime_transcription(text: str, role: ROLE, message_queue: Queue, started_at: float = None):
+    """
+        `started_at` is when the recording of the phrase started (the recorder's recording_start_time)
+    """
+    message = {
+        "role": role, 
+        "transcription_type": MESSAGE_TYPE.REALTIME, 
+        "content": text,
+        "started_at": started_at or None,
+    }
+    latency.stamp(message, role, 'realtime')
+    latency.mark(message, 'enqueue')
+    try:
+        message_queue.put_nowait(message)
+    except Full:
+        pass
+
+
+def recorded_words(r) -> list[tuple]:
+    """
+        The (start, end, word) of the recorder's last final transcription in time.time() seconds, None without them.
+        Whisper's timestamps count from the start of the transcribed audio, which begins with the pre-recording buffer
+    """
+    words = (getattr(r, 'last_transcription_metadata', None) or {}).get('words')
+    if not words or not r.last_recording_start_time:
+        return None
+    audio_start = r.last_recording_start_time - recorder_config.get('pre_recording_buffer_duration', 1.0)
+    return [(audio_start + word['start'], audio_start + word['end'], word['word']) for word in words]
+
+
+def poll_recorder(r, role: ROLE, message_queue: Queue, stop: Event = None):
+    """
+        Polls a RealTimeSST recorder for new (final, non-realtime) messages
+        and puts them into the queue on behalf of `role`, until `stop` is set (if given)
+    """
+    while stop is None or not stop.is_set():
+        text = r.text()
+        if stop is not None and stop.is_set():
+            # The recorder was shut down, whatever it returned isn't a phrase
+            return
+        message = {
+            "role": role, 
+            "transcription_type": MESSAGE_TYPE.FINAL, 
+            "content": text,
+            "words": recorded_words(r),
+        }
+        latency.stamp(message, role, 'final')
+        # Marked before the (possibly blocking) put, waiting for room in the queue counts as enqueue -> history
+        latency.mark(message, 'enqueue')
+        message_queue.put(message)